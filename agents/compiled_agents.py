@@ -1,5 +1,7 @@
+import os
+import time
 import logging
-from langchain_ollama import ChatOllama
+from difflib import SequenceMatcher
 from langchain_core.messages import (
     HumanMessage,
     SystemMessage,
@@ -7,37 +9,102 @@ from langchain_core.messages import (
     ChatMessage,
     AnyMessage,
 )
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langgraph.graph import StateGraph, END
 from langgraph.types import Command
 
 # from langgraph.checkpoint.memory import InMemorySaver
-from langgraph.checkpoint.sqlite import SqliteSaver
-import sqlite3
-
-from tools.search_tools import arxiv_search, search_web, load_pdf
-from tools.semantic_retrieval import semantic_retrieval
+import asyncio
+import threading
+
+from tools.search_tools import (
+    arxiv_search,
+    search_web,
+    load_pdf,
+    host_limiter,
+    TAVILY_HOST,
+)
+from tools.semantic_retrieval import vector_search
 import utils.prompts as prompts
 from agents import states
+from agents.local_router import get_local_router
+from utils.checkpoints import (
+    PooledSqliteSaver,
+    PooledAsyncSqliteSaver,
+    checkpoint_path,
+    get_checkpoint_janitor,
+)
+from utils.blob_store import get_blob_store
+from utils.concurrency import fan_out, afan_out
+from utils.config import get_section
+from utils.llm_cache import cached_llm
+from utils.llm_scheduler import chat_model, scheduled_llm
+from utils.context_packer import (
+    count_tokens,
+    pack_context,
+    split_passages,
+    split_sections,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def _node(func, afunc):
+    """
+    Register a node with both a sync and an async implementation, so the same
+    graph can be driven by `invoke` and by `ainvoke` without blocking the loop.
+    """
+    return RunnableLambda(func, afunc=afunc, name=func.__name__)
+
+
 # ====================== Search/Retrieval Agent =======================
 class SearchAgent:  # subGraph
     def __init__(self, llm):
         self.llm = llm  # the llm is defined once in the main graph.
+        # routing and query planning answer from the LLM cache when enabled.
+        self.router_llm = cached_llm(scheduled_llm(llm, "router"), "search_router")
+        self.query_llm = cached_llm(scheduled_llm(llm, "structured"), "query")
+        self.local_router = get_local_router()
         self.web_search_function = search_web
-        self.semantic_retrieval_function = semantic_retrieval
+        # a tool, so retrieval shows up in the metrics, traces and recordings.
+        self.vector_search_function = vector_search
+        # search hits are kept out of the checkpoints, the state holds a handle.
+        self.blob_store = get_blob_store()
         # tools = [self.web_search, self.semantic_retrieval]
+        web_search_config = get_section("web_search")
+        self.query_timeout = float(web_search_config.get("query_timeout", 15))
+        self.max_concurrency = int(
+            web_search_config.get("max_concurrency_per_host", 4)
+        )
+        budget_config = get_section("context_budget")
+        self.context_budget = int(budget_config.get("generator", 3000))
+        self.dedup_threshold = float(budget_config.get("dedup_threshold", 0.8))
 
         build_search = StateGraph(states.SearchState)
-        build_search.add_node("router", self.search_router)
-        build_search.add_node("web_search", self.web_search_node)
-        build_search.add_node("semantic_retrieval", self.semantic_retrieval_node)
-        build_search.add_node("generator", self.generator_node)
+        build_search.add_node(
+            "router", _node(self.search_router, self.asearch_router)
+        )
+        build_search.add_node(
+            "web_search", _node(self.web_search_node, self.aweb_search_node)
+        )
+        build_search.add_node(
+            "semantic_retrieval",
+            _node(self.semantic_retrieval_node, self.asemantic_retrieval_node),
+        )
+        build_search.add_node(
+            "generator", _node(self.generator_node, self.agenerator_node)
+        )
 
-        build_search.set_entry_point("router")
+        # a fused plan from the main router already picked the sub-route.
+        build_search.set_conditional_entry_point(
+            self.entry,
+            {
+                "router": "router",
+                "web_search": "web_search",
+                "vector_store": "semantic_retrieval",
+            },
+        )
         build_search.add_conditional_edges(
             "router",
             self.decision,
@@ -52,37 +119,80 @@ class SearchAgent:  # subGraph
         build_search.add_edge("semantic_retrieval", "generator")
         build_search.add_edge("generator", END)
 
-        self.search_agent = build_search.compile()
+        self.search_agent = build_search.compile(name="SearchAgent")
 
-    def search_router(self, state: states.SearchState):
-        messages = [
+    def _router_messages(self, state: states.SearchState):
+        return [
             SystemMessage(content=prompts.SEARCH_ROUTER_PROMPT),
             HumanMessage(content=state["task"]),
         ]
-        response = self.llm.with_structured_output(states.SearchRouter).invoke(messages)
 
+    def _router_update(self, state: states.SearchState, response):
         return {
             "node_name": "router",
             "next_node": response.next_node,
             "task": state.get("task", ""),
         }
 
+    def search_router(self, state: states.SearchState):
+        # the local router answers confident cases, the LLM the rest.
+        label = self.local_router.route("search", state["task"])
+        if label:
+            return self._router_update(state, states.SearchRouter(next_node=label))
+
+        messages = self._router_messages(state)
+        response = self.router_llm.with_structured_output(
+            states.SearchRouter
+        ).invoke(messages)
+        self.local_router.record("search", state["task"], response.next_node, "llm")
+        return self._router_update(state, response)
+
+    async def asearch_router(self, state: states.SearchState):
+        label = await self.local_router.aroute("search", state["task"])
+        if label:
+            return self._router_update(state, states.SearchRouter(next_node=label))
+
+        messages = self._router_messages(state)
+        response = await self.router_llm.with_structured_output(
+            states.SearchRouter
+        ).ainvoke(messages)
+        await self.local_router.arecord(
+            "search", state["task"], response.next_node, "llm"
+        )
+        return self._router_update(state, response)
+
+    def entry(self, state: states.SearchState):
+        return (state.get("plan") or {}).get("sub_route") or "router"
+
     def decision(self, state: states.SearchState):
         return state.get("next_node", "web_search")
 
-    def web_search_node(self, state: states.SearchState):
-        messages = [
+    def _planned_query(self, state: states.SearchState):
+        plan = state.get("plan") or {}
+        if not plan.get("queries"):
+            return None
+        return states.Query(
+            query=plan["queries"], max_results=plan.get("max_results", 3)
+        )
+
+    def _query_messages(self, state: states.SearchState):
+        return [
             SystemMessage(content=prompts.SEARCH_PROMPT),
             HumanMessage(content=state.get("task", "")),
         ]
-        search_queries = self.llm.with_structured_output(states.Query).invoke(messages)
 
+    def _web_search_update(self, state: states.SearchState, responses):
+        # responses follow the query order, failed queries are None.
         search_results = []
-        for q in search_queries.query:
-            response = self.web_search_function.invoke(
-                q, max_results=search_queries.max_results
-            )
-            for item in response:
+        seen_urls = set()
+        for response in responses:
+            for item in response or []:
+                if "ERROR" in item:
+                    logger.warning(f"Web search failed: {item['ERROR']}")
+                    continue
+                if item["url"] in seen_urls:
+                    continue
+                seen_urls.add(item["url"])
                 search_results.append(
                     {
                         "type": "web_search",
@@ -94,22 +204,50 @@ class SearchAgent:  # subGraph
 
         return {
             "node_name": "web_search",
-            "retrieved_content": search_results,
+            "retrieved_content": self.blob_store.put(search_results),
             "task": state.get("task", ""),
         }
 
-    def semantic_retrieval_node(self, state: states.SearchState):
-        messages = [
-            SystemMessage(content=prompts.SEARCH_PROMPT),
-            HumanMessage(content=state.get("task", "")),
-        ]
-        queries = self.llm.with_structured_output(states.Query).invoke(messages)
+    def web_search_node(self, state: states.SearchState):
+        search_queries = self._planned_query(state)
+        if search_queries is None:
+            messages = self._query_messages(state)
+            search_queries = self.query_llm.with_structured_output(
+                states.Query
+            ).invoke(messages)
+
+        responses = fan_out(
+            lambda q: self.web_search_function.invoke(
+                {"query": q, "max_results": search_queries.max_results}
+            ),
+            search_queries.query,
+            host_limiter.sync_semaphore(TAVILY_HOST),
+            timeout=self.query_timeout,
+            max_workers=self.max_concurrency,
+        )
+        return self._web_search_update(state, responses)
+
+    async def aweb_search_node(self, state: states.SearchState):
+        search_queries = self._planned_query(state)
+        if search_queries is None:
+            messages = self._query_messages(state)
+            search_queries = await self.query_llm.with_structured_output(
+                states.Query
+            ).ainvoke(messages)
+
+        responses = await afan_out(
+            lambda q: self.web_search_function.ainvoke(
+                {"query": q, "max_results": search_queries.max_results}
+            ),
+            search_queries.query,
+            host_limiter.async_semaphore(TAVILY_HOST),
+            timeout=self.query_timeout,
+        )
+        return self._web_search_update(state, responses)
 
+    def _semantic_retrieval_update(self, state: states.SearchState, responses):
         retrieved_content = []
-        for q in queries.query:
-            response = self.semantic_retrieval_function.invoke(
-                q, max_results=queries.max_results
-            )
+        for response in responses:
             for item in response:
                 retrieved_content.append(
                     {
@@ -120,20 +258,54 @@ class SearchAgent:  # subGraph
 
         return {
             "node_name": "semantic_retrieval",
-            "retrieved_content": retrieved_content,
+            "retrieved_content": self.blob_store.put(retrieved_content),
             "task": state.get("task", ""),
         }
 
-    def generator_node(self, state: states.SearchState):
+    def semantic_retrieval_node(self, state: states.SearchState):
+        queries = self._planned_query(state)
+        if queries is None:
+            messages = self._query_messages(state)
+            queries = self.query_llm.with_structured_output(states.Query).invoke(
+                messages
+            )
+
+        responses = self.vector_search_function.invoke({"queries": queries.query})
+        return self._semantic_retrieval_update(state, responses)
+
+    async def asemantic_retrieval_node(self, state: states.SearchState):
+        queries = self._planned_query(state)
+        if queries is None:
+            messages = self._query_messages(state)
+            queries = await self.query_llm.with_structured_output(
+                states.Query
+            ).ainvoke(messages)
+
+        responses = await self.vector_search_function.ainvoke(
+            {"queries": queries.query}
+        )
+        return self._semantic_retrieval_update(state, responses)
+
+    def _generator_messages(self, state: states.SearchState):
         formatted_retrieved_content = []
-        for item in state["retrieved_content"]:
+        for item in self.blob_store.resolve(state["retrieved_content"], []):
             if item["type"] == "web_search":
                 formatted = f'title: {item["title"]}\nurl: {item["url"]}\ncontent: {item["content"]}'
             else:  # semantic
                 formatted = f'content: {item["content"]}'
             formatted_retrieved_content.append(formatted)
 
-        formatted_content_string = "\n\n".join(formatted_retrieved_content)
+        # most relevant first, near-duplicates and overflow are left out.
+        kept, stats = pack_context(
+            state.get("task", ""),
+            formatted_retrieved_content,
+            self.context_budget,
+            self.dedup_threshold,
+        )
+        logger.info(f"generator context: {stats.as_dict()}")
+        formatted_content_string = "\n\n".join(
+            formatted_retrieved_content[i] for i in kept
+        )
 
         messages = [
             SystemMessage(content=prompts.GENERATOR_PROMPT),
@@ -141,27 +313,62 @@ class SearchAgent:  # subGraph
                 content=f'{state.get("task", "")}\n\n{formatted_content_string}'
             ),
         ]
-        response = self.llm.invoke(messages)
+        return messages, stats.as_dict()
 
+    def _generator_update(self, state: states.SearchState, response, stats):
         return {
             "node_name": "generator",
             "content": [response.content],
             "task": state.get("task", ""),
             "retrieved_content": state.get("retrieved_content", []),
+            "context_stats": stats,
         }
 
+    def generator_node(self, state: states.SearchState):
+        messages, stats = self._generator_messages(state)
+        response = self.llm.invoke(messages)
+        return self._generator_update(state, response, stats)
+
+    async def agenerator_node(self, state: states.SearchState):
+        # blob reads and context packing block, keep them off the loop.
+        messages, stats = await asyncio.to_thread(self._generator_messages, state)
+        response = await self.llm.ainvoke(messages)
+        return self._generator_update(state, response, stats)
+
 
 # ====================== Deep Analysis Agent ========================
 class DeepAnalysisAgent:
     def __init__(self, llm):
         self.llm = llm
+        self.metadata_llm = cached_llm(
+            scheduled_llm(llm, "structured"), "paper_metadata"
+        )
         self.search_arxiv = arxiv_search
         self.load_pdf_function = load_pdf
+        self.blob_store = get_blob_store()
+        budget_config = get_section("context_budget")
+        self.context_budget = int(budget_config.get("analyze", 6000))
+        self.passage_tokens = int(budget_config.get("passage_tokens", 256))
+        self.dedup_threshold = float(budget_config.get("dedup_threshold", 0.8))
+        analysis_config = get_section("deep_analysis")
+        self.map_reduce_threshold = int(
+            analysis_config.get("map_reduce_threshold", 12000)
+        )
+        self.chunk_tokens = int(analysis_config.get("chunk_tokens", 2048))
+        self.map_concurrency = int(analysis_config.get("max_concurrency", 4))
+        self.map_timeout = float(analysis_config.get("chunk_timeout", 180))
+        # partial results are not streamed to clients, only the reduce step is.
+        self.map_llm = scheduled_llm(llm, "bulk").with_config(tags=["nostream"])
 
         build_analysis = StateGraph(states.DeepAnalysisState)
-        build_analysis.add_node("paper_metadata", self.paper_metadata_node)
-        build_analysis.add_node("fetch_url", self.fetch_url_node)
-        build_analysis.add_node("analyze", self.analyze_node)
+        build_analysis.add_node(
+            "paper_metadata",
+            _node(self.paper_metadata_node, self.apaper_metadata_node),
+        )
+        build_analysis.add_node(
+            "fetch_url", _node(self.fetch_url_node, self.afetch_url_node)
+        )
+        build_analysis.add_node("analyze", _node(self.analyze_node, self.aanalyze_node))
 
         build_analysis.set_entry_point("paper_metadata")
 
@@ -174,7 +381,7 @@ class DeepAnalysisAgent:
         # build_analysis.add_edge("paper_metadata", "analyze")   #redundant
         build_analysis.add_edge("analyze", END)
 
-        self.deep_analysis_agent = build_analysis.compile()
+        self.deep_analysis_agent = build_analysis.compile(name="DeepAnalysisAgent")
 
     def decision(self, state: states.DeepAnalysisState):
         if state.get("paper_url", ""):
@@ -182,13 +389,13 @@ class DeepAnalysisAgent:
         else:
             return "fetch_url"
 
-    def paper_metadata_node(self, state: states.DeepAnalysisState) -> Command:
-        messages = [
+    def _metadata_messages(self, state: states.DeepAnalysisState):
+        return [
             SystemMessage(content=prompts.PAPER_FETCHING_PROMPT),
             HumanMessage(content=state.get("task", "")),
         ]
-        response = self.llm.with_structured_output(states.MetaData).invoke(messages)
 
+    def _metadata_command(self, state: states.DeepAnalysisState, response) -> Command:
         next_node = "analyze" if response.paper_url else "fetch_url"
         return Command(
             goto=next_node,
@@ -201,9 +408,21 @@ class DeepAnalysisAgent:
             },
         )
 
-    def fetch_url_node(self, state: states.DeepAnalysisState):
-        query = state.get("paper_name", "") or state.get("task", "")
-        url = self.search_arxiv.invoke(query, max_results=1)
+    def paper_metadata_node(self, state: states.DeepAnalysisState) -> Command:
+        messages = self._metadata_messages(state)
+        response = self.metadata_llm.with_structured_output(states.MetaData).invoke(
+            messages
+        )
+        return self._metadata_command(state, response)
+
+    async def apaper_metadata_node(self, state: states.DeepAnalysisState) -> Command:
+        messages = self._metadata_messages(state)
+        response = await self.metadata_llm.with_structured_output(
+            states.MetaData
+        ).ainvoke(messages)
+        return self._metadata_command(state, response)
+
+    def _fetch_url_update(self, state: states.DeepAnalysisState, url):
         return {
             "node_name": "fetch_url",
             "paper_url": url[0]["PDF_URL"],
@@ -215,111 +434,388 @@ class DeepAnalysisAgent:
             "task": state.get("task", ""),
         }
 
-    def analyze_node(self, state: states.DeepAnalysisState):
-        try:
-            pdf = self.load_pdf_function.invoke(state.get("paper_url", ""))
-        except Exception as e:
-            logger.warning(f"PDF load failed, continuing without full paper: {e}")
-            pdf = ""
+    def fetch_url_node(self, state: states.DeepAnalysisState):
+        query = state.get("paper_name", "") or state.get("task", "")
+        url = self.search_arxiv.invoke(query, max_results=1)
+        return self._fetch_url_update(state, url)
+
+    async def afetch_url_node(self, state: states.DeepAnalysisState):
+        query = state.get("paper_name", "") or state.get("task", "")
+        url = await self.search_arxiv.ainvoke(query, max_results=1)
+        return self._fetch_url_update(state, url)
+
+    def _analyze_messages(self, state: states.DeepAnalysisState, pdf: str):
+        # papers rarely fit the context window: keep the passages most relevant
+        # to the task, in reading order.
+        passages = split_passages(pdf, self.passage_tokens)
+        kept, stats = pack_context(
+            state.get("task", ""),
+            passages,
+            self.context_budget,
+            self.dedup_threshold,
+            keep_order=True,
+        )
+        stats = {**stats.as_dict(), "mode": "single"}
+        logger.info(f"analyze context: {stats}")
+        paper = "\n\n".join(passages[i] for i in kept)
 
         messages = [
             SystemMessage(content=prompts.DEEP_ANALYSIS_PROMPT),
-            HumanMessage(content=f"{state.get('task','')} {pdf}"),
+            HumanMessage(content=f"{state.get('task','')} {paper}"),
         ]
-        response = self.llm.invoke(messages)
+        return messages, stats
+
+    def _analyze_update(
+        self, state: states.DeepAnalysisState, pdf: str, response, stats
+    ):
         return {
             "node_name": "analyze",
-            "full_paper": pdf,
+            "full_paper": self.blob_store.put(pdf),
             "content": [str(response.content)],
             "task": state.get("task", ""),
+            "context_stats": stats,
         }
 
+    # ---------------- map-reduce mode ( long papers ) ----------------
+    def _use_map_reduce(self, state: states.DeepAnalysisState, pdf: str) -> bool:
+        mode = state.get("analysis_mode") or "auto"
+        if mode == "auto":
+            return count_tokens(pdf) > self.map_reduce_threshold
+        return mode == "map_reduce"
+
+    def _map_messages(self, state: states.DeepAnalysisState, chunk: str):
+        return [
+            SystemMessage(content=prompts.PAPER_CHUNK_PROMPT),
+            HumanMessage(content=f"{state.get('task','')}\n\n{chunk}"),
+        ]
+
+    def _reduce_messages(self, state: states.DeepAnalysisState, chunks, notes):
+        notes = [note for note in notes if note]
+        kept, stats = pack_context(
+            state.get("task", ""),
+            notes,
+            self.context_budget,
+            self.dedup_threshold,
+            keep_order=True,
+        )
+        stats = {
+            **stats.as_dict(),
+            "mode": "map_reduce",
+            "chunks": len(chunks),
+            "chunks_failed": len(chunks) - len(notes),
+        }
+        logger.info(f"analyze context: {stats}")
+        joined_notes = "\n\n".join(notes[i] for i in kept)
+
+        messages = [
+            SystemMessage(content=prompts.PAPER_REDUCE_PROMPT),
+            HumanMessage(content=f"{state.get('task','')}\n\n{joined_notes}"),
+        ]
+        return messages, stats
+
+    def _map_reduce_messages(self, state: states.DeepAnalysisState, pdf: str):
+        chunks = split_sections(pdf, self.chunk_tokens)
+        # indices, so a failed chunk is logged by position and not by content.
+        notes = fan_out(
+            lambda i: self.map_llm.invoke(self._map_messages(state, chunks[i])).content,
+            list(range(len(chunks))),
+            threading.BoundedSemaphore(self.map_concurrency),
+            timeout=self.map_timeout,
+            max_workers=self.map_concurrency,
+        )
+        return self._reduce_messages(state, chunks, notes)
+
+    async def _amap_reduce_messages(self, state: states.DeepAnalysisState, pdf: str):
+        chunks = await asyncio.to_thread(split_sections, pdf, self.chunk_tokens)
+
+        async def summarize(i):
+            response = await self.map_llm.ainvoke(self._map_messages(state, chunks[i]))
+            return response.content
+
+        notes = await afan_out(
+            summarize,
+            list(range(len(chunks))),
+            asyncio.Semaphore(self.map_concurrency),
+            timeout=self.map_timeout,
+        )
+        return await asyncio.to_thread(self._reduce_messages, state, chunks, notes)
+
+    def analyze_node(self, state: states.DeepAnalysisState):
+        try:
+            pdf = self.load_pdf_function.invoke(state.get("paper_url", ""))
+        except Exception as e:
+            logger.warning(f"PDF load failed, continuing without full paper: {e}")
+            pdf = ""
+
+        if self._use_map_reduce(state, pdf):
+            messages, stats = self._map_reduce_messages(state, pdf)
+        else:
+            messages, stats = self._analyze_messages(state, pdf)
+        response = self.llm.invoke(messages)
+        return self._analyze_update(state, pdf, response, stats)
+
+    async def aanalyze_node(self, state: states.DeepAnalysisState):
+        try:
+            pdf = await self.load_pdf_function.ainvoke(state.get("paper_url", ""))
+        except Exception as e:
+            logger.warning(f"PDF load failed, continuing without full paper: {e}")
+            pdf = ""
+
+        # tokenizing / packing a full paper and storing it are CPU and disk
+        # bound, keep them off the loop.
+        if await asyncio.to_thread(self._use_map_reduce, state, pdf):
+            messages, stats = await self._amap_reduce_messages(state, pdf)
+        else:
+            messages, stats = await asyncio.to_thread(
+                self._analyze_messages, state, pdf
+            )
+        response = await self.llm.ainvoke(messages)
+        return await asyncio.to_thread(
+            self._analyze_update, state, pdf, response, stats
+        )
+
 
 # ==================== Generator/Reflect Agent ========================
 class ImproverAgent:
+    """
+    Reflect / improve loop with early stopping: it ends when the critique
+    accepts the draft, when an improved draft barely differs from the previous
+    one, when the request deadline leaves no time for another round, or at
+    `max_revisions` as before.
+    """
+
     def __init__(self, llm):
         self.llm = llm
+        self.reflect_llm = scheduled_llm(llm, "structured")
+        config = get_section("improver")
+        self.early_stopping = bool(config.get("early_stopping", True))
+        self.accept_score = float(config.get("accept_score", 0.8))
+        self.min_change = float(config.get("min_change", 0.05))
+        # running estimate of each node's duration, for the latency budget,
+        # updated by concurrent runs (sync threads and the event loop).
+        self._node_lock = threading.Lock()
+        self._node_seconds = {
+            "reflect": float(config.get("reflect_seconds", 20)),
+            "improver": float(config.get("improver_seconds", 40)),
+        }
 
         build_improver = StateGraph(states.ImproverState)
-        build_improver.add_node("reflect", self.reflect_node)
-        build_improver.add_node("improver", self.improver_node)
+        build_improver.add_node("start", self.start_node)
+        build_improver.add_node("reflect", _node(self.reflect_node, self.areflect_node))
+        build_improver.add_node(
+            "improver", _node(self.improver_node, self.aimprover_node)
+        )
         build_improver.add_node("final", self.final_output_node)
 
-        build_improver.set_entry_point("reflect")
+        build_improver.set_entry_point("start")
+        build_improver.add_conditional_edges(
+            "start", self.entry, {"reflect": "reflect", "final": "final"}
+        )
+        build_improver.add_conditional_edges(
+            "reflect",
+            self.after_reflect,
+            {"improver": "improver", "final": "final"},
+        )
         build_improver.add_conditional_edges(
             "improver",
             self.decision,
             {"reflect": "reflect", "final": "final"},
         )
 
-        build_improver.add_edge("reflect", "improver")
         build_improver.add_edge("final", END)
 
-        self.improver_agent = build_improver.compile()
+        self.improver_agent = build_improver.compile(name="ImproverAgent")
 
-    def reflect_node(self, state: states.ImproverState):
-        messages = [
+    def _observe(self, node: str, seconds: float):
+        with self._node_lock:
+            self._node_seconds[node] = (
+                0.7 * self._node_seconds[node] + 0.3 * seconds
+            )
+
+    def _estimate(self, *nodes: str) -> float:
+        with self._node_lock:
+            return sum(self._node_seconds[node] for node in nodes)
+
+    def _reflect_messages(self, state: states.ImproverState):
+        return [
             SystemMessage(content=prompts.REFLECTION_PROMPT),
             HumanMessage(content="\n".join(state.get("content", ""))),
         ]
-        response = self.llm.invoke(messages)
-        return {
+
+    def _reflect_update(self, state: states.ImproverState, response):
+        update = {
             "node_name": "reflect",
-            "reflection": str(response.content),
+            "reflection": response.critique,
+            "score": response.score,
+            "verdict": response.verdict,
             "content": state.get("content", ""),
             "revision_number": state.get("revision_number", 1) + 1,
             "count": 1,
             "task": state.get("task", ""),
         }
+        update["stop_reason"] = self._stop_reason({**state, **update}, "reflect")
+        return update
 
-    def improver_node(self, state: states.ImproverState):
-        messages = [
+    def reflect_node(self, state: states.ImproverState):
+        started = time.perf_counter()
+        messages = self._reflect_messages(state)
+        try:
+            response = self.reflect_llm.with_structured_output(
+                states.Reflection
+            ).invoke(messages)
+        except Exception as e:
+            # no verdict, keep the critique as plain text and revise.
+            logger.warning(f"Structured reflection failed: {e}")
+            critique = self.reflect_llm.invoke(messages).content
+            response = states.Reflection(critique=str(critique))
+        self._observe("reflect", time.perf_counter() - started)
+        return self._reflect_update(state, response)
+
+    async def areflect_node(self, state: states.ImproverState):
+        started = time.perf_counter()
+        messages = self._reflect_messages(state)
+        try:
+            response = await self.reflect_llm.with_structured_output(
+                states.Reflection
+            ).ainvoke(messages)
+        except Exception as e:
+            logger.warning(f"Structured reflection failed: {e}")
+            critique = (await self.reflect_llm.ainvoke(messages)).content
+            response = states.Reflection(critique=str(critique))
+        self._observe("reflect", time.perf_counter() - started)
+        return self._reflect_update(state, response)
+
+    def _improver_messages(self, state: states.ImproverState):
+        return [
             SystemMessage(content=prompts.IMPROVER_PROMPT),
             HumanMessage(
-                content=f'{state.get("task", "")}\n\n{state.get('content',[])}\n\n here is the critique: {state.get("reflection", "")}'
+                content=f"{state.get('task', '')}\n\n{state.get('content', [])}\n\n here is the critique: {state.get('reflection', '')}"
             ),
         ]
-        response = self.llm.invoke(messages)
 
-        return {
-            "content": [str(response.content)],
+    def _improver_update(self, state: states.ImproverState, response):
+        previous = "\n".join(state.get("content", [])).split()
+        draft = str(response.content)
+        update = {
+            "content": [draft],
             "node_name": "improver",
             "revision_number": state.get("revision_number", 1) + 1,
+            "revisions": state.get("revisions", 0) + 1,
+            "draft_similarity": SequenceMatcher(None, previous, draft.split()).ratio(),
             "count": 1,
         }
+        update["stop_reason"] = self._stop_reason({**state, **update}, "improver")
+        return update
+
+    def improver_node(self, state: states.ImproverState):
+        started = time.perf_counter()
+        response = self.llm.invoke(self._improver_messages(state))
+        self._observe("improver", time.perf_counter() - started)
+        return self._improver_update(state, response)
+
+    async def aimprover_node(self, state: states.ImproverState):
+        started = time.perf_counter()
+        response = await self.llm.ainvoke(self._improver_messages(state))
+        self._observe("improver", time.perf_counter() - started)
+        return self._improver_update(state, response)
+
+    def _planned_revisions(self, state: states.ImproverState) -> int:
+        # improver runs of the fixed loop, each round adds 2 to revision_number.
+        return max(1, (state.get("max_revisions", 2) - 1) // 2 + 1)
+
+    def _stop_reason(self, state: states.ImproverState, after: str) -> str:
+        """
+        Why the loop stops after node `after` ("start" before the first
+        reflection), empty to keep going.
+        """
+        if self.early_stopping and after == "reflect":
+            if (
+                state.get("verdict") == "accept"
+                or state.get("score", 0.0) >= self.accept_score
+            ):
+                return "accepted"
+        if self.early_stopping and after == "improver":
+            if state.get("draft_similarity", 0.0) >= 1 - self.min_change:
+                return "converged"
+        if after == "improver" and state.get("revision_number", 1) > state.get(
+            "max_revisions", 2
+        ):
+            return "max_revisions"
+
+        deadline = state.get("deadline") or 0
+        if deadline:
+            if after == "reflect":
+                needed = self._estimate("improver")
+            else:
+                needed = self._estimate("reflect", "improver")
+            if time.time() + needed > deadline:
+                return "latency_budget"
+        return ""
+
+    def start_node(self, state: states.ImproverState):
+        # the reason is decided once by the node before each branch, kept in
+        # the state for the routing below and the final node.
+        return {"stop_reason": self._stop_reason(state, "start")}
 
     def final_output_node(self, state: states.ImproverState):
         output = state["content"]
+        planned = self._planned_revisions(state)
+        revisions = state.get("revisions", 0)
+        stop_reason = state.get("stop_reason") or "max_revisions"
+        logger.info(
+            f"improver stopped ({stop_reason}) after {revisions}/{planned} revisions"
+        )
 
         return {
             "node_name": "final",
             "final_output": output,
             "reflection": state.get("reflection", ""),
+            "stop_reason": stop_reason,
+            "revisions_saved": max(0, planned - revisions),
         }
 
+    def entry(self, state: states.ImproverState):
+        return "final" if state.get("stop_reason") else "reflect"
+
+    def after_reflect(self, state: states.ImproverState):
+        return "final" if state.get("stop_reason") else "improver"
+
     def decision(self, state: states.ImproverState):
-        return (
-            "final"
-            if state.get("revision_number", 1) > state.get("max_revisions", 2)
-            else "improver"
-        )
+        return "final" if state.get("stop_reason") else "reflect"
 
 
 # ========================== Analysis Agent ==========================
 class ResearchAssistant:
     def __init__(self):
-        self.llm = ChatOllama(model="llama3.1:8b-instruct-q4_K_M")
+        # calls are queued by priority behind a global in-flight limit.
+        self.llm = chat_model("llama3.1:8b-instruct-q4_K_M")
+        self.router_llm = cached_llm(scheduled_llm(self.llm, "router"), "main_router")
+        self.planner_llm = cached_llm(scheduled_llm(self.llm, "router"), "planner")
+        self.local_router = get_local_router()
+        self.blob_store = get_blob_store()
+        # one structured call for route, sub-route and queries.
+        self.fused_planner = get_section("planner").get("mode", "separate") == "fused"
 
         self.search_agent = SearchAgent(self.llm).search_agent
         self.deep_analysis_agent = DeepAnalysisAgent(self.llm).deep_analysis_agent
         self.improver_agent = ImproverAgent(self.llm).improver_agent
 
         main_builder = StateGraph(states.MainState)
-        main_builder.add_node("main_router", self.main_router_node)
-        main_builder.add_node("search_agent", self.search_agent_node)
-        main_builder.add_node("deep_analysis_agent", self.deep_analysis_agent_node)
-        main_builder.add_node("improver_agent", self.improver_agent_node)
-        main_builder.add_node("chat", self.chat_node)
+        main_builder.add_node(
+            "main_router", _node(self.main_router_node, self.amain_router_node)
+        )
+        main_builder.add_node(
+            "search_agent", _node(self.search_agent_node, self.asearch_agent_node)
+        )
+        main_builder.add_node(
+            "deep_analysis_agent",
+            _node(self.deep_analysis_agent_node, self.adeep_analysis_agent_node),
+        )
+        main_builder.add_node(
+            "improver_agent",
+            _node(self.improver_agent_node, self.aimprover_agent_node),
+        )
+        main_builder.add_node("chat", _node(self.chat_node, self.achat_node))
 
         main_builder.set_entry_point("main_router")
         main_builder.add_conditional_edges(
@@ -337,38 +833,162 @@ class ResearchAssistant:
         main_builder.add_edge("deep_analysis_agent", "improver_agent")
         main_builder.add_edge("chat", END)
         main_builder.add_edge("improver_agent", END)
+        self.main_builder = main_builder
 
-        conn = sqlite3.connect(
-            "checkpoints/checkpoints.sqlite", check_same_thread=False
+        checkpoints = get_section("checkpoints")
+        self.checkpoint_path = checkpoint_path()
+        self.checkpoint_readers = int(checkpoints.get("readers", 2))
+        memory = PooledSqliteSaver.from_path(
+            self.checkpoint_path, self.checkpoint_readers
         )
-        memory = SqliteSaver(conn)
-        compile_kwargs = {"checkpointer": memory}
+        compile_kwargs = {"checkpointer": memory, "name": "ResearchAssistant"}
 
         self.main_agent = main_builder.compile(**compile_kwargs)
-
-    def main_router_node(self, state: states.MainState):
-        messages = [
+        # keep_last / idle expiry / vacuum, in a background thread.
+        get_checkpoint_janitor().start()
+
+        # the async graph needs aiosqlite connections bound to the running
+        # loop, so it is compiled lazily on first use (see `get_async_agent`).
+        self.async_main_agent = None
+        self._async_saver = None
+        self._async_lock = asyncio.Lock()
+
+    async def get_async_agent(self):
+        """
+        Returns the main graph compiled with an async checkpointer, sharing the
+        same sqlite file as `main_agent` so threads can be resumed from either.
+        """
+        async with self._async_lock:
+            if self.async_main_agent is None:
+                self._async_saver = await PooledAsyncSqliteSaver.from_path(
+                    self.checkpoint_path, self.checkpoint_readers
+                )
+                self.async_main_agent = self.main_builder.compile(
+                    checkpointer=self._async_saver, name="ResearchAssistant"
+                )
+        return self.async_main_agent
+
+    async def aclose(self):
+        # aiosqlite runs its own (non daemon) threads, close them on shutdown.
+        async with self._async_lock:
+            if self._async_saver is not None:
+                await self._async_saver.aclose()
+            self._async_saver = None
+            self.async_main_agent = None
+
+    def _main_router_messages(self, state: states.MainState):
+        return [
             SystemMessage(content=prompts.MAIN_ROUTER_PROMPT),
             HumanMessage(
-                content=f'{state.get("task", "")}\n\nhere is the previous content: {state.get('content',[])}'
+                content=f"{state.get('task', '')}\n\nhere is the previous content: {state.get('content', [])}"
             ),
         ]
-        response = self.llm.with_structured_output(states.MainRouter).invoke(messages)
+
+    def _main_router_update(self, state: states.MainState, response):
         return {
             "node_name": "main_router",
             "next_node": response.next_node,
             "task": state.get("task", ""),
+            "plan": {},
+        }
+
+    def _planner_messages(self, state: states.MainState):
+        return [
+            SystemMessage(content=prompts.PLANNER_PROMPT),
+            self._main_router_messages(state)[1],
+        ]
+
+    def _plan_update(self, state: states.MainState, plan: states.Plan):
+        text = self._main_router_text(state)
+        self.local_router.record("main", text, plan.route, "llm")
+        if plan.route != "search_agent":
+            return self._main_router_update(
+                state, states.MainRouter(next_node=plan.route)
+            )
+
+        if plan.sub_route:
+            self.local_router.record(
+                "search", state.get("task", ""), plan.sub_route, "llm"
+            )
+        return {
+            "node_name": "main_router",
+            "next_node": plan.route,
+            "task": state.get("task", ""),
+            "plan": plan.model_dump(),
+        }
+
+    def _main_router_text(self, state: states.MainState) -> str:
+        # follow-ups on an existing thread are the ones that may go to chat.
+        task = state.get("task", "")
+        return f"follow-up: {task}" if state.get("content") else task
+
+    def main_router_node(self, state: states.MainState):
+        text = self._main_router_text(state)
+        label = self.local_router.route("main", text)
+        if label and not (self.fused_planner and label == "search_agent"):
+            return self._main_router_update(state, states.MainRouter(next_node=label))
+
+        if self.fused_planner:
+            plan = self.planner_llm.with_structured_output(states.Plan).invoke(
+                self._planner_messages(state)
+            )
+            return self._plan_update(state, plan)
+
+        messages = self._main_router_messages(state)
+        response = self.router_llm.with_structured_output(
+            states.MainRouter
+        ).invoke(messages)
+        self.local_router.record("main", text, response.next_node, "llm")
+        return self._main_router_update(state, response)
+
+    async def amain_router_node(self, state: states.MainState):
+        text = self._main_router_text(state)
+        label = await self.local_router.aroute("main", text)
+        if label and not (self.fused_planner and label == "search_agent"):
+            return self._main_router_update(state, states.MainRouter(next_node=label))
+
+        if self.fused_planner:
+            plan = await self.planner_llm.with_structured_output(states.Plan).ainvoke(
+                self._planner_messages(state)
+            )
+            # records the decisions, a file append.
+            return await asyncio.to_thread(self._plan_update, state, plan)
+
+        messages = self._main_router_messages(state)
+        response = await self.router_llm.with_structured_output(
+            states.MainRouter
+        ).ainvoke(messages)
+        await self.local_router.arecord("main", text, response.next_node, "llm")
+        return self._main_router_update(state, response)
+
+    def _search_agent_update(self, state: states.MainState, output):
+        return {
+            "search_state": output,
+            "retrieved_content": output.get("retrieved_content", []),
+            "content": output.get("content", []),
+            "task": state.get("task", ""),
         }
 
     def search_agent_node(self, state: states.MainState):
         # task = state.get("task", "")
         search_state = state["search_state"]
         search_state["task"] = state.get("task", "")
+        search_state["plan"] = state.get("plan") or {}
         output = self.search_agent.invoke(search_state)
+        return self._search_agent_update(state, output)
+
+    async def asearch_agent_node(
+        self, state: states.MainState, config: RunnableConfig
+    ):
+        search_state = state["search_state"]
+        search_state["task"] = state.get("task", "")
+        search_state["plan"] = state.get("plan") or {}
+        output = await self.search_agent.ainvoke(search_state, config)
+        return self._search_agent_update(state, output)
 
+    def _deep_analysis_agent_update(self, state: states.MainState, output):
         return {
-            "search_state": output,
-            "retrieved_content": output.get("retrieved_content", []),
+            "deep_analysis_state": output,
             "content": output.get("content", []),
             "task": state.get("task", ""),
         }
@@ -378,19 +998,17 @@ class ResearchAssistant:
         deep_analysis_state = state["deep_analysis_state"]
         deep_analysis_state["task"] = state.get("task", "")
         output = self.deep_analysis_agent.invoke(deep_analysis_state)
+        return self._deep_analysis_agent_update(state, output)
 
-        return {
-            "deep_analysis_state": output,
-            "content": output.get("content", []),
-            "task": state.get("task", ""),
-        }
-
-    def improver_agent_node(self, state: states.MainState):
-        improver_state = state["improver_state"]
-        improver_state["content"] = state["content"]
-        improver_state["task"] = state.get("task", "")
+    async def adeep_analysis_agent_node(
+        self, state: states.MainState, config: RunnableConfig
+    ):
+        deep_analysis_state = state["deep_analysis_state"]
+        deep_analysis_state["task"] = state.get("task", "")
+        output = await self.deep_analysis_agent.ainvoke(deep_analysis_state, config)
+        return self._deep_analysis_agent_update(state, output)
 
-        output = self.improver_agent.invoke(improver_state)
+    def _improver_agent_update(self, state: states.MainState, output):
         final_output = output.get("final_output", "")
 
         return {
@@ -400,14 +1018,44 @@ class ResearchAssistant:
             "task": state.get("task", ""),
         }
 
-    def chat_node(self, state: states.MainState):
-        messages = [
+    def _improver_input(self, state: states.MainState):
+        # the loop counters are per request.
+        return {
+            **state["improver_state"],
+            "content": state["content"],
+            "task": state.get("task", ""),
+            "node_name": "",
+            "revision_number": 1,
+            "revisions": 0,
+            "score": 0.0,
+            "verdict": "",
+            "draft_similarity": 0.0,
+            "deadline": state.get("deadline", 0.0),
+            "stop_reason": "",
+        }
+
+    def improver_agent_node(self, state: states.MainState):
+        improver_state = self._improver_input(state)
+        output = self.improver_agent.invoke(improver_state)
+        return self._improver_agent_update(state, output)
+
+    async def aimprover_agent_node(
+        self, state: states.MainState, config: RunnableConfig
+    ):
+        improver_state = self._improver_input(state)
+        output = await self.improver_agent.ainvoke(improver_state, config)
+        return self._improver_agent_update(state, output)
+
+    def _chat_messages(self, state: states.MainState):
+        retrieved_content = self.blob_store.resolve(state.get("retrieved_content"), [])
+        return [
             SystemMessage(content=prompts.CHAT_PROMPT),
             HumanMessage(
-                content=f'{state.get("task", "")}\n\n{state.get("content", "")}\n\n{state.get('retrieved_content')}'
+                content=f"{state.get('task', '')}\n\n{state.get('content', '')}\n\n{retrieved_content}"
             ),
         ]
-        response = self.llm.invoke(messages)
+
+    def _chat_update(self, state: states.MainState, response):
         state["improver_state"]["final_output"] = str(response.content)
 
         return {
@@ -416,6 +1064,14 @@ class ResearchAssistant:
             "task": state.get("task", ""),
         }
 
+    def chat_node(self, state: states.MainState):
+        response = self.llm.invoke(self._chat_messages(state))
+        return self._chat_update(state, response)
+
+    async def achat_node(self, state: states.MainState):
+        response = await self.llm.ainvoke(self._chat_messages(state))
+        return self._chat_update(state, response)
+
     def decision(self, state: states.MainState):
         next_node = state.get("next_node", "")
         if next_node not in ["search_agent", "deep_analysis_agent", "chat"]:
@@ -0,0 +1,309 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import argparse
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_ollama import OllamaEmbeddings
+
+from utils.config import get_section
+from utils.embedding_cache import cached_embeddings
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROUTERS = ("main", "search")
+
+
+def _normalize(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def fit_centroids(
+    vectors: np.ndarray, labels: List[str]
+) -> Tuple[List[str], np.ndarray]:
+    names = sorted(set(labels))
+    labels = np.asarray(labels)
+    centroids = np.stack([vectors[labels == name].mean(axis=0) for name in names])
+    return names, _normalize(centroids)
+
+
+# ======================= Local Router ========================
+class LocalRouter:
+    """
+    Nearest-centroid classifier over task embeddings, one per router ("main":
+    search_agent / deep_analysis_agent / chat, "search": web_search /
+    vector_store), trained offline from the logged LLM routing decisions.
+    `route` answers only when the best centroid beats the runner-up by
+    `min_margin`, otherwise the caller asks the LLM.
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        log_path: str,
+        embeddings,
+        min_margin: float = 0.05,
+        enabled: bool = True,
+        log: bool = True,
+        log_max_bytes: int = 0,
+    ):
+        self.model_path = model_path
+        self.log_path = log_path
+        self.embeddings = embeddings
+        self.min_margin = min_margin
+        self.enabled = enabled
+        self.log = log
+        self.log_max_bytes = log_max_bytes
+        self._log_full = False
+        self._lock = threading.Lock()
+        self._models: Dict[str, Tuple[List[str], np.ndarray]] = {}
+        self._mtime = None
+
+    @classmethod
+    def from_config(cls, config: dict) -> "LocalRouter":
+        model = get_section("vector_store").get(
+            "embedding_model", "llama3.1:8b-instruct-q4_K_M"
+        )
+        return cls(
+            model_path=os.path.join(
+                ROOT_DIR, config.get("model_path", "cache/local_router.npz")
+            ),
+            log_path=os.path.join(
+                ROOT_DIR, config.get("log_path", "cache/routing_log.jsonl")
+            ),
+            embeddings=cached_embeddings(OllamaEmbeddings(model=model), model),
+            min_margin=float(config.get("min_margin", 0.05)),
+            enabled=bool(config.get("enabled", True)),
+            log=bool(config.get("log", True)),
+            log_max_bytes=int(config.get("log_max_bytes", 0) or 0),
+        )
+
+    def _load(self) -> Dict[str, Tuple[List[str], np.ndarray]]:
+        # picks up a retrained model without a restart.
+        if not os.path.exists(self.model_path):
+            return {}
+        mtime = os.path.getmtime(self.model_path)
+        with self._lock:
+            if self._mtime != mtime:
+                with np.load(self.model_path) as data:
+                    self._models = {
+                        router: (
+                            [str(label) for label in data[f"{router}__labels"]],
+                            data[f"{router}__centroids"],
+                        )
+                        for router in ROUTERS
+                        if f"{router}__labels" in data.files
+                    }
+                self._mtime = mtime
+            return self._models
+
+    def save(self, models: Dict[str, Tuple[List[str], np.ndarray]]):
+        os.makedirs(os.path.dirname(self.model_path) or ".", exist_ok=True)
+        arrays = {}
+        for router, (labels, centroids) in models.items():
+            arrays[f"{router}__labels"] = np.asarray(labels)
+            arrays[f"{router}__centroids"] = centroids
+        tmp_path = f"{self.model_path}.tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, self.model_path)
+
+    def predict(self, router: str, text: str) -> Optional[Tuple[str, float]]:
+        """
+        Returns the nearest label and its margin over the runner-up.
+        """
+        model = self._load().get(router)
+        if model is None:
+            return None
+        labels, centroids = model
+        scores = centroids @ _normalize(self.embeddings.embed_query(text))
+        order = np.argsort(-scores)
+        margin = float(scores[order[0]] - scores[order[1]]) if len(order) > 1 else 1.0
+        return labels[order[0]], margin
+
+    def route(self, router: str, text: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        try:
+            prediction = self.predict(router, text)
+        except Exception as e:
+            logger.warning(f"Local {router} router failed, using the LLM: {e}")
+            return None
+        if prediction is None or prediction[1] < self.min_margin:
+            return None
+        label, margin = prediction
+        self.record(router, text, label, "local", margin)
+        return label
+
+    async def aroute(self, router: str, text: str) -> Optional[str]:
+        return await asyncio.to_thread(self.route, router, text)
+
+    def record(
+        self,
+        router: str,
+        text: str,
+        label: str,
+        source: str,
+        margin: float = None,
+    ):
+        """
+        Appends a routing decision to the log, the LLM ones are the training data.
+        The log holds the raw tasks: it stops at `log_max_bytes`, `log` turns
+        it off.
+        """
+        logger.info(f"routing [{router}] -> {label} ({source})")
+        if not self.log or self._log_full:
+            return
+        entry = {
+            "time": time.time(),
+            "router": router,
+            "text": text,
+            "label": label,
+            "source": source,
+            "margin": margin,
+        }
+        with self._lock:
+            if self.log_max_bytes and os.path.exists(self.log_path):
+                if os.path.getsize(self.log_path) >= self.log_max_bytes:
+                    logger.warning(
+                        f"{self.log_path} reached log_max_bytes, logging stopped"
+                    )
+                    self._log_full = True
+                    return
+            os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    async def arecord(
+        self,
+        router: str,
+        text: str,
+        label: str,
+        source: str,
+        margin: float = None,
+    ):
+        await asyncio.to_thread(self.record, router, text, label, source, margin)
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_local_router() -> LocalRouter:
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = LocalRouter.from_config(get_section("local_router"))
+        return _router
+
+
+# ===================== Offline train / eval ====================
+def load_examples(log_path: str) -> Dict[str, List[Tuple[str, str]]]:
+    """
+    LLM decisions from the log, per router, the latest label of a text wins.
+    """
+    latest: Dict[str, Dict[str, str]] = defaultdict(dict)
+    with open(log_path, "r") as f:
+        for line in f:
+            entry = json.loads(line)
+            if (
+                entry.get("source") == "llm"
+                and entry.get("router") in ROUTERS
+                and entry.get("label")
+            ):
+                latest[entry["router"]][entry["text"]] = entry["label"]
+    return {router: list(texts.items()) for router, texts in latest.items()}
+
+
+def _is_holdout(text: str, fraction: float) -> bool:
+    # stable split, the same text always lands on the same side.
+    bucket = int(hashlib.sha256(text.encode()).hexdigest()[:8], 16) / 0xFFFFFFFF
+    return bucket < fraction
+
+
+def train(router: LocalRouter) -> Dict[str, int]:
+    examples = load_examples(router.log_path)
+    models = {}
+    for name, pairs in examples.items():
+        if len({label for _, label in pairs}) < 2:
+            print(f"[{name}] skipped: needs decisions for at least two routes")
+            continue
+        vectors = _normalize(router.embeddings.embed_documents([t for t, _ in pairs]))
+        models[name] = fit_centroids(vectors, [label for _, label in pairs])
+        print(f"[{name}] trained on {len(pairs)} decisions: {models[name][0]}")
+    router.save(models)
+    return {name: len(pairs) for name, pairs in examples.items()}
+
+
+def evaluate(router: LocalRouter, holdout: float = 0.2):
+    """
+    Agreement with the LLM router on a held-out part of the log: overall, and
+    on the confident decisions the local router would actually take.
+    """
+    for name, pairs in load_examples(router.log_path).items():
+        train_pairs = [p for p in pairs if not _is_holdout(p[0], holdout)]
+        test_pairs = [p for p in pairs if _is_holdout(p[0], holdout)]
+        if len({label for _, label in train_pairs}) < 2 or not test_pairs:
+            print(f"[{name}] not enough decisions to evaluate ({len(pairs)})")
+            continue
+
+        train_vectors = _normalize(
+            router.embeddings.embed_documents([t for t, _ in train_pairs])
+        )
+        labels, centroids = fit_centroids(train_vectors, [l for _, l in train_pairs])
+        test_vectors = _normalize(
+            router.embeddings.embed_documents([t for t, _ in test_pairs])
+        )
+
+        scores = test_vectors @ centroids.T
+        order = np.argsort(-scores, axis=1)
+        predicted = [labels[i] for i in order[:, 0]]
+        rows = np.arange(len(test_pairs))
+        margins = scores[rows, order[:, 0]] - scores[rows, order[:, 1]]
+        expected = [label for _, label in test_pairs]
+
+        agree = [p == e for p, e in zip(predicted, expected)]
+        confident = margins >= router.min_margin
+        covered = int(confident.sum())
+        confident_agreement = (
+            float(np.mean([a for a, c in zip(agree, confident) if c]))
+            if covered
+            else 0.0
+        )
+        print(
+            f"[{name}] {len(test_pairs)} held-out decisions: "
+            f"agreement {np.mean(agree):.1%}, "
+            f"local coverage {covered / len(test_pairs):.1%} "
+            f"(margin >= {router.min_margin}) with agreement {confident_agreement:.1%}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Train or evaluate the local router from the logged LLM routing decisions."
+    )
+    parser.add_argument("command", choices=["train", "eval"])
+    parser.add_argument(
+        "--log", type=str, help="routing log, defaults to the config one"
+    )
+    parser.add_argument(
+        "--holdout", type=float, default=0.2, help="eval: share of decisions held out"
+    )
+    args = parser.parse_args()
+
+    local_router = get_local_router()
+    if args.log:
+        local_router.log_path = args.log
+
+    if args.command == "train":
+        train(local_router)
+    else:
+        evaluate(local_router, args.holdout)
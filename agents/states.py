@@ -1,4 +1,4 @@
-from typing import List, Dict, Literal, Annotated, Optional, TypedDict
+from typing import List, Dict, Literal, Annotated, Optional, TypedDict, Union
 from pydantic import BaseModel, Field
 import operator
 
@@ -12,6 +12,19 @@ class MainRouter(BaseModel):
     )
 
 
+class Plan(BaseModel):
+    route: Literal["search_agent", "deep_analysis_agent", "chat"] = Field(
+        None, description="the next route to take based on the task."
+    )
+    sub_route: Optional[Literal["web_search", "vector_store"]] = Field(
+        None, description="search_agent only: where to search."
+    )
+    queries: List[str] = Field(
+        default_factory=list, description="search_agent only: the search queries."
+    )
+    max_results: int = 3
+
+
 class SearchRouter(BaseModel):
     next_node: Literal["web_search", "vector_store"]
 
@@ -21,6 +34,19 @@ class Query(BaseModel):
     max_results: int = 3
 
 
+class Reflection(BaseModel):
+    critique: str = Field(
+        "", description="critique and recommendations on how to improve the paragraphs."
+    )
+    score: float = Field(
+        0.0,
+        description="quality of the paragraphs, from 0 (poor) to 1 (nothing to improve).",
+    )
+    verdict: Literal["accept", "revise"] = Field(
+        "revise", description="accept only if the paragraphs need no further revision."
+    )
+
+
 class MetaData(BaseModel):
     paper_url: Optional[str]
     paper_name: Optional[str]
@@ -34,7 +60,9 @@ class SearchState(TypedDict):
     node_name: str
     next_node: str
     content: List[str]
-    retrieved_content: List[Dict]
+    retrieved_content: Union[List[Dict], str]  # or a utils.blob_store handle
+    context_stats: Dict  # what the generator prompt kept / dropped
+    plan: Dict  # fused planner output, skips the router and query generation
 
 
 class DeepAnalysisState(TypedDict):
@@ -44,8 +72,10 @@ class DeepAnalysisState(TypedDict):
     paper_name: str
     paper_url: str
     meta_data: List[Dict]
-    full_paper: str
+    full_paper: str  # or a utils.blob_store handle
     content: List[str]
+    context_stats: Dict  # what the analysis prompt kept / dropped
+    analysis_mode: str  # "auto", "single" or "map_reduce"
 
 
 class ImproverState(TypedDict):
@@ -57,6 +87,13 @@ class ImproverState(TypedDict):
     revision_number: int
     max_revisions: int
     count: Annotated[int, operator.add]
+    score: float  # last reflection's grade
+    verdict: str  # last reflection's "accept" / "revise"
+    draft_similarity: float  # last improved draft vs the previous one
+    revisions: int  # improver runs in this request
+    deadline: float  # epoch seconds, 0 without a latency budget
+    stop_reason: str
+    revisions_saved: int  # improver runs skipped vs the fixed loop
 
 
 class MainState(TypedDict):
@@ -67,10 +104,14 @@ class MainState(TypedDict):
     node_name: str
     next_node: str
     content: List[str]
-    retrieved_content: List[Dict]
+    retrieved_content: Union[List[Dict], str]  # or a utils.blob_store handle
+    plan: Dict
+    deadline: float  # epoch seconds the request should finish by, 0 for none
 
 
-def _initialize_state(task: str) -> MainState:
+def _initialize_state(
+    task: str, analysis_mode: str = "auto", deadline: float = 0.0
+) -> MainState:
     return {
         "task": task,
         "search_state": {
@@ -79,6 +120,8 @@ def _initialize_state(task: str) -> MainState:
             "next_node": "",
             "content": [],
             "retrieved_content": [],
+            "context_stats": {},
+            "plan": {},
         },
         "deep_analysis_state": {
             "task": "",
@@ -89,6 +132,8 @@ def _initialize_state(task: str) -> MainState:
             "meta_data": [],
             "full_paper": "",
             "content": [],
+            "context_stats": {},
+            "analysis_mode": analysis_mode,
         },
         "improver_state": {
             "content": [],
@@ -98,9 +143,18 @@ def _initialize_state(task: str) -> MainState:
             "revision_number": 1,
             "max_revisions": 2,
             "count": 0,
+            "score": 0.0,
+            "verdict": "",
+            "draft_similarity": 0.0,
+            "revisions": 0,
+            "deadline": 0.0,
+            "stop_reason": "",
+            "revisions_saved": 0,
         },
         "node_name": "",
         "next_node": "",
         "content": [],
         "retrieved_content": [],
+        "plan": {},
+        "deadline": deadline,
     }
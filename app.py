@@ -1,17 +1,55 @@
+import json
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import Any, Dict, Optional
-from main import RunResearchAssistant
-from agents import states
+from typing import Any, Dict, Literal, Optional
+from main import RunResearchAssistant, ThreadContext, UnknownThread
+from utils.admission import AdmissionController, AdmissionRejected
+from utils.blob_store import get_blob_store
+from utils.cache import get_tool_cache
+from utils.checkpoints import get_checkpoint_janitor
+from utils.config import get_section
+from utils.llm_cache import get_llm_cache_store
+from utils.llm_scheduler import get_llm_scheduler
+from utils.metrics import render_metrics
+from utils.tracing import get_trace_store, to_chrome_trace
+
+
+# one compiled graph shared by every request, the per-request state lives in
+# a `ThreadContext` so concurrent runs never see each other's thread_id.
+runner = RunResearchAssistant()
+admission = AdmissionController.from_config(get_section("admission"))
 
 
-app = FastAPI()
-runner = RunResearchAssistant()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await runner.aclose()
+    get_checkpoint_janitor().stop()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 
 class TaskRequest(BaseModel):
     task: str
     thread_id: Optional[str] = None
+    # deep analysis of a paper: "map_reduce" summarizes its sections in
+    # parallel first, "auto" picks it for long papers only.
+    analysis_mode: Optional[Literal["auto", "single", "map_reduce"]] = None
+    # seconds the run should take, fewer revisions are made to meet it.
+    latency_budget: Optional[float] = None
 
 
 class AgentResponse(BaseModel):
@@ -24,35 +62,138 @@ class AgentResponse(BaseModel):
 async def run_agent(request: TaskRequest):
     # data = await request.json() will be deprecated
     input_text = request.task
-    thread_id = request.thread_id
-
-    if thread_id:
-        runner.thread_id = thread_id
-        runner.config = {"configurable": {"thread_id": thread_id}}
-        result = runner.existing_thread(input_text)
-    else:
-        result = runner.new_thread(input_text)
+    context = ThreadContext.create(request.thread_id)
+
+    async with admission.slot():
+        try:
+            if request.thread_id:
+                result = await runner.aexisting_thread(
+                    input_text,
+                    context,
+                    request.analysis_mode,
+                    request.latency_budget,
+                )
+            else:
+                result = await runner.anew_thread(
+                    input_text,
+                    context,
+                    request.analysis_mode or "auto",
+                    request.latency_budget,
+                )
+        except UnknownThread as e:
+            raise HTTPException(status_code=404, detail=str(e))
 
     return {
         "final_output": result["improver_state"]["final_output"],
         "reflection": result["improver_state"]["reflection"],
-        "thread_id": runner.thread_id,
+        "thread_id": context.thread_id,
     }
 
 
+def _sse(event: Dict) -> str:
+    return f"event: {event['event']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+
+@app.post("/run/stream")
+async def run_agent_stream(request: TaskRequest):
+    """
+    Same as `/run` but answers with server-sent events: node transitions and
+    token deltas while the graph runs, then a `done` event with the output.
+    Closing the connection cancels the run.
+    """
+    context = ThreadContext.create(request.thread_id)
+    await admission.acquire()
+
+    events = runner.astream_thread(
+        request.task,
+        context,
+        resume=bool(request.thread_id),
+        analysis_mode=request.analysis_mode,
+        latency_budget=request.latency_budget,
+    )
+    try:
+        first = await events.__anext__()
+    except UnknownThread as e:
+        await events.aclose()
+        admission.release()
+        raise HTTPException(status_code=404, detail=str(e))
+    except BaseException:
+        await events.aclose()
+        admission.release()
+        raise
+
+    async def event_stream():
+        try:
+            yield _sse(first)
+            async for event in events:
+                yield _sse(event)
+        except Exception as e:
+            yield _sse({"event": "error", "detail": str(e)})
+        finally:
+            # also reached when the client disconnects and the response
+            # task gets cancelled, which stops the graph run.
+            await events.aclose()
+            admission.release()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/state/{thread_id}")
 async def get_state(thread_id: str):
     try:
-        snapshot = runner.get_current_state(thread_id)
-        return snapshot
+        snapshot = await runner.aget_current_state(thread_id)
+        # the paper text and search hits are stored as blob handles.
+        values = await asyncio.to_thread(get_blob_store().resolve_all, snapshot.values)
+        return snapshot._replace(values=values)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/trace/{thread_id}")
+def get_trace(
+    thread_id: str, format: Literal["tree", "chrome"] = "tree", limit: int = None
+):
+    """
+    Span trees of the thread's latest runs (graph, subgraphs, nodes, LLM and
+    tool calls), or `format=chrome` for a file to open in Perfetto /
+    chrome://tracing.
+    """
+    runs = get_trace_store().runs(thread_id, limit)
+    if not runs:
+        raise HTTPException(status_code=404, detail=f"No trace for {thread_id}")
+    if format == "chrome":
+        return JSONResponse(
+            to_chrome_trace(runs[::-1]),
+            headers={
+                "Content-Disposition": f'attachment; filename="trace-{thread_id}.json"'
+            },
+        )
+    return {"thread_id": thread_id, "runs": runs}
+
+
 # Health check endpoint
 @app.get("/health")
 def health_check():
-    return {"status": "✅ ✅ ✅"}
+    return {
+        "status": "✅ ✅ ✅",
+        "admission": admission.stats(),
+        "tool_cache": get_tool_cache().stats(),
+        "llm_cache": get_llm_cache_store().stats(),
+        "checkpoints": get_checkpoint_janitor().stats(),
+        "blob_store": get_blob_store().stats(),
+        "llm_scheduler": get_llm_scheduler().stats(),
+    }
+
+
+@app.get("/metrics")
+def metrics():
+    # Prometheus scrape: node / tool / LLM latency, tokens, cache hits, sizes.
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
 
 
 # Optionally: metadata endpoint for debugging
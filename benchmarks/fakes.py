@@ -0,0 +1,455 @@
+import json
+import math
+import time
+import random
+import asyncio
+import hashlib
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, fields, replace
+from typing import Any, Dict, List, Optional, Tuple
+from unittest import mock
+
+import numpy as np
+from langchain.tools import StructuredTool
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_ollama import ChatOllama
+
+import tools.search_tools as search_tools
+from tools.semantic_retrieval import RetrievalService
+from utils.config import get_section
+from utils.llm_scheduler import ScheduledChatOllama
+
+WORDS = (
+    "model training data diffusion transformer attention benchmark dataset "
+    "audio music generation latent sampling evaluation baseline accuracy "
+    "inference encoder decoder token sequence loss gradient layer network "
+    "results method paper study approach performance quality scale parameter "
+    "embedding retrieval context prompt language vision signal spectrogram "
+    "waveform codec objective fine-tuning pretraining ablation metric score"
+).split()
+
+# the first line of the task decides the route, like a well behaved router.
+ROUTES = (
+    ("analyze the paper", "deep_analysis_agent", None),
+    ("local papers", "search_agent", "vector_store"),
+    ("on the web", "search_agent", "web_search"),
+)
+
+
+@dataclass(frozen=True)
+class Dist:
+    """
+    Lognormal around `median` (`spread` is the sigma of its log), a constant
+    without spread.
+    """
+
+    median: float
+    spread: float = 0.0
+
+    def sample(self, rng: random.Random) -> float:
+        if not self.spread:
+            return self.median
+        return self.median * math.exp(rng.gauss(0.0, self.spread))
+
+
+@dataclass(frozen=True)
+class BackendProfile:
+    """
+    Latencies (seconds) and payload sizes (words) of the stand-in backends.
+    Every draw is seeded by `seed` and the call input, so a run is
+    reproducible whatever order the concurrent calls happen in.
+    """
+
+    seed: int = 0
+    structured_latency: Dist = Dist(0.0)  # routers, planner, queries, reflection
+    generate_latency: Dist = Dist(0.0)  # generator, analyze, improver, chat
+    generate_words: Dist = Dist(250, 0.3)
+    embed_latency: Dist = Dist(0.0)  # per request, whatever the batch size
+    search_latency: Dist = Dist(0.0)
+    search_results: int = 3
+    search_result_words: Dist = Dist(120, 0.4)
+    arxiv_latency: Dist = Dist(0.0)
+    pdf_latency: Dist = Dist(0.0)
+    pdf_words: Dist = Dist(6000, 0.5)
+    retrieval_latency: Dist = Dist(0.0)
+    chunk_words: Dist = Dist(180, 0.2)
+    corpus_size: int = 5000  # chunks in the fake vector store
+    accept_rate: float = 0.5  # reflections that accept the first draft
+
+    def scaled(self, factor: float) -> "BackendProfile":
+        """
+        The same profile with every latency multiplied by `factor`.
+        """
+        latencies = {}
+        for f in fields(self):
+            if f.name.endswith("_latency"):
+                dist = getattr(self, f.name)
+                latencies[f.name] = Dist(dist.median * factor, dist.spread)
+        return replace(self, **latencies)
+
+
+PROFILES = {
+    # no waiting at all: what is left is the orchestration overhead.
+    "instant": BackendProfile(),
+    # a local 8B model on one GPU, Tavily and arXiv over the internet.
+    "ollama": BackendProfile(
+        structured_latency=Dist(0.8, 0.3),
+        generate_latency=Dist(6.0, 0.4),
+        embed_latency=Dist(0.05, 0.3),
+        search_latency=Dist(1.2, 0.5),
+        arxiv_latency=Dist(0.8, 0.4),
+        pdf_latency=Dist(2.5, 0.6),
+        retrieval_latency=Dist(0.02, 0.3),
+    ),
+}
+
+
+def _rng(profile: BackendProfile, *parts: str) -> random.Random:
+    return random.Random(f"{profile.seed}\0" + "\0".join(parts))
+
+
+def _text(rng: random.Random, words: float) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(max(1, int(words))))
+
+
+def _route(text: str) -> Tuple[str, Optional[str]]:
+    first_line = text.split("\n", 1)[0].lower()
+    for keyword, route, sub_route in ROUTES:
+        if keyword in first_line:
+            return route, sub_route
+    return "chat", None
+
+
+# ======================= Chat model ========================
+class FakeChatOllama(ChatOllama):
+    """
+    ChatOllama answering from `profile` instead of an Ollama server: the
+    structured outputs the graph asks for (routes, plans, queries, paper
+    metadata, reflections) and filler text of the profile's length, after the
+    profile's latency. Token usage is reported as whitespace words.
+    """
+
+    profile: Any = None
+
+    def _answer(self, messages, kwargs) -> Tuple[str, float, int]:
+        prompt = str(messages[-1].content)
+        schema = kwargs.get("format")
+        rng = _rng(self.profile, "llm", json.dumps(schema, sort_keys=True), prompt)
+        if isinstance(schema, dict):
+            latency = self.profile.structured_latency.sample(rng)
+            text = json.dumps(self._structured(schema, prompt, rng))
+        else:
+            latency = self.profile.generate_latency.sample(rng)
+            text = _text(rng, self.profile.generate_words.sample(rng))
+        prompt_tokens = sum(len(str(m.content).split()) for m in messages)
+        return text, latency, prompt_tokens
+
+    def _structured(self, schema: dict, prompt: str, rng: random.Random) -> dict:
+        route, sub_route = _route(prompt)
+        topic = prompt.split("\n", 1)[0]
+        title = schema.get("title")
+        if title == "MainRouter":
+            return {"next_node": route}
+        if title == "SearchRouter":
+            return {"next_node": sub_route or "web_search"}
+        if title == "Plan":
+            return {
+                "route": route,
+                "sub_route": sub_route,
+                "queries": [f"{topic} {i}" for i in range(3)],
+                "max_results": self.profile.search_results,
+            }
+        if title == "Query":
+            return {
+                "query": [f"{topic} {i}" for i in range(3)],
+                "max_results": self.profile.search_results,
+            }
+        if title == "MetaData":
+            paper_id = f"{rng.randrange(2000, 2500)}.{rng.randrange(10000):05d}"
+            return {
+                "paper_url": f"https://arxiv.org/pdf/{paper_id}",
+                "paper_name": topic,
+            }
+        if title == "Reflection":
+            accept = rng.random() < self.profile.accept_rate
+            return {
+                "critique": _text(rng, 40),
+                "score": 0.9 if accept else 0.5,
+                "verdict": "accept" if accept else "revise",
+            }
+        return {
+            key: {"string": "x", "integer": 1, "number": 0.5, "boolean": True}.get(
+                value.get("type"), []
+            )
+            for key, value in schema.get("properties", {}).items()
+        }
+
+    def _result(self, text: str, prompt_tokens: int) -> ChatResult:
+        usage = {
+            "input_tokens": prompt_tokens,
+            "output_tokens": len(text.split()),
+            "total_tokens": prompt_tokens + len(text.split()),
+        }
+        message = AIMessage(content=text, usage_metadata=usage)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text, latency, prompt_tokens = self._answer(messages, kwargs)
+        time.sleep(latency)
+        return self._result(text, prompt_tokens)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        text, latency, prompt_tokens = self._answer(messages, kwargs)
+        await asyncio.sleep(latency)
+        return self._result(text, prompt_tokens)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        text, latency, _ = self._answer(messages, kwargs)
+        words = text.split(" ")
+        for word in words:
+            time.sleep(latency / len(words))
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        text, latency, _ = self._answer(messages, kwargs)
+        words = text.split(" ")
+        for word in words:
+            await asyncio.sleep(latency / len(words))
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+class ScheduledFakeChatOllama(ScheduledChatOllama, FakeChatOllama):
+    """
+    FakeChatOllama behind the LLM scheduler, as `chat_model` builds it.
+    """
+
+
+def fake_chat_model(profile: BackendProfile):
+    # same choice as utils.llm_scheduler.chat_model.
+    def chat_model(model: str) -> ChatOllama:
+        if not get_section("llm_scheduler").get("enabled", True):
+            return FakeChatOllama(model=model, profile=profile)
+        return ScheduledFakeChatOllama(model=model, profile=profile)
+
+    return chat_model
+
+
+# ======================= Embeddings ========================
+class FakeEmbeddings(Embeddings):
+    """
+    Unit vectors seeded by the text: equal texts embed equally, different
+    ones are about orthogonal (no accidental semantic cache hits).
+    """
+
+    def __init__(self, profile: BackendProfile, model: str = "", dim: int = 256):
+        self.profile = profile
+        self.model = model
+        self.dim = dim
+
+    def _vector(self, text: str) -> List[float]:
+        seed = hashlib.sha256(f"{self.profile.seed}\0{text}".encode()).digest()
+        vector = np.random.default_rng(list(seed)).standard_normal(self.dim)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.profile.embed_latency.sample(_rng(self.profile, *texts)))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+# ======================= Vector store ========================
+class FakeCollection:
+    """
+    The two calls RetrievalService makes on a Chroma collection, over a
+    corpus of `corpus_size` generated chunks.
+    """
+
+    def __init__(self, profile: BackendProfile):
+        self.profile = profile
+
+    def _document(self, doc_id: str) -> str:
+        rng = _rng(self.profile, "chunk", doc_id)
+        return _text(rng, self.profile.chunk_words.sample(rng))
+
+    def query(self, query_embeddings, n_results: int = 10, include=()):
+        digest = hashlib.sha256(np.asarray(query_embeddings).tobytes()).hexdigest()
+        rng = _rng(self.profile, "query", digest)
+        k = min(n_results, self.profile.corpus_size)
+        time.sleep(self.profile.retrieval_latency.sample(rng))
+        ids = [
+            [f"chunk-{i}" for i in rng.sample(range(self.profile.corpus_size), k)]
+            for _ in query_embeddings
+        ]
+        return {
+            "ids": ids,
+            "documents": [[self._document(i) for i in row] for row in ids],
+            "metadatas": [[{"source": i} for i in row] for row in ids],
+        }
+
+    def get(self, ids: List[str], include=()):
+        return {"ids": list(ids), "documents": [self._document(i) for i in ids]}
+
+
+class FakeRetrievalService(RetrievalService):
+    """
+    RetrievalService over a FakeCollection, dense search only.
+    """
+
+    def __init__(self, profile: BackendProfile, k: int = 10):
+        super().__init__(chroma_dir="", model="fake", k=k, mode="dense")
+        self.profile = profile
+
+    def _open(self):
+        if self._collection is None:
+            self._embeddings = FakeEmbeddings(self.profile, self.model)
+            self._collection = FakeCollection(self.profile)
+        return self._collection
+
+
+# ======================= Tools ========================
+def fake_tools(profile: BackendProfile) -> Dict[str, StructuredTool]:
+    """
+    search_web, arxiv_search and load_pdf with the real names and argument
+    schemas, answering after the profile's latency. They stand in for the
+    whole tool, tool cache included.
+    """
+
+    def search_web(
+        query: str, max_results: int = 3, include_raw_content: bool = False
+    ) -> List[Dict]:
+        rng = _rng(profile, "search", query, str(max_results))
+        time.sleep(profile.search_latency.sample(rng))
+        return _search_results(rng, query, max_results)
+
+    async def asearch_web(
+        query: str, max_results: int = 3, include_raw_content: bool = False
+    ) -> List[Dict]:
+        rng = _rng(profile, "search", query, str(max_results))
+        await asyncio.sleep(profile.search_latency.sample(rng))
+        return _search_results(rng, query, max_results)
+
+    def _search_results(rng, query, max_results):
+        site = hashlib.sha1(query.encode()).hexdigest()[:8]
+        return [
+            {
+                "title": f"{query} ({i})",
+                "url": f"https://example.org/{site}/{i}",
+                "content": _text(rng, profile.search_result_words.sample(rng)),
+                "score": round(rng.random(), 3),
+            }
+            for i in range(max_results or profile.search_results)
+        ]
+
+    def arxiv_search(
+        query: str, max_results: int = 1, sort_by: str = "relevance"
+    ) -> List[Dict]:
+        rng = _rng(profile, "arxiv", query)
+        time.sleep(profile.arxiv_latency.sample(rng))
+        paper_id = f"{rng.randrange(2000, 2500)}.{rng.randrange(10000):05d}v1"
+        return [
+            {
+                "PDF_URL": f"http://arxiv.org/pdf/{paper_id}.pdf",
+                "Paper_ID": paper_id,
+                "Title": query,
+                "Publish Date": "2024-01-01T00:00:00+00:00",
+            }
+        ]
+
+    async def aarxiv_search(
+        query: str, max_results: int = 1, sort_by: str = "relevance"
+    ) -> List[Dict]:
+        return await asyncio.to_thread(arxiv_search, query, max_results, sort_by)
+
+    def load_pdf(url: str) -> str:
+        rng = _rng(profile, "pdf", url)
+        time.sleep(profile.pdf_latency.sample(rng))
+        return _paper(rng)
+
+    async def aload_pdf(url: str) -> str:
+        rng = _rng(profile, "pdf", url)
+        await asyncio.sleep(profile.pdf_latency.sample(rng))
+        return _paper(rng)
+
+    def _paper(rng) -> str:
+        # numbered sections of paragraphs, what split_sections expects.
+        words = int(profile.pdf_words.sample(rng))
+        sections = []
+        for number in range(1, max(2, words // 800) + 1):
+            paragraphs = [_text(rng, 100) for _ in range(8)]
+            sections.append(f"{number} Section {number}\n" + "\n\n".join(paragraphs))
+        sections.append("References\n" + _text(rng, 300))
+        return "\n\n".join(sections)
+
+    return {
+        "search_web": StructuredTool.from_function(
+            func=search_web,
+            coroutine=asearch_web,
+            name="search_web",
+            description=search_tools.search_web.description,
+            args_schema=search_tools.SearchInput,
+        ),
+        "arxiv_search": StructuredTool.from_function(
+            func=arxiv_search,
+            coroutine=aarxiv_search,
+            name="arxiv_search",
+            description=search_tools.arxiv_search.description,
+            args_schema=search_tools.ArxivSearchInput,
+        ),
+        "load_pdf": StructuredTool.from_function(
+            func=load_pdf,
+            coroutine=aload_pdf,
+            name="load_pdf",
+            description=search_tools.load_pdf.description,
+            args_schema=search_tools.LoadPDFInput,
+            return_direct=True,
+        ),
+    }
+
+
+@contextmanager
+def installed(profile: BackendProfile):
+    """
+    While active, agents built by ResearchAssistant() (and the local router /
+    LLM cache embeddings) use the fakes of `profile` instead of Ollama,
+    Tavily, arXiv, the PDF download and the vector store.
+    """
+    # imported here, importing the agents reads the config.
+    import agents.compiled_agents as compiled_agents
+    import agents.local_router as local_router
+    import tools.semantic_retrieval as semantic_retrieval
+    import utils.llm_cache as llm_cache
+
+    tools = fake_tools(profile)
+    retrieval = FakeRetrievalService(
+        profile, int(get_section("vector_store").get("k", 10))
+    )
+
+    def embeddings(model: str = "", **kwargs) -> FakeEmbeddings:
+        return FakeEmbeddings(profile, model)
+
+    patches = {
+        compiled_agents: {
+            "chat_model": fake_chat_model(profile),
+            "search_web": tools["search_web"],
+            "arxiv_search": tools["arxiv_search"],
+            "load_pdf": tools["load_pdf"],
+        },
+        semantic_retrieval: {"get_retrieval_service": lambda: retrieval},
+        local_router: {"OllamaEmbeddings": embeddings},
+        llm_cache: {"OllamaEmbeddings": embeddings},
+    }
+    with ExitStack() as stack:
+        for module, values in patches.items():
+            for name, value in values.items():
+                stack.enter_context(mock.patch.object(module, name, value))
+        yield
@@ -0,0 +1,508 @@
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from benchmarks.run import (
+    RSSSampler,
+    ScenarioResult,
+    _stored_bytes,
+    prepare_config,
+    report,
+)
+
+logger = logging.getLogger(__name__)
+
+# recorded values compared against a baseline, all "lower is better".
+REGRESSION_METRICS = ("p50", "p95", "peak_rss_mb", "checkpoint_bytes_per_call")
+# schemas a missing call can be answered for from the recorded path: the local
+# router may have made the decision without a model call when recording.
+ROUTING_SCHEMAS = ("MainRouter", "Plan", "SearchRouter", "Query")
+
+_current: ContextVar[Optional["RunCursor"]] = ContextVar("replay_run", default=None)
+
+
+class RunCursor:
+    """
+    The calls of one recorded run, each served once: the same request first
+    (same messages and schema, same tool input), else the next unused call of
+    the same node and schema (or tool), which keeps a run replayable after
+    its prompts or state changed.
+    """
+
+    def __init__(self, run: Dict[str, Any]):
+        self.run = run
+        self._lock = threading.Lock()
+        self._used = set()
+        self.served = defaultdict(int)
+        self.misses = defaultdict(int)
+
+    def take(self, kind: str, key: str, **group) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            for exact in (True, False):
+                for i, call in enumerate(self.run["calls"]):
+                    if i in self._used or call["kind"] != kind:
+                        continue
+                    if exact and call["key"] != key:
+                        continue
+                    if not exact and any(call.get(k) != v for k, v in group.items()):
+                        continue
+                    self._used.add(i)
+                    self.served[kind] += 1
+                    return call
+            self.misses[kind] += 1
+            return None
+
+    def routing(self, schema: str) -> Optional[Dict[str, Any]]:
+        """
+        Answer of a routing / query schema taken from the nodes the recorded
+        run went through and the inputs of its search tools.
+        """
+        nodes = self.run["nodes"]
+        route = next(
+            (n for n in ("search_agent", "deep_analysis_agent", "chat") if n in nodes),
+            "chat",
+        )
+        sub_route = "vector_store" if "semantic_retrieval" in nodes else "web_search"
+        queries, max_results = [], 3
+        for call in self.run["calls"]:
+            if call["kind"] != "tool" or not isinstance(call.get("input"), dict):
+                continue
+            if call["name"] == "search_web":
+                queries.append(call["input"].get("query", ""))
+                max_results = call["input"].get("max_results") or max_results
+            elif call["name"] == "vector_search":
+                queries.extend(call["input"].get("queries", []))
+        if schema == "MainRouter":
+            return {"next_node": route}
+        if schema == "SearchRouter":
+            return {"next_node": sub_route}
+        if schema == "Query":
+            return {"query": queries or [self.run["task"]], "max_results": max_results}
+        if schema == "Plan":
+            return {
+                "route": route,
+                "sub_route": sub_route if route == "search_agent" else None,
+                "queries": queries,
+                "max_results": max_results,
+            }
+        return None
+
+
+def _node() -> str:
+    from langchain_core.runnables import ensure_config
+
+    return ensure_config().get("metadata", {}).get("langgraph_node", "")
+
+
+@contextmanager
+def replaying(run: Dict[str, Any]):
+    """
+    Serves the calls of the graph invocations started inside the block (and
+    the tasks / threads they spawn) from `run`.
+    """
+    cursor = RunCursor(run)
+    token = _current.set(cursor)
+    try:
+        yield cursor
+    finally:
+        _current.reset(token)
+
+
+# ======================= Backends ========================
+def replay_backends(latency_scale: float = 1.0):
+    """
+    The chat model factory and the tools, answering from the current run
+    (see `replaying`) after the recorded duration times `latency_scale`.
+    Calls the recording does not have get the `instant` fake answers.
+    """
+    # imported here, importing the agents reads the config.
+    import tools.search_tools as search_tools
+    import tools.semantic_retrieval as semantic_retrieval
+    from langchain.tools import StructuredTool
+    from benchmarks.fakes import (
+        PROFILES,
+        FakeChatOllama,
+        FakeRetrievalService,
+        fake_tools,
+    )
+    from utils.config import get_section
+    from utils.llm_scheduler import ScheduledChatOllama
+    from utils.replay import llm_key, tool_key
+
+    profile = PROFILES["instant"]
+
+    class ReplayChatOllama(FakeChatOllama):
+        """
+        FakeChatOllama answering with the recorded responses.
+        """
+
+        def _answer(self, messages, kwargs) -> Tuple[str, float, int]:
+            cursor = _current.get()
+            schema = kwargs.get("format")
+            title = schema.get("title") if isinstance(schema, dict) else schema
+            call = cursor and cursor.take(
+                "llm", llm_key(messages, schema), node=_node(), schema=title
+            )
+            if call is None:
+                routing = cursor and title in ROUTING_SCHEMAS and cursor.routing(title)
+                if routing:
+                    return json.dumps(routing), 0.0, 0
+                return super()._answer(messages, kwargs)
+            if "error" in call:
+                raise RuntimeError(f"recorded model error: {call['error']}")
+            prompt_tokens = (call.get("usage") or {}).get("input_tokens", 0)
+            return call["response"], call["seconds"] * latency_scale, prompt_tokens
+
+    class ScheduledReplayChatOllama(ScheduledChatOllama, ReplayChatOllama):
+        pass
+
+    def chat_model(model: str):
+        if not get_section("llm_scheduler").get("enabled", True):
+            return ReplayChatOllama(model=model, profile=profile)
+        return ScheduledReplayChatOllama(model=model, profile=profile)
+
+    fallbacks = fake_tools(profile)
+    retrieval = FakeRetrievalService(profile)
+    fallbacks["vector_search"] = StructuredTool.from_function(
+        func=lambda queries, k=None, mode=None: retrieval.search_many(queries, k),
+        name="vector_search",
+        description="fallback",
+        args_schema=semantic_retrieval.VectorSearchInput,
+    )
+
+    def serve(name: str, args, kwargs) -> Tuple[Any, float]:
+        tool_input = args[0] if args else kwargs
+        cursor = _current.get()
+        call = cursor and cursor.take("tool", tool_key(name, tool_input), name=name)
+        if call is None:
+            return fallbacks[name].func(*args, **kwargs), 0.0
+        if "error" in call:
+            raise RuntimeError(f"recorded tool error: {call['error']}")
+        return call["output"], call["seconds"] * latency_scale
+
+    def tool(name: str, original) -> StructuredTool:
+        def func(*args, **kwargs):
+            output, seconds = serve(name, args, kwargs)
+            time.sleep(seconds)
+            return output
+
+        async def coroutine(*args, **kwargs):
+            output, seconds = serve(name, args, kwargs)
+            await asyncio.sleep(seconds)
+            return output
+
+        return StructuredTool.from_function(
+            func=func,
+            coroutine=coroutine,
+            name=name,
+            description=original.description,
+            args_schema=original.args_schema,
+            return_direct=original.return_direct,
+        )
+
+    tools = {
+        "search_web": tool("search_web", search_tools.search_web),
+        "arxiv_search": tool("arxiv_search", search_tools.arxiv_search),
+        "load_pdf": tool("load_pdf", search_tools.load_pdf),
+        "vector_search": tool("vector_search", semantic_retrieval.vector_search),
+    }
+    return chat_model, tools
+
+
+@contextmanager
+def installed(latency_scale: float = 1.0):
+    """
+    `benchmarks.fakes.installed` (embeddings, vector store) with the chat
+    model and the tools replaced by the replaying ones.
+    """
+    from unittest import mock
+
+    import agents.compiled_agents as compiled_agents
+    from benchmarks.fakes import PROFILES, installed as fakes_installed
+
+    chat_model, tools = replay_backends(latency_scale)
+    with ExitStack() as stack:
+        stack.enter_context(fakes_installed(PROFILES["instant"]))
+        stack.enter_context(
+            mock.patch.object(compiled_agents, "chat_model", chat_model)
+        )
+        for name, value in tools.items():
+            stack.enter_context(mock.patch.object(compiled_agents, name, value))
+        yield
+
+
+# ======================= Sessions ========================
+def sessions(runs: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """
+    Recorded runs grouped by thread, in the order they ran.
+    """
+    threads = defaultdict(list)
+    for run in sorted(runs, key=lambda run: run["started_at"]):
+        threads[run["thread_id"]].append(run)
+    return list(threads.values())
+
+
+class Fidelity:
+    """
+    How closely the replay followed the recordings: calls served from the
+    file, calls missing from it, and runs whose nodes differ from the
+    recorded ones.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.served = defaultdict(int)
+        self.misses = defaultdict(int)
+        self.path_changes = 0
+
+    def add(self, cursor: RunCursor, thread_id: str):
+        from utils.tracing import get_trace_store
+
+        runs = get_trace_store().runs(thread_id, limit=1)
+        spans = runs[0]["spans"] if runs else []
+        nodes = [span["name"] for span in spans if span["kind"] == "node"]
+        with self._lock:
+            for kind, count in cursor.served.items():
+                self.served[kind] += count
+            for kind, count in cursor.misses.items():
+                self.misses[kind] += count
+            if runs and nodes != cursor.run["nodes"]:
+                self.path_changes += 1
+                logger.info(
+                    f"path changed: {cursor.run['nodes']} -> {nodes} "
+                    f"({cursor.run['task'][:60]!r})"
+                )
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "served": dict(self.served),
+            "misses": dict(self.misses),
+            "path_changes": self.path_changes,
+        }
+
+
+async def _aclients(runner, queue: List, clients: int, fidelity: Fidelity):
+    from main import ThreadContext
+
+    latencies, errors = [], []
+
+    async def client():
+        while queue:
+            session = queue.pop()
+            context = ThreadContext.create()
+            for turn, run in enumerate(session):
+                started = time.perf_counter()
+                try:
+                    with replaying(run) as cursor:
+                        if turn == 0:
+                            await runner.anew_thread(
+                                run["task"],
+                                context,
+                                run.get("analysis_mode") or "auto",
+                                run.get("latency_budget"),
+                            )
+                        else:
+                            await runner.aexisting_thread(
+                                run["task"],
+                                context,
+                                run.get("analysis_mode"),
+                                run.get("latency_budget"),
+                            )
+                except Exception as e:
+                    errors.append(repr(e))
+                latencies.append(time.perf_counter() - started)
+                fidelity.add(cursor, context.thread_id)
+
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return latencies, errors
+
+
+def _clients(runners, queue: List, fidelity: Fidelity):
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def client(runner):
+        while True:
+            with lock:
+                if not queue:
+                    return
+                session = queue.pop()
+            for turn, run in enumerate(session):
+                started = time.perf_counter()
+                try:
+                    with replaying(run) as cursor:
+                        if turn == 0:
+                            runner.new_thread(
+                                run["task"],
+                                run.get("analysis_mode") or "auto",
+                                run.get("latency_budget"),
+                            )
+                        else:
+                            runner.existing_thread(
+                                run["task"],
+                                run.get("analysis_mode"),
+                                run.get("latency_budget"),
+                            )
+                except Exception as e:
+                    with lock:
+                        errors.append(repr(e))
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+                fidelity.add(cursor, runner.thread_id)
+
+    with ThreadPoolExecutor(len(runners)) as pool:
+        list(pool.map(client, runners))
+    return latencies, errors
+
+
+def replay(path: str, clients: int, mode: str = "async", limit: int = None):
+    """
+    Replays the sessions of a recording with `clients` concurrent clients.
+    Returns the run summary (as `benchmarks.run` reports it) with the replay
+    fidelity under "replay".
+    """
+    from main import RunResearchAssistant
+    from utils.replay import ReplayLog
+
+    runs = ReplayLog.load(path, limit)
+    queue = sessions(runs)[::-1]
+    fidelity = Fidelity()
+    result = ScenarioResult("replay", clients)
+
+    if mode == "async":
+
+        async def main():
+            runner = RunResearchAssistant()
+            try:
+                before, started = _stored_bytes(), time.perf_counter()
+                with RSSSampler() as rss:
+                    outcome = await _aclients(runner, queue, clients, fidelity)
+                return outcome, before, started, rss
+            finally:
+                await runner.aclose()
+
+        outcome, before, started, rss = asyncio.run(main())
+    else:
+        runners = [RunResearchAssistant() for _ in range(clients)]
+        before, started = _stored_bytes(), time.perf_counter()
+        with RSSSampler() as rss:
+            outcome = _clients(runners, queue, fidelity)
+
+    result.latencies, result.errors = outcome
+    result.wall = time.perf_counter() - started
+    result.peak_rss = rss.peak
+    after = _stored_bytes()
+    result.checkpoint_bytes = after[0] - before[0]
+    result.blob_bytes = after[1] - before[1]
+    for error in sorted(set(result.errors)):
+        logger.warning(f"replay: {error}")
+
+    recorded = [run["duration"] for run in runs]
+    return {
+        **result.summary(),
+        "recorded_runs": len(runs),
+        "recorded_p50": sorted(recorded)[len(recorded) // 2] if recorded else 0.0,
+        "replay": fidelity.as_dict(),
+    }
+
+
+def regressions(summary: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    found = []
+    for metric in REGRESSION_METRICS:
+        old, new = baseline.get(metric), summary.get(metric)
+        if old and new is not None and new > old * (1 + tolerance):
+            found.append(f"{metric}: {old:.4g} -> {new:.4g} (+{new / old - 1:.0%})")
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay recorded runs offline and compare with a baseline."
+    )
+    parser.add_argument("recording", type=str, help="replay file (replay.path)")
+    parser.add_argument("--clients", "-c", type=int, default=1)
+    parser.add_argument("--mode", choices=["async", "sync"], default="async")
+    parser.add_argument("--limit", type=int, help="first runs of the file only")
+    parser.add_argument(
+        "--latency-scale",
+        type=float,
+        default=1.0,
+        help="multiplies the recorded latencies, 0 replays at full speed",
+    )
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="SECTION.KEY=VALUE",
+        help="config override, e.g. llm_scheduler.max_in_flight=4",
+    )
+    parser.add_argument("--baseline", help="JSON results of an earlier replay")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="allowed regression, 0.2 = 20%%"
+    )
+    parser.add_argument("--workdir", help="kept after the run, defaults to a temp dir")
+    parser.add_argument("--output", "-o", help="JSON results file")
+    args = parser.parse_args()
+
+    recording = os.path.abspath(args.recording)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="research-replay-")
+    os.makedirs(workdir, exist_ok=True)
+    # the recorded answers decide the routes, not a router trained meanwhile, and
+    # a cached answer would hide the recorded latency.
+    overrides = [
+        "replay.record=false",
+        "local_router.enabled=false",
+        "llm_cache.enabled=false",
+        *args.set,
+    ]
+    os.environ["RESEARCH_CONFIG"] = prepare_config(workdir, overrides)
+
+    try:
+        with installed(args.latency_scale):
+            logging.getLogger().setLevel(logging.WARNING)
+            summary = replay(recording, args.clients, args.mode, args.limit)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    fidelity = summary["replay"]
+    print(report([summary]))
+    print(
+        f"\n{summary['recorded_runs']} recorded runs "
+        f"(p50 {summary['recorded_p50']:.3f} s), "
+        f"served {fidelity['served']}, missing {fidelity['misses']}, "
+        f"{fidelity['path_changes']} changed paths"
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "recording": recording,
+                    "mode": args.mode,
+                    "latency_scale": args.latency_scale,
+                    "overrides": args.set,
+                    "results": [summary],
+                },
+                f,
+                indent=2,
+            )
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)["results"][0]
+        found = regressions(summary, baseline, args.tolerance)
+        for line in found:
+            print(f"regression: {line}")
+        sys.exit(1 if found else 0)
@@ -0,0 +1,394 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Tuple
+
+import psutil
+import yaml
+
+from utils.config import CONFIG_PATH
+
+logger = logging.getLogger(__name__)
+
+TOPICS = (
+    "music generation",
+    "text to speech",
+    "retrieval augmented generation",
+    "diffusion transformers",
+    "audio codecs",
+    "long context attention",
+)
+
+
+@dataclass(frozen=True)
+class Scenario:
+    """
+    One session per client request: the first turn opens a thread, the other
+    turns resume it (`existing_thread`). The wording picks the route the fake
+    routers take (see benchmarks.fakes.ROUTES).
+    """
+
+    name: str
+    turns: Tuple[str, ...]
+    analysis_mode: str = "auto"
+
+
+SCENARIOS = {
+    scenario.name: scenario
+    for scenario in (
+        Scenario(
+            "search_web", ("what are the latest results on the web about {topic}",)
+        ),
+        Scenario("search_vector", ("what do the local papers say about {topic}",)),
+        Scenario("deep_analysis", ("analyze the paper on {topic}",)),
+        Scenario("chat", ("explain {topic} in simple terms",)),
+        Scenario(
+            "multi_turn",
+            (
+                "what are the latest results on the web about {topic}",
+                "explain the second point about {topic}",
+                "what do the local papers say about {topic}",
+            ),
+        ),
+    )
+}
+
+# everything the graph writes goes to the benchmark directory.
+WORKDIR_PATHS = {
+    ("checkpoints", "path"): "checkpoints.sqlite",
+    ("tool_cache", "path"): "tool_cache.sqlite",
+    ("pdf_cache", "dir"): "pdf",
+    ("embedding_cache", "path"): "embeddings.sqlite",
+    ("llm_cache", "path"): "llm_cache.sqlite",
+    ("local_router", "model_path"): "local_router.npz",
+    ("local_router", "log_path"): "routing_log.jsonl",
+    ("blob_store", "dir"): "blobs",
+    ("replay", "path"): "replay.jsonl.gz",
+}
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    clients: int
+    latencies: List[float] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+    wall: float = 0.0
+    checkpoint_bytes: int = 0
+    blob_bytes: int = 0
+    peak_rss: int = 0
+
+    def summary(self) -> Dict:
+        calls = len(self.latencies)
+        return {
+            "scenario": self.name,
+            "clients": self.clients,
+            "calls": calls,
+            "errors": len(self.errors),
+            "p50": _percentile(self.latencies, 0.5),
+            "p95": _percentile(self.latencies, 0.95),
+            "max": max(self.latencies, default=0.0),
+            "requests_per_second": calls / self.wall if self.wall else 0.0,
+            "checkpoint_bytes": self.checkpoint_bytes,
+            "checkpoint_bytes_per_call": self.checkpoint_bytes // max(1, calls),
+            "blob_bytes": self.blob_bytes,
+            "peak_rss_mb": round(self.peak_rss / 2**20, 1),
+        }
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def _task(template: str, client: int, request: int) -> str:
+    topic = TOPICS[(client + request) % len(TOPICS)]
+    # distinct tasks, so the LLM cache does not answer the whole benchmark.
+    return f"{template.format(topic=topic)} (client {client}, request {request})"
+
+
+def prepare_config(workdir: str, overrides: List[str] = ()) -> str:
+    """
+    Copy of the repo config writing into `workdir`, with retention off (it
+    would delete the checkpoints being measured) and `section.key=value`
+    overrides applied. Returns its path.
+    """
+    with open(CONFIG_PATH, "r") as f:
+        config = yaml.safe_load(f) or {}
+    for (section, key), name in WORKDIR_PATHS.items():
+        config.setdefault(section, {})[key] = os.path.join(workdir, name)
+    config["checkpoints"]["prune_interval"] = 0
+
+    for override in overrides:
+        name, value = override.split("=", 1)
+        section, key = name.split(".", 1)
+        config.setdefault(section, {})[key] = yaml.safe_load(value)
+
+    path = os.path.join(workdir, "config.yaml")
+    with open(path, "w") as f:
+        yaml.safe_dump(config, f)
+    return path
+
+
+def checkpoint_bytes(path: str) -> int:
+    """
+    Serialized checkpoint, metadata and pending write bytes in the file.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        (checkpoints,) = conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) "
+            "FROM checkpoints"
+        ).fetchone()
+        (writes,) = conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(value)), 0) FROM writes"
+        ).fetchone()
+    except sqlite3.OperationalError:  # no run checkpointed yet
+        return 0
+    finally:
+        conn.close()
+    return checkpoints + writes
+
+
+class RSSSampler:
+    """
+    Highest resident set size of the process while the block runs.
+    """
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.peak = 0
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+
+    def _loop(self):
+        while True:
+            self.peak = max(self.peak, self._process.memory_info().rss)
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._process.memory_info().rss)
+
+
+# ======================= Clients ========================
+async def _aclients(runner, scenario: Scenario, clients: int, requests: int):
+    from main import ThreadContext
+
+    latencies, errors = [], []
+
+    async def client(number: int):
+        for request in range(requests):
+            context = ThreadContext.create()
+            for turn, template in enumerate(scenario.turns):
+                task = _task(template, number, request)
+                started = time.perf_counter()
+                try:
+                    if turn == 0:
+                        await runner.anew_thread(
+                            task, context, analysis_mode=scenario.analysis_mode
+                        )
+                    else:
+                        await runner.aexisting_thread(task, context)
+                except Exception as e:
+                    errors.append(repr(e))
+                latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(client(number) for number in range(clients)))
+    return latencies, errors
+
+
+def _clients(runners, scenario: Scenario, requests: int):
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def client(number: int):
+        runner = runners[number]
+        for request in range(requests):
+            for turn, template in enumerate(scenario.turns):
+                task = _task(template, number, request)
+                started = time.perf_counter()
+                try:
+                    if turn == 0:
+                        runner.new_thread(task, analysis_mode=scenario.analysis_mode)
+                    else:
+                        runner.existing_thread(task)
+                except Exception as e:
+                    with lock:
+                        errors.append(repr(e))
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+
+    with ThreadPoolExecutor(len(runners)) as pool:
+        list(pool.map(client, range(len(runners))))
+    return latencies, errors
+
+
+# ======================= Runs ========================
+def _stored_bytes() -> Tuple[int, int]:
+    from utils.blob_store import get_blob_store
+    from utils.checkpoints import checkpoint_path
+
+    return checkpoint_bytes(checkpoint_path()), get_blob_store().stats()["bytes"]
+
+
+def _result(scenario: Scenario, clients: int, outcome, started, before, rss):
+    result = ScenarioResult(scenario.name, clients, *outcome)
+    result.wall = time.perf_counter() - started
+    result.peak_rss = rss.peak
+    after = _stored_bytes()
+    result.checkpoint_bytes = after[0] - before[0]
+    result.blob_bytes = after[1] - before[1]
+    for error in sorted(set(result.errors)):
+        logger.warning(f"{scenario.name}: {error}")
+    return result
+
+
+async def arun(scenarios: List[Scenario], clients: int, requests: int, warmup: int):
+    """
+    The API path: one shared runner, `anew_thread` / `aexisting_thread` from
+    `clients` concurrent tasks.
+    """
+    from main import RunResearchAssistant
+
+    runner = RunResearchAssistant()
+    results = []
+    try:
+        for scenario in scenarios:
+            if warmup:
+                await _aclients(runner, scenario, 1, warmup)
+            before, started = _stored_bytes(), time.perf_counter()
+            with RSSSampler() as rss:
+                outcome = await _aclients(runner, scenario, clients, requests)
+            results.append(_result(scenario, clients, outcome, started, before, rss))
+    finally:
+        await runner.aclose()
+    return results
+
+
+def run(scenarios: List[Scenario], clients: int, requests: int, warmup: int):
+    """
+    The sync graph (`ResearchAssistant.main_agent`): one RunResearchAssistant
+    per client thread, `new_thread` / `existing_thread`.
+    """
+    from main import RunResearchAssistant
+
+    runners = [RunResearchAssistant() for _ in range(clients)]
+    results = []
+    for scenario in scenarios:
+        if warmup:
+            _clients(runners[:1], scenario, warmup)
+        before, started = _stored_bytes(), time.perf_counter()
+        with RSSSampler() as rss:
+            outcome = _clients(runners, scenario, requests)
+        results.append(_result(scenario, clients, outcome, started, before, rss))
+    return results
+
+
+def report(summaries: List[Dict]) -> str:
+    header = (
+        f"{'scenario':<14} {'clients':>7} {'calls':>6} {'errors':>6} "
+        f"{'p50 s':>8} {'p95 s':>8} {'req/s':>8} {'ckpt KB/call':>12} "
+        f"{'blob KB':>8} {'peak RSS MB':>11}"
+    )
+    lines = [header, "-" * len(header)]
+    for s in summaries:
+        lines.append(
+            f"{s['scenario']:<14} {s['clients']:>7} {s['calls']:>6} {s['errors']:>6} "
+            f"{s['p50']:>8.3f} {s['p95']:>8.3f} {s['requests_per_second']:>8.2f} "
+            f"{s['checkpoint_bytes_per_call'] / 1024:>12.1f} "
+            f"{s['blob_bytes'] / 1024:>8.1f} {s['peak_rss_mb']:>11.1f}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the research graph against stand-in backends."
+    )
+    parser.add_argument(
+        "--scenario",
+        "-s",
+        action="append",
+        choices=sorted(SCENARIOS),
+        help="repeatable, defaults to all",
+    )
+    parser.add_argument("--clients", "-c", type=int, default=4)
+    parser.add_argument(
+        "--requests", "-n", type=int, default=5, help="sessions per client"
+    )
+    parser.add_argument("--warmup", type=int, default=1, help="untimed sessions")
+    parser.add_argument("--mode", choices=["async", "sync"], default="async")
+    parser.add_argument("--profile", choices=["instant", "ollama"], default="instant")
+    parser.add_argument(
+        "--latency-scale", type=float, default=1.0, help="multiplies every latency"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="SECTION.KEY=VALUE",
+        help="config override, e.g. llm_scheduler.max_in_flight=4",
+    )
+    parser.add_argument("--workdir", help="kept after the run, defaults to a temp dir")
+    parser.add_argument("--output", "-o", help="JSON results file")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="research-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.environ["RESEARCH_CONFIG"] = prepare_config(workdir, args.set)
+
+    # imported once RESEARCH_CONFIG is set, the modules read the config on import.
+    from benchmarks.fakes import PROFILES, installed
+
+    profile = replace(PROFILES[args.profile], seed=args.seed)
+    profile = profile.scaled(args.latency_scale)
+    scenarios = [SCENARIOS[name] for name in args.scenario or SCENARIOS]
+    try:
+        with installed(profile):
+            logging.getLogger().setLevel(logging.WARNING)
+            if args.mode == "async":
+                results = asyncio.run(
+                    arun(scenarios, args.clients, args.requests, args.warmup)
+                )
+            else:
+                results = run(scenarios, args.clients, args.requests, args.warmup)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    summaries = [result.summary() for result in results]
+    print(report(summaries))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "mode": args.mode,
+                    "profile": args.profile,
+                    "latency_scale": args.latency_scale,
+                    "seed": args.seed,
+                    "overrides": args.set,
+                    "results": summaries,
+                },
+                f,
+                indent=2,
+            )
@@ -0,0 +1,221 @@
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+from unittest import mock
+
+import utils.llm_scheduler as llm_scheduler
+from utils.llm_scheduler import LLMScheduler, ScheduledChatOllama
+
+
+class FakeOllama(ThreadingHTTPServer):
+    """
+    Local stand-in for the Ollama HTTP API (`/api/chat`, streamed or not):
+    answers every request after `delay` seconds, or the delay given in the
+    message (`label:seconds`), and records the labels in arrival order.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, delay: float = 0.05):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.delay = delay
+        self.arrivals: List[str] = []
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def arrived(self, label: str):
+        with self._lock:
+            self.arrivals.append(label)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        label, _, seconds = body["messages"][-1]["content"].partition(":")
+        self.server.arrived(label)
+        time.sleep(float(seconds) if seconds else self.server.delay)
+
+        message = {"role": "assistant", "content": f"answer to {label}"}
+        last = {
+            "model": body["model"],
+            "created_at": "2024-01-01T00:00:00Z",
+            "message": {"role": "assistant", "content": ""},
+            "done": True,
+            "done_reason": "stop",
+            "prompt_eval_count": 1,
+            "eval_count": 1,
+        }
+        if body.get("stream", True):
+            lines = [{**last, "message": message, "done": False}, last]
+        else:
+            lines = [{**last, "message": message}]
+        payload = "".join(json.dumps(line) + "\n" for line in lines).encode()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client gave up (timed out / cancelled)
+
+
+@contextmanager
+def serving(max_in_flight: int, delay: float = 0.05):
+    """
+    A fake Ollama server and a fresh scheduler of `max_in_flight` slots in
+    place of the process one.
+    """
+    server = FakeOllama(delay)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    scheduler = LLMScheduler(max_in_flight)
+    try:
+        with mock.patch.object(llm_scheduler, "_scheduler", scheduler):
+            yield server, scheduler
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _llm(server: FakeOllama, call_class: str) -> ScheduledChatOllama:
+    return ScheduledChatOllama(
+        model="fake", base_url=server.url, call_class=call_class
+    )
+
+
+def _config(thread_id: str) -> dict:
+    return {"metadata": {"thread_id": thread_id}}
+
+
+async def _queued(scheduler: LLMScheduler, count: int):
+    while scheduler.stats()["queued"] < count:
+        await asyncio.sleep(0.005)
+
+
+async def _in_flight(scheduler: LLMScheduler, count: int):
+    while scheduler.stats()["in_flight"] < count:
+        await asyncio.sleep(0.005)
+
+
+# ======================= Checks ========================
+async def check_priority():
+    """
+    With the single slot taken, waiting calls run router, structured,
+    generate, bulk, whatever order they arrived in.
+    """
+    with serving(max_in_flight=1) as (server, scheduler):
+        classes = ("bulk", "generate", "structured", "router")
+        llms = {call_class: _llm(server, call_class) for call_class in classes}
+        blocker = asyncio.create_task(
+            llms["generate"].ainvoke("blocker:1.0", _config("a"))
+        )
+        await _in_flight(scheduler, 1)
+        calls = []
+        for call_class in classes:
+            calls.append(
+                asyncio.create_task(
+                    llms[call_class].ainvoke(call_class, _config(call_class))
+                )
+            )
+            await _queued(scheduler, len(calls))
+        await asyncio.gather(blocker, *calls)
+        expected = ["blocker", "router", "structured", "generate", "bulk"]
+        assert server.arrivals == expected, server.arrivals
+
+
+async def check_fairness():
+    """
+    Between calls of the same class, the thread with fewer calls in flight
+    goes first: b1 overtakes a3, queued before it.
+    """
+    with serving(max_in_flight=2) as (server, scheduler):
+        llm = _llm(server, "generate")
+        first = [
+            asyncio.create_task(llm.ainvoke("a1:0.5", _config("a"))),
+            asyncio.create_task(llm.ainvoke("a2:0.2", _config("a"))),
+        ]
+        await _in_flight(scheduler, 2)
+        a3 = asyncio.create_task(llm.ainvoke("a3", _config("a")))
+        await _queued(scheduler, 1)
+        b1 = asyncio.create_task(llm.ainvoke("b1", _config("b")))
+        await _queued(scheduler, 2)
+        await asyncio.gather(*first, a3, b1)
+        assert server.arrivals.index("b1") < server.arrivals.index("a3"), (
+            server.arrivals
+        )
+
+
+async def check_cancellation():
+    """
+    A call cancelled after its slot was granted (woken, not yet resumed) or
+    while it waits gives the slot back, and so do calls abandoned by a
+    `wait_for` timeout mid-request.
+    """
+    with serving(max_in_flight=1) as (server, scheduler):
+        held = scheduler.slot("generate", "a")
+        held.__enter__()
+
+        async def wait():
+            async with scheduler.aslot("generate", "b"):
+                pass
+
+        waiter = asyncio.create_task(wait())
+        await _queued(scheduler, 1)
+        loop = asyncio.get_running_loop()
+        # the release schedules the wake up, the cancel lands right after it.
+        held.__exit__(None, None, None)
+        loop.call_soon(waiter.cancel)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            pass
+        assert scheduler.stats()["in_flight"] == 0, scheduler.stats()
+
+        llm = _llm(server, "structured")
+        calls = [
+            asyncio.wait_for(llm.ainvoke(f"c{i}:0.1", _config(f"t{i}")), 0.15)
+            for i in range(8)
+        ]
+        await asyncio.gather(*calls, return_exceptions=True)
+        stats = scheduler.stats()
+        assert stats["in_flight"] == 0 and stats["queued"] == 0, stats
+        await asyncio.wait_for(llm.ainvoke("after", _config("a")), 2)
+
+
+CHECKS = {
+    "priority": check_priority,
+    "fairness": check_fairness,
+    "cancellation": check_cancellation,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check the LLM scheduler against a local fake Ollama server."
+    )
+    parser.add_argument(
+        "--check", "-k", action="append", choices=sorted(CHECKS), help="repeatable"
+    )
+    args = parser.parse_args()
+
+    failed = 0
+    for name in args.check or CHECKS:
+        try:
+            asyncio.run(asyncio.wait_for(CHECKS[name](), 30))
+            print(f"{name:<14} ok")
+        except Exception as e:
+            failed += 1
+            print(f"{name:<14} FAILED {type(e).__name__}: {e}")
+    sys.exit(1 if failed else 0)
@@ -1,10 +1,144 @@
+import time
 import uuid
+import asyncio
+import logging
+import sqlite3
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
 from agents.compiled_agents import ResearchAssistant
 from agents.states import _initialize_state
+from utils.config import get_section
+from utils.metrics import get_metrics_handler
+from utils.replay import RunRecorder, get_replay_log, recording_enabled
+from utils.tracing import RunTracer, get_trace_store, tracing_enabled
+
+logger = logging.getLogger(__name__)
+
+# nodes whose LLM tokens are forwarded to streaming clients.
+TOKEN_STREAM_NODES = {"generator", "analyze", "improver", "chat"}
+
+
+class UnknownThread(ValueError):
+    """
+    Raised when resuming a thread that has no checkpoint (the API answers 404).
+    """
+
 
 Input = "what are the top 3 SOTA models in music generation, i want live information"
 
 
+@dataclass
+class ThreadContext:
+    """
+    Request-scoped execution context: the thread a single API call runs on.
+    """
+
+    thread_id: str
+    config: dict = field(default_factory=dict)
+
+    @classmethod
+    def create(cls, thread_id: str = None) -> "ThreadContext":
+        thread_id = thread_id or str(uuid.uuid4())
+        return cls(thread_id, _run_config(thread_id))
+
+
+def _run_config(thread_id: str) -> dict:
+    config = {"configurable": {"thread_id": thread_id}}
+    if get_section("metrics").get("enabled", True):
+        # per node / tool / LLM call metrics, see `/metrics`.
+        config["callbacks"] = [get_metrics_handler()]
+    return config
+
+
+def _run_handlers(thread_id: str, state: dict, resume: bool) -> list:
+    """
+    Callbacks of one invocation, saved once it ends: the span tracer (see
+    `/trace/{thread_id}`) and, when recording, the replay recorder.
+    """
+    handlers = []
+    if tracing_enabled():
+        handlers.append(RunTracer(thread_id))
+    if recording_enabled():
+        deadline = state.get("deadline") or 0
+        handlers.append(
+            RunRecorder(
+                thread_id,
+                state.get("task", ""),
+                resume,
+                state["deep_analysis_state"].get("analysis_mode"),
+                deadline - time.time() if deadline else None,
+            )
+        )
+    return handlers
+
+
+def _save_handlers(handlers: list):
+    for handler in handlers:
+        try:
+            if isinstance(handler, RunTracer):
+                get_trace_store().save(handler)
+            else:
+                get_replay_log().save(handler)
+        except (sqlite3.Error, OSError) as e:
+            # a lost trace or recording is not worth failing the run for.
+            logger.warning(
+                f"{type(handler).__name__} of thread {handler.thread_id} "
+                f"not saved: {e}"
+            )
+
+
+@contextmanager
+def _instrumented(config: dict, thread_id: str, state: dict, resume: bool = False):
+    """
+    Run config with the per-invocation handlers of `_run_handlers`.
+    """
+    handlers = _run_handlers(thread_id, state, resume)
+    try:
+        yield {**config, "callbacks": [*config.get("callbacks", []), *handlers]}
+    finally:
+        _save_handlers(handlers)
+
+
+@asynccontextmanager
+async def _ainstrumented(
+    config: dict, thread_id: str, state: dict, resume: bool = False
+):
+    """
+    `_instrumented` for the async runs. The handlers are saved from a worker
+    thread: a blocking write on the loop would wait for the async checkpoint
+    writer, which needs the loop to commit.
+    """
+    handlers = _run_handlers(thread_id, state, resume)
+    try:
+        yield {**config, "callbacks": [*config.get("callbacks", []), *handlers]}
+    finally:
+        if handlers:
+            await asyncio.to_thread(_save_handlers, handlers)
+
+
+def _deadline(latency_budget: float = None) -> float:
+    # seconds a request may take, the improver loop stops early to meet it.
+    if latency_budget is None:
+        latency_budget = get_section("improver").get("latency_budget", 0)
+    return time.time() + float(latency_budget) if latency_budget else 0.0
+
+
+def _resume_state(
+    values: dict, Input: str, analysis_mode: str = None, deadline: float = 0.0
+) -> dict:
+    state = dict(values)
+    state["task"] = Input
+    state["next_node"] = ""
+    state["deadline"] = deadline
+    if analysis_mode:
+        state["deep_analysis_state"] = {
+            **state["deep_analysis_state"],
+            "analysis_mode": analysis_mode,
+        }
+    return state
+
+
 class RunResearchAssistant:
 
     def __init__(self, share=False):
@@ -13,26 +147,144 @@ class RunResearchAssistant:
         self.threads = []
         self.thread_id = None
         self.config = {}
+        self._thread_locks = weakref.WeakValueDictionary()
 
-    def new_thread(self, Input: str):
+    def new_thread(
+        self, Input: str, analysis_mode: str = "auto", latency_budget: float = None
+    ):
         self.thread_id = str(uuid.uuid4())
-        self.config = {"configurable": {"thread_id": self.thread_id}}
-        state = _initialize_state(Input)
-        return self.agent.main_agent.invoke(state, self.config)
+        self.config = _run_config(self.thread_id)
+        state = _initialize_state(Input, analysis_mode, _deadline(latency_budget))
+        with _instrumented(self.config, self.thread_id, state) as config:
+            return self.agent.main_agent.invoke(state, config)
 
-    def existing_thread(self, Input: str):
+    def existing_thread(
+        self, Input: str, analysis_mode: str = None, latency_budget: float = None
+    ):
         if not self.thread_id:
             raise ValueError("No existing thread_id to resume")
         snapshot = self.agent.main_agent.get_state(self.config)
-        state = dict(snapshot.values)
-        state["task"] = Input
-        state["next_node"] = ""
-        return self.agent.main_agent.invoke(state, config=self.config)
+        state = _resume_state(
+            snapshot.values, Input, analysis_mode, _deadline(latency_budget)
+        )
+        with _instrumented(self.config, self.thread_id, state, resume=True) as config:
+            return self.agent.main_agent.invoke(state, config=config)
 
     def get_current_state(self, thread_id: str):
         config = {"configurable": {"thread_id": thread_id}}
         return self.agent.main_agent.get_state(config)
 
+    # ---------------- async execution (used by the API) ----------------
+    # The API shares one compiled graph across requests, so the async methods
+    # never touch `self.thread_id`/`self.config`: every call carries its own
+    # `ThreadContext`, and calls on the same thread are serialized.
+    def _thread_lock(self, thread_id: str) -> asyncio.Lock:
+        lock = self._thread_locks.get(thread_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._thread_locks[thread_id] = lock
+        return lock
+
+    async def anew_thread(
+        self,
+        Input: str,
+        context: "ThreadContext" = None,
+        analysis_mode: str = "auto",
+        latency_budget: float = None,
+    ):
+        context = context or ThreadContext.create()
+        agent = await self.agent.get_async_agent()
+        state = _initialize_state(Input, analysis_mode, _deadline(latency_budget))
+        async with self._thread_lock(context.thread_id):
+            async with _ainstrumented(
+                context.config, context.thread_id, state
+            ) as config:
+                return await agent.ainvoke(state, config)
+
+    async def aexisting_thread(
+        self,
+        Input: str,
+        context: "ThreadContext",
+        analysis_mode: str = None,
+        latency_budget: float = None,
+    ):
+        agent = await self.agent.get_async_agent()
+        deadline = _deadline(latency_budget)
+        async with self._thread_lock(context.thread_id):
+            snapshot = await agent.aget_state(context.config)
+            if not snapshot.values:
+                raise UnknownThread(f"Unknown thread_id: {context.thread_id}")
+            state = _resume_state(snapshot.values, Input, analysis_mode, deadline)
+            async with _ainstrumented(
+                context.config, context.thread_id, state, resume=True
+            ) as config:
+                return await agent.ainvoke(state, config=config)
+
+    async def astream_thread(
+        self,
+        Input: str,
+        context: "ThreadContext",
+        resume: bool = False,
+        analysis_mode: str = None,
+        latency_budget: float = None,
+    ):
+        """
+        Runs the graph with `astream` and yields progress events: a `start`
+        event once the input state is ready, `node` events as nodes (including
+        the subgraph ones) finish, `token` deltas from the long generations and
+        a closing `done` event with the final output.
+        """
+        agent = await self.agent.get_async_agent()
+        deadline = _deadline(latency_budget)
+        async with self._thread_lock(context.thread_id):
+            if resume:
+                snapshot = await agent.aget_state(context.config)
+                if not snapshot.values:
+                    raise UnknownThread(f"Unknown thread_id: {context.thread_id}")
+                state = _resume_state(snapshot.values, Input, analysis_mode, deadline)
+            else:
+                state = _initialize_state(Input, analysis_mode or "auto", deadline)
+
+            yield {"event": "start", "thread_id": context.thread_id}
+
+            async with _ainstrumented(
+                context.config, context.thread_id, state, resume
+            ) as config:
+                async for namespace, mode, chunk in agent.astream(
+                    state,
+                    config,
+                    stream_mode=["updates", "messages"],
+                    subgraphs=True,
+                ):
+                    graph = namespace[-1].split(":")[0] if namespace else "main"
+                    if mode == "messages":
+                        message, metadata = chunk
+                        node = metadata.get("langgraph_node", "")
+                        if node in TOKEN_STREAM_NODES and message.content:
+                            yield {
+                                "event": "token",
+                                "node": node,
+                                "delta": str(message.content),
+                            }
+                    else:
+                        for node in chunk:
+                            yield {"event": "node", "node": node, "graph": graph}
+
+            snapshot = await agent.aget_state(context.config)
+            yield {
+                "event": "done",
+                "thread_id": context.thread_id,
+                "final_output": snapshot.values["improver_state"]["final_output"],
+                "reflection": snapshot.values["improver_state"]["reflection"],
+            }
+
+    async def aget_current_state(self, thread_id: str):
+        agent = await self.agent.get_async_agent()
+        return await agent.aget_state(ThreadContext.create(thread_id).config)
+
+    async def aclose(self):
+        await self.agent.aclose()
+
 
 # for testing on new user.
 if __name__ == "__main__":
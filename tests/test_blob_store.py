@@ -0,0 +1,48 @@
+import os
+import time
+
+from utils.blob_store import HANDLE_PREFIX, BlobStore
+
+
+def _age(store: BlobStore, handle: str, seconds: float):
+    path = store._path(handle[len(HANDLE_PREFIX) :])
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_prune_keeps_referenced_and_recent_blobs(tmp_path):
+    store = BlobStore(str(tmp_path), ttl=60, min_bytes=10)
+    kept = store.put({"text": "referenced by a kept checkpoint " * 4})
+    stale = store.put({"text": "no checkpoint points here " * 4})
+    recent = store.put({"text": "written a moment ago " * 4})
+    _age(store, kept, 120)
+    _age(store, stale, 120)
+
+    assert store.prune({kept[len(HANDLE_PREFIX) :]}) == 1
+    assert store.resolve(kept) == {"text": "referenced by a kept checkpoint " * 4}
+    assert store.resolve(recent) == {"text": "written a moment ago " * 4}
+    assert store.resolve(stale, "gone") == "gone"
+
+
+def test_prune_without_references_removes_every_expired_blob(tmp_path):
+    store = BlobStore(str(tmp_path), ttl=60, min_bytes=10)
+    handles = [store.put({"text": f"payload {i} " * 8}) for i in range(3)]
+    for handle in handles:
+        _age(store, handle, 120)
+
+    assert store.prune() == 3
+    assert store.stats()["blobs"] == 0
+
+
+def test_stats_follow_put_and_prune(tmp_path):
+    store = BlobStore(str(tmp_path), ttl=60, min_bytes=10)
+    assert store.stats()["blobs"] == 0
+    first = store.put({"text": "first payload " * 8})
+    store.put({"text": "second payload " * 8})
+    store.put({"text": "second payload " * 8})  # same content, one blob
+    stats = store.stats()
+    assert stats["blobs"] == 2 and stats["bytes"] > 0
+
+    _age(store, first, 120)
+    store.prune()
+    assert store.stats()["blobs"] == 1
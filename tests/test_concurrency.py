@@ -0,0 +1,70 @@
+import asyncio
+import threading
+import time
+
+from utils.concurrency import afan_out, fan_out
+
+
+def _sleep(seconds: float) -> float:
+    time.sleep(seconds)
+    return seconds
+
+
+async def _asleep(seconds: float) -> float:
+    await asyncio.sleep(seconds)
+    return seconds
+
+
+def test_fan_out_drops_a_slow_call_after_timeout():
+    started = time.monotonic()
+    results = fan_out(
+        _sleep, [0.05, 2.0, 0.05], threading.BoundedSemaphore(3), 0.3, 3
+    )
+    assert results == [0.05, None, 0.05]
+    assert time.monotonic() - started < 1.0
+
+
+def test_fan_out_times_calls_from_their_slot():
+    # three 0.2s calls through one slot take 0.6s, each within its 0.3s.
+    results = fan_out(_sleep, [0.2, 0.2, 0.2], threading.BoundedSemaphore(1), 0.3, 1)
+    assert results == [0.2, 0.2, 0.2]
+
+
+def test_fan_out_gives_up_on_calls_that_never_get_a_slot():
+    semaphore = threading.BoundedSemaphore(2)
+    for _ in range(2):
+        semaphore.acquire()  # taken by other requests
+    try:
+        started = time.monotonic()
+        assert fan_out(_sleep, [0.01] * 4, semaphore, 0.1, 2) == [None] * 4
+        # two waves of 0.1s.
+        assert time.monotonic() - started < 0.5
+    finally:
+        for _ in range(2):
+            semaphore.release()
+
+
+def test_fan_out_keeps_order_and_drops_failures():
+    def call(item):
+        if item == "bad":
+            raise ValueError(item)
+        return item.upper()
+
+    results = fan_out(call, ["a", "bad", "c"], threading.BoundedSemaphore(2), 1, 2)
+    assert results == ["A", None, "C"]
+
+
+def test_afan_out_drops_a_slow_call_after_timeout():
+    async def run():
+        return await afan_out(_asleep, [0.05, 2.0, 0.05], asyncio.Semaphore(3), 0.3)
+
+    started = time.monotonic()
+    assert asyncio.run(run()) == [0.05, None, 0.05]
+    assert time.monotonic() - started < 1.0
+
+
+def test_afan_out_times_calls_from_their_slot():
+    async def run():
+        return await afan_out(_asleep, [0.2, 0.2, 0.2], asyncio.Semaphore(1), 0.3)
+
+    assert asyncio.run(run()) == [0.2, 0.2, 0.2]
@@ -0,0 +1,90 @@
+import shutil
+from typing import List
+
+import fitz
+import pytest
+from langchain_core.embeddings import Embeddings
+
+import vector_store.Chroma as chroma
+from vector_store.Chroma import Ingester, file_sha256
+
+
+class WordEmbeddings(Embeddings):
+    def __init__(self, model: str = ""):
+        pass
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [[float(len(text)), float(len(text.split())), 1.0] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def _pdf(path, text: str):
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), text)
+    doc.save(str(path))
+    doc.close()
+
+
+@pytest.fixture
+def ingest(tmp_path, monkeypatch):
+    monkeypatch.setattr(chroma, "OllamaEmbeddings", WordEmbeddings)
+    monkeypatch.setattr(chroma, "cached_embeddings", lambda embeddings, _: embeddings)
+    pdf_dir = tmp_path / "pdfs"
+    pdf_dir.mkdir()
+    store = str(tmp_path / "store")
+
+    def run() -> Ingester:
+        ingester = Ingester(store, "fake", backend="numpy", workers=1)
+        ingester.run(str(pdf_dir))
+        return ingester
+
+    return pdf_dir, run
+
+
+def _chunks(ingester: Ingester, sha256: str):
+    ids = [
+        chunk_id
+        for chunk_id in ingester.collection.get(include=[])["ids"]
+        if chunk_id.startswith(f"{sha256}:")
+    ]
+    indexed = ingester.bm25._conn.execute(
+        "SELECT COUNT(*) FROM docs WHERE source_hash = ?", (sha256,)
+    ).fetchone()[0]
+    return len(ids), indexed
+
+
+def test_identical_file_keeps_chunks_when_the_other_changes(ingest):
+    pdf_dir, run = ingest
+    _pdf(pdf_dir / "a.pdf", "diffusion models for music generation")
+    shutil.copy(pdf_dir / "a.pdf", pdf_dir / "b.pdf")
+    shared = file_sha256(pdf_dir / "b.pdf")
+    assert _chunks(run(), shared) == (1, 1)
+
+    _pdf(pdf_dir / "a.pdf", "transformers for audio")
+    ingester = run()
+    assert _chunks(ingester, shared) == (1, 1)
+    assert ingester.manifest.shared_by(shared, "a.pdf") == ["b.pdf"]
+
+    _pdf(pdf_dir / "b.pdf", "something else entirely")
+    assert _chunks(run(), shared) == (0, 0)
+
+
+def test_removed_file_is_dropped_once_no_copy_is_left(ingest):
+    pdf_dir, run = ingest
+    _pdf(pdf_dir / "a.pdf", "retrieval augmented generation")
+    shutil.copy(pdf_dir / "a.pdf", pdf_dir / "b.pdf")
+    _pdf(pdf_dir / "c.pdf", "graph neural networks")
+    shared = file_sha256(pdf_dir / "a.pdf")
+    run()
+
+    (pdf_dir / "a.pdf").unlink()
+    ingester = run()
+    assert _chunks(ingester, shared) == (1, 1)
+    assert "a.pdf" not in ingester.manifest.files
+
+    (pdf_dir / "b.pdf").unlink()
+    ingester = run()
+    assert _chunks(ingester, shared) == (0, 0)
+    assert sorted(ingester.manifest.files) == ["c.pdf"]
@@ -0,0 +1,97 @@
+import asyncio
+
+from utils.llm_scheduler import LLMScheduler
+
+
+async def _queued(scheduler: LLMScheduler, count: int):
+    while scheduler.stats()["queued"] < count:
+        await asyncio.sleep(0)
+
+
+def test_waiting_calls_run_by_class_priority():
+    async def run():
+        scheduler = LLMScheduler(max_in_flight=1)
+        order = []
+
+        async def call(call_class: str):
+            async with scheduler.aslot(call_class, call_class):
+                order.append(call_class)
+
+        held = scheduler.slot("generate", "other")
+        held.__enter__()
+        tasks = []
+        for call_class in ("bulk", "generate", "structured", "router"):
+            tasks.append(asyncio.create_task(call(call_class)))
+            await _queued(scheduler, len(tasks))
+        held.__exit__(None, None, None)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(run()) == ["router", "structured", "generate", "bulk"]
+
+
+def test_thread_with_fewer_calls_in_flight_goes_first():
+    async def run():
+        scheduler = LLMScheduler(max_in_flight=2)
+        order = []
+
+        async def call(label: str, thread_id: str):
+            async with scheduler.aslot("generate", thread_id):
+                order.append(label)
+
+        first = scheduler.slot("generate", "a")
+        second = scheduler.slot("generate", "a")
+        first.__enter__()
+        second.__enter__()
+        a3 = asyncio.create_task(call("a3", "a"))
+        await _queued(scheduler, 1)
+        b1 = asyncio.create_task(call("b1", "b"))
+        await _queued(scheduler, 2)
+        # one slot frees up: "a" still has a call running, "b" none.
+        first.__exit__(None, None, None)
+        await b1
+        second.__exit__(None, None, None)
+        await a3
+        return order
+
+    assert asyncio.run(run()) == ["b1", "a3"]
+
+
+def test_cancelled_calls_give_their_slot_back():
+    async def run():
+        scheduler = LLMScheduler(max_in_flight=1)
+
+        async def call():
+            async with scheduler.aslot("generate", "b"):
+                pass
+
+        held = scheduler.slot("generate", "a")
+        held.__enter__()
+        queued = asyncio.create_task(call())
+        await _queued(scheduler, 1)
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        assert scheduler.stats()["queued"] == 0
+
+        # granted and woken, then cancelled before it resumed.
+        granted = asyncio.create_task(call())
+        await _queued(scheduler, 1)
+        held.__exit__(None, None, None)
+        asyncio.get_running_loop().call_soon(granted.cancel)
+        await asyncio.gather(granted, return_exceptions=True)
+        return scheduler.stats()
+
+    stats = asyncio.run(run())
+    assert stats["in_flight"] == 0 and stats["queued"] == 0
+
+
+def test_sync_slot_is_released_when_the_call_fails():
+    scheduler = LLMScheduler(max_in_flight=1)
+    try:
+        with scheduler.slot("router", "a"):
+            raise RuntimeError("model error")
+    except RuntimeError:
+        pass
+    stats = scheduler.stats()
+    assert stats["in_flight"] == 0
+    assert stats["classes"]["router"]["calls"] == 1
@@ -0,0 +1,290 @@
+import os
+import mmap
+import hashlib
+import logging
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, Iterator, List, Tuple
+
+import fitz
+import httpx
+import requests
+
+from utils.config import get_section
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 16
+DEFAULT_BUFFER_SIZE = 1 << 20  # used when the server sends no Content-Length
+SHM_DIR = "/dev/shm"
+
+
+# ===================== In-memory PDF buffer =====================
+class PDFBuffer:
+    """
+    Downloaded PDF bytes, written straight into a shared memory block so the
+    document is opened from memory (no temp file) and worker processes can map
+    the same bytes instead of receiving a pickled copy. When /dev/shm is full
+    (64 MB by default in Docker) the bytes spill to a temp file instead.
+    """
+
+    def __init__(self, size_hint: int = 0):
+        self._shm = None
+        self._file = None
+        self.size = 0
+        try:
+            self._shm = _shared_memory(size_hint or DEFAULT_BUFFER_SIZE)
+        except OSError as e:
+            self._spill(e)
+
+    def write(self, chunk: bytes):
+        end = self.size + len(chunk)
+        if self._shm is not None and end > self._shm.size:
+            try:
+                self._grow(max(end, self._shm.size * 2))
+            except OSError as e:
+                self._spill(e)
+        if self._shm is None:
+            self._file.write(chunk)
+        else:
+            self._shm.buf[self.size : end] = chunk
+        self.size = end
+
+    def _grow(self, capacity: int):
+        grown = _shared_memory(capacity)
+        grown.buf[: self.size] = self._shm.buf[: self.size]
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = grown
+
+    def _spill(self, error: OSError):
+        logger.warning(f"shared memory unavailable ({error}), buffering PDF on disk")
+        self._file = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+        if self._shm is not None:
+            self._file.write(self._shm.buf[: self.size])
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    @property
+    def source(self) -> Tuple[str, str]:
+        """
+        Where worker processes find the bytes: ("shm", block name) or
+        ("file", path).
+        """
+        if self._shm is not None:
+            return "shm", self._shm.name
+        self._file.flush()
+        return "file", self._file.name
+
+    def view(self) -> memoryview:
+        if self._shm is not None:
+            return self._shm.buf[: self.size]
+        self._file.flush()
+        if not self.size:
+            return memoryview(b"")
+        # mapped, not read: the spill happens when memory is short.
+        return memoryview(
+            mmap.mmap(self._file.fileno(), self.size, access=mmap.ACCESS_READ)
+        )
+
+    def close(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+        if self._file is not None:
+            self._file.close()
+            os.unlink(self._file.name)
+            self._file = None
+
+
+def _shared_memory(size: int) -> SharedMemory:
+    shm = SharedMemory(create=True, size=size)
+    # reserve the pages now: a full tmpfs raises ENOSPC here instead of a
+    # SIGBUS on the first write past the free space.
+    path = os.path.join(SHM_DIR, shm.name.lstrip("/"))
+    if hasattr(os, "posix_fallocate") and os.path.exists(path):
+        try:
+            fd = os.open(path, os.O_RDWR)
+            try:
+                os.posix_fallocate(fd, 0, size)
+            finally:
+                os.close(fd)
+        except OSError:
+            shm.close()
+            shm.unlink()
+            raise
+    return shm
+
+
+class PDFDownload:
+    def __init__(self, status_code: int, headers: Dict[str, str], buffer: PDFBuffer):
+        self.status_code = status_code
+        self.headers = headers
+        self.buffer = buffer
+        self.sha256 = ""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.buffer.close()
+
+
+def _content_length(headers) -> int:
+    try:
+        return int(headers.get("Content-Length", 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def download_pdf(url: str, headers: Dict[str, str] = None, timeout: float = 30):
+    """
+    Streams `url` into a `PDFBuffer`, hashing the bytes on the way. A 304
+    answer comes back with an empty buffer, other errors raise.
+    """
+    with requests.get(url, headers=headers or {}, timeout=timeout, stream=True) as resp:
+        if resp.status_code != 304:
+            resp.raise_for_status()
+        download = PDFDownload(
+            resp.status_code,
+            dict(resp.headers),
+            PDFBuffer(_content_length(resp.headers)),
+        )
+        digest = hashlib.sha256()
+        try:
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                digest.update(chunk)
+                download.buffer.write(chunk)
+        except BaseException:
+            download.buffer.close()
+            raise
+        download.sha256 = digest.hexdigest()
+        return download
+
+
+async def adownload_pdf(
+    client: httpx.AsyncClient, url: str, headers: Dict[str, str] = None
+) -> PDFDownload:
+    async with client.stream("GET", url, headers=headers or {}) as resp:
+        if resp.status_code != 304:
+            resp.raise_for_status()
+        download = PDFDownload(
+            resp.status_code,
+            dict(resp.headers),
+            PDFBuffer(_content_length(resp.headers)),
+        )
+        digest = hashlib.sha256()
+        try:
+            async for chunk in resp.aiter_bytes(CHUNK_SIZE):
+                digest.update(chunk)
+                download.buffer.write(chunk)
+        except BaseException:
+            download.buffer.close()
+            raise
+        download.sha256 = digest.hexdigest()
+        return download
+
+
+# ====================== Page extraction ========================
+def _extract_page_range(
+    source: Tuple[str, str], size: int, start: int, stop: int
+) -> List[str]:
+    # runs in a worker process: map the parent's buffer, parse only our pages.
+    # pool workers share the parent's resource tracker, so attaching here does
+    # not take ownership: the parent still unlinks the block.
+    kind, name = source
+    if kind == "file":
+        doc = fitz.open(name, filetype="pdf")
+        try:
+            return [doc[i].get_text().strip() for i in range(start, stop)]
+        finally:
+            doc.close()
+
+    shm = SharedMemory(name=name)
+    view = shm.buf[:size]
+    try:
+        doc = fitz.open(stream=view, filetype="pdf")
+        texts = [doc[i].get_text().strip() for i in range(start, stop)]
+        doc.close()
+        del doc
+        return texts
+    finally:
+        view.release()
+        shm.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, forking a process that runs the event loop and the sqlite
+            # threads is not safe.
+            _pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def iter_pdf_pages(buffer: PDFBuffer) -> Iterator[str]:
+    """
+    Yields the text of every page in order. Large documents are split into
+    page ranges extracted in a process pool, each range is yielded as soon as
+    it (and the ones before it) are done, so consumers can start early.
+    """
+    config = get_section("pdf_loader")
+    workers = int(config.get("workers", min(4, os.cpu_count() or 1)))
+    min_pages = int(config.get("parallel_min_pages", 16))
+
+    view = buffer.view()
+    doc = fitz.open(stream=view, filetype="pdf")
+    try:
+        page_count = doc.page_count
+        if workers <= 1 or page_count < min_pages:
+            for page in doc:
+                yield page.get_text().strip()
+            return
+    finally:
+        doc.close()
+        del doc
+        view.release()
+
+    pool = _get_pool(workers)
+    step = -(-page_count // workers)
+    futures = [
+        pool.submit(
+            _extract_page_range,
+            buffer.source,
+            buffer.size,
+            start,
+            min(start + step, page_count),
+        )
+        for start in range(0, page_count, step)
+    ]
+    try:
+        for future in futures:
+            yield from future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def extract_text(buffer: PDFBuffer) -> str:
+    return "\n\n".join(text for text in iter_pdf_pages(buffer) if text)
+
+
+def iter_pdf_url_pages(url: str, timeout: float = 30) -> Iterator[str]:
+    """
+    Page generator straight from a URL, the buffer is released once the last
+    page has been yielded (or the consumer stops early).
+    """
+    with download_pdf(url, timeout=timeout) as download:
+        yield from iter_pdf_pages(download.buffer)
@@ -1,19 +1,33 @@
 #!/usr/bin/env python3
 import os
+import asyncio
 from dotenv import load_dotenv
 from typing import Optional, Dict, List, Literal
-from langchain.tools import tool
-from langchain_community.utilities.tavily_search import TavilySearchAPIWrapper
+from langchain.tools import StructuredTool
 import arxiv
 from pydantic import BaseModel, Field
 import json
+import httpx
 import requests
 
 # from pypdf import PdfReader
-import uuid
-import fitz
 import logging
 
+from utils.cache import ToolCache, get_tool_cache
+from utils.concurrency import HostLimiter
+from utils.pdf_cache import PDFTextCache, get_pdf_cache
+from tools.pdf_loader import PDFDownload, adownload_pdf, download_pdf, extract_text
+from utils.config import get_section
+
+TAVILY_HOST = "api.tavily.com"
+TAVILY_API_URL = f"https://{TAVILY_HOST}"
+# shared by every web_search fan-out in the process.
+host_limiter = HostLimiter(
+    int(get_section("web_search").get("max_concurrency_per_host", 4))
+)
+# seconds, per HTTP request of a single query.
+QUERY_TIMEOUT = float(get_section("web_search").get("query_timeout", 15))
+
 
 # ====================== Web Search Tool =======================
 class SearchInput(BaseModel):
@@ -24,25 +38,110 @@ class SearchInput(BaseModel):
     )  # only works for paid plans.
 
 
-@tool(args_schema=SearchInput)
-def search_web(
+load_dotenv()
+
+
+def _tavily_params(query: str, max_results: int, include_raw_content: bool) -> Dict:
+    return {
+        "api_key": os.getenv("TAVILY_API_KEY", ""),
+        "query": query,
+        "max_results": max_results,
+        "search_depth": "advanced",
+        "include_raw_content": include_raw_content,
+    }
+
+
+def _clean_results(results: List[Dict]) -> List[Dict]:
+    # the fields LangChain's Tavily wrapper kept.
+    cleaned = []
+    for result in results:
+        item = {key: result[key] for key in ("title", "url", "content", "score")}
+        if result.get("raw_content"):
+            item["raw_content"] = result["raw_content"]
+        cleaned.append(item)
+    return cleaned
+
+
+# called directly, with a timeout: a hung query would keep its worker, and its
+# host slot, long after the fan-out dropped it.
+def _tavily_results(
+    query: str, max_results: int, include_raw_content: bool
+) -> List[Dict]:
+    response = requests.post(
+        f"{TAVILY_API_URL}/search",
+        json=_tavily_params(query, max_results, include_raw_content),
+        timeout=QUERY_TIMEOUT,
+    )
+    response.raise_for_status()
+    return _clean_results(response.json()["results"])
+
+
+async def _atavily_results(
+    query: str, max_results: int, include_raw_content: bool
+) -> List[Dict]:
+    async with httpx.AsyncClient(timeout=QUERY_TIMEOUT) as client:
+        response = await client.post(
+            f"{TAVILY_API_URL}/search",
+            json=_tavily_params(query, max_results, include_raw_content),
+        )
+        response.raise_for_status()
+    return _clean_results(response.json()["results"])
+
+
+def _search_web_key(query: str, max_results: int, include_raw_content: bool) -> str:
+    return ToolCache.make_key(
+        "search_web",
+        query,
+        max_results=max_results,
+        include_raw_content=include_raw_content,
+    )
+
+
+def _search_web(
     query: str, max_results: int = 3, include_raw_content: bool = False
 ) -> List[Dict]:
     """
     Search the web for real time information and return the top results.
     """
+    key = _search_web_key(query, max_results, include_raw_content)
+    cached = get_tool_cache().get(key)
+    if cached is not None:
+        return cached
+
     try:
-        load_dotenv()
-        search = TavilySearchAPIWrapper(tavily_api_key=os.getenv("TAVILY_API_KEY"))
-        results = search.results(
-            query=query,
-            max_results=max_results,
-            include_raw_content=include_raw_content,
-        )
-        return results
+        results = _tavily_results(query, max_results, include_raw_content)
     except Exception as e:
         return [{"ERROR": str(e)}]
 
+    get_tool_cache().set(key, results)
+    return results
+
+
+async def _asearch_web(
+    query: str, max_results: int = 3, include_raw_content: bool = False
+) -> List[Dict]:
+    key = _search_web_key(query, max_results, include_raw_content)
+    # sqlite reads and writes may wait on other writers, keep them off the loop.
+    cached = await asyncio.to_thread(get_tool_cache().get, key)
+    if cached is not None:
+        return cached
+
+    try:
+        results = await _atavily_results(query, max_results, include_raw_content)
+    except Exception as e:
+        return [{"ERROR": str(e)}]
+
+    await asyncio.to_thread(get_tool_cache().set, key, results)
+    return results
+
+
+search_web = StructuredTool.from_function(
+    func=_search_web,
+    coroutine=_asearch_web,
+    name="search_web",
+    args_schema=SearchInput,
+)
+
 
 # ===================== ArXiv Search Tool ======================
 class ArxivSearchInput(BaseModel):
@@ -53,22 +152,30 @@ class ArxivSearchInput(BaseModel):
     )
 
 
-@tool(args_schema=ArxivSearchInput)
-def arxiv_search(
+_arxiv_client = arxiv.Client()
+
+
+def _arxiv_search(
     query: str, max_results: int = 1, sort_by: str = "relevance"
 ) -> List[Dict]:
     """
     Search the arxiv for real time information and return the top paper metadata.
     """
+    key = ToolCache.make_key(
+        "arxiv_search", query, max_results=max_results, sort_by=sort_by
+    )
+    cached = get_tool_cache().get(key)
+    if cached is not None:
+        return cached
+
     try:
-        client = arxiv.Client()
         search_arxiv = arxiv.Search(
             query=query,
             max_results=max_results,
             sort_by=arxiv.SortCriterion(sort_by),
         )
         results = []
-        for result in client.results(search_arxiv):
+        for result in _arxiv_client.results(search_arxiv):
             results.append(
                 {
                     "PDF_URL": result.pdf_url + ".pdf",
@@ -77,10 +184,27 @@ def arxiv_search(
                     "Publish Date": result.published.isoformat(),
                 }
             )
-        return results
     except Exception as e:
         return [{"ERROR": str(e)}]
 
+    get_tool_cache().set(key, results)
+    return results
+
+
+async def _aarxiv_search(
+    query: str, max_results: int = 1, sort_by: str = "relevance"
+) -> List[Dict]:
+    # the arxiv client is blocking (feedparser + requests), keep it off the loop.
+    return await asyncio.to_thread(_arxiv_search, query, max_results, sort_by)
+
+
+arxiv_search = StructuredTool.from_function(
+    func=_arxiv_search,
+    coroutine=_aarxiv_search,
+    name="arxiv_search",
+    args_schema=ArxivSearchInput,
+)
+
 
 # ================= load pdf for analysis ================
 logger = logging.getLogger(__name__)
@@ -98,41 +222,91 @@ def _normalize_arxiv_pdf_url(url: str) -> str:
     return url
 
 
-@tool(args_schema=LoadPDFInput, return_direct=True)
-def load_pdf(url: str) -> str:
+def _store_pdf(cache: PDFTextCache, source_key: str, download: PDFDownload) -> str:
+    # the same bytes may already be cached under another URL.
+    text = cache.read_text(download.sha256)
+    if text is None:
+        text = extract_text(download.buffer)
+    if text:
+        cache.store(
+            source_key,
+            download.sha256,
+            text,
+            etag=download.headers.get("ETag", ""),
+            last_modified=download.headers.get("Last-Modified", ""),
+        )
+    return text
+
+
+def _load_pdf(url: str) -> str:
     """
-    Downloads a PDF from `url`, extracts all text using PyMuPDF (fitz),
-    and returns the concatenated text. Cleans up temp file on exit.
+    Downloads a PDF from `url` into memory, extracts all text using PyMuPDF
+    (fitz) and returns the concatenated text. Extracted text is cached per
+    arXiv id / URL, stale entries are revalidated with a conditional request.
     """
-    # Generate a unique temp filename
-    temp_filename = f"/tmp/{uuid.uuid4().hex}.pdf"
     url = _normalize_arxiv_pdf_url(url)
+    cache = get_pdf_cache()
+    source_key = cache.source_key(url)
+    entry = cache.lookup(source_key)
+    if entry is not None and cache.is_fresh(entry):
+        text = cache.read_text(entry.content_hash)
+        if text is not None:
+            return text
+
     try:
         # Download PDF
-        resp = requests.get(url, timeout=30)
-        resp.raise_for_status()
-        with open(temp_filename, "wb") as f:
-            f.write(resp.content)
-
-        # Extract text with PyMuPDF
-        doc = fitz.open(temp_filename)
-        all_text = []
-        for page in doc:
-            text = page.get_text().strip()
-            if text:
-                all_text.append(text)
-        doc.close()
-
-        return "\n\n".join(all_text)
+        with download_pdf(url, cache.conditional_headers(entry)) as download:
+            if download.status_code == 304:
+                text = cache.read_text(entry.content_hash)
+                if text is not None:
+                    cache.mark_validated(source_key)
+                    return text
+            else:
+                return _store_pdf(cache, source_key, download)
+
+        with download_pdf(url) as download:
+            return _store_pdf(cache, source_key, download)
 
     except Exception as e:
         logger.error(f"Failed to load or parse PDF at {url}: {e}")
         return ""  # or raise, depending on how you want upstream to handle failures
 
-    finally:
-        # Cleanup temp file
-        try:
-            if os.path.exists(temp_filename):
-                os.remove(temp_filename)
-        except OSError as cleanup_err:
-            logger.warning(f"Could not delete temp file {temp_filename}: {cleanup_err}")
+
+async def _aload_pdf(url: str) -> str:
+    url = _normalize_arxiv_pdf_url(url)
+    cache = get_pdf_cache()
+    source_key = cache.source_key(url)
+    entry = await asyncio.to_thread(cache.lookup, source_key)
+    if entry is not None and cache.is_fresh(entry):
+        text = await asyncio.to_thread(cache.read_text, entry.content_hash)
+        if text is not None:
+            return text
+
+    try:
+        async with httpx.AsyncClient(timeout=30, follow_redirects=True) as client:
+            download = await adownload_pdf(
+                client, url, cache.conditional_headers(entry)
+            )
+            if download.status_code == 304:
+                download.buffer.close()
+                text = await asyncio.to_thread(cache.read_text, entry.content_hash)
+                if text is not None:
+                    await asyncio.to_thread(cache.mark_validated, source_key)
+                    return text
+                download = await adownload_pdf(client, url)
+        with download:
+            # PyMuPDF parsing is CPU bound, keep it off the loop.
+            return await asyncio.to_thread(_store_pdf, cache, source_key, download)
+
+    except Exception as e:
+        logger.error(f"Failed to load or parse PDF at {url}: {e}")
+        return ""
+
+
+load_pdf = StructuredTool.from_function(
+    func=_load_pdf,
+    coroutine=_aload_pdf,
+    name="load_pdf",
+    args_schema=LoadPDFInput,
+    return_direct=True,
+)
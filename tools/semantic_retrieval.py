@@ -1,28 +1,214 @@
-from langchain_community.vectorstores import Chroma
+import os
+import asyncio
+import logging
+import threading
 from langchain_ollama import OllamaEmbeddings
-from typing import List, Dict
+from typing import List, Dict, Literal, Optional
 from pydantic import BaseModel
-from langchain.tools import tool
+from langchain.tools import StructuredTool
+
+from utils.config import get_section
+from utils.embedding_cache import cached_embeddings
+from vector_store.bm25 import BM25Index, reciprocal_rank_fusion
+from vector_store.chroma_store import chroma_collection
+from vector_store.numpy_store import NumpyVectorStore
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
 class SemnaticInput(BaseModel):
     query: str
+    mode: Optional[Literal["dense", "hybrid"]] = None
+
+
+class VectorSearchInput(BaseModel):
+    queries: List[str]
+    k: Optional[int] = None
+    mode: Optional[Literal["dense", "hybrid"]] = None
 
 
-@tool(args_schema=SemnaticInput)
-def semantic_retrieval(
-    query: str,
-    chroma_dir: str = "/Users/mac/Desktop/Projects/Scripts/research_assistant/vector_store/Chroma_vs",
-    model: str = "llama3.1:8b-instruct-q4_K_M",
-) -> List[Dict]:
+# ================== Shared Retrieval Service ===================
+class RetrievalService:
     """
-    do semantic retrieval from a vector store of mesh and StyleGAN topics
+    Long-lived handle on the persistent vector store (a Chroma collection or,
+    with `backend="numpy"`, a memory-mapped `NumpyVectorStore`) and its
+    embedding client. The store is opened lazily on first use and then reused by every
+    thread, all the queries of a node are embedded in one request and searched
+    in one batch.
+
+    In `hybrid` mode the dense hits are fused (reciprocal rank fusion) with
+    the BM25 index built at ingestion, `dense` only queries Chroma.
     """
-    embeddings = OllamaEmbeddings(model=model)
-    vector_store = Chroma(persist_directory=chroma_dir, embedding_function=embeddings)
-    retriever = vector_store.as_retriever(
-        search_type="similarity", search_kwargs={"k": 10}
-    )
-    full_results = retriever.invoke(query)
-
-    return [{"retrieved_content": result.page_content} for result in full_results]
+
+    def __init__(
+        self,
+        chroma_dir: str,
+        model: str,
+        k: int = 10,
+        mode: str = "hybrid",
+        candidates: int = 20,
+        rrf_k: int = 60,
+        backend: str = "chroma",
+        nprobe: int = 8,
+    ):
+        self.chroma_dir = chroma_dir
+        self.model = model
+        self.k = k
+        self.mode = mode
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.backend = backend
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+        self._embeddings = None
+        self._collection = None
+        self._bm25 = None
+
+    @classmethod
+    def from_config(cls, config: dict) -> "RetrievalService":
+        backend = config.get("backend", "chroma")
+        if backend == "numpy":
+            store_dir = config.get("numpy_dir", "vector_store/Numpy_vs")
+        else:
+            store_dir = config.get("chroma_dir", "vector_store/Chroma_vs")
+        return cls(
+            chroma_dir=os.path.join(ROOT_DIR, store_dir),
+            model=config.get("embedding_model", "llama3.1:8b-instruct-q4_K_M"),
+            k=int(config.get("k", 10)),
+            mode=config.get("retrieval_mode", "hybrid"),
+            candidates=int(config.get("hybrid_candidates", 20)),
+            rrf_k=int(config.get("rrf_k", 60)),
+            backend=backend,
+            nprobe=int(config.get("nprobe", 8)),
+        )
+
+    def _open(self):
+        if self._collection is None:
+            with self._lock:
+                if self._collection is None:
+                    self._embeddings = cached_embeddings(
+                        OllamaEmbeddings(model=self.model), self.model
+                    )
+                    if BM25Index.exists(self.chroma_dir):
+                        self._bm25 = BM25Index(self.chroma_dir)
+                    elif self.mode == "hybrid":
+                        logger.warning(
+                            "No BM25 index next to the vector store, hybrid "
+                            "retrieval falls back to dense search. Re-run the "
+                            "ingestion with --rebuild-bm25 to build it."
+                        )
+                    if self.backend == "numpy":
+                        self._collection = NumpyVectorStore(
+                            self.chroma_dir, nprobe=self.nprobe
+                        )
+                    else:
+                        self._collection = chroma_collection(self.chroma_dir)
+        return self._collection
+
+    def search_many(
+        self, queries: List[str], k: int = None, mode: str = None
+    ) -> List[List[Dict]]:
+        """
+        Returns one list of hits per query, in the order of `queries`.
+        """
+        if not queries:
+            return []
+        k = k or self.k
+        collection = self._open()
+        hybrid = (mode or self.mode) == "hybrid" and self._bm25 is not None
+
+        vectors = self._embeddings.embed_documents(queries)
+        results = collection.query(
+            query_embeddings=vectors,
+            n_results=max(k, self.candidates) if hybrid else k,
+            include=["documents", "metadatas"],
+        )
+        if not hybrid:
+            return [
+                [{"retrieved_content": document} for document in documents]
+                for documents in results["documents"]
+            ]
+
+        documents = {}
+        rankings = []
+        for query, ids, texts in zip(queries, results["ids"], results["documents"]):
+            documents.update(zip(ids, texts))
+            lexical = [doc_id for doc_id, _ in self._bm25.search(query, self.candidates)]
+            rankings.append(reciprocal_rank_fusion([ids, lexical], self.rrf_k)[:k])
+
+        # lexical-only hits were not returned by Chroma, fetch them in one call.
+        missing = list({i for ranking in rankings for i in ranking} - documents.keys())
+        if missing:
+            fetched = collection.get(ids=missing, include=["documents"])
+            documents.update(zip(fetched["ids"], fetched["documents"]))
+
+        return [
+            [{"retrieved_content": documents[i]} for i in ranking if i in documents]
+            for ranking in rankings
+        ]
+
+    async def asearch_many(
+        self, queries: List[str], k: int = None, mode: str = None
+    ) -> List[List[Dict]]:
+        # the store and the embedding client are synchronous, keep them off the loop.
+        return await asyncio.to_thread(self.search_many, queries, k, mode)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_retrieval_service() -> RetrievalService:
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = RetrievalService.from_config(get_section("vector_store"))
+        return _service
+
+
+# ==================== Semantic Retrieval Tool ==================
+def _semantic_retrieval(query: str, mode: str = None) -> List[Dict]:
+    """
+    do semantic retrieval from a vector store of mesh and StyleGAN topics,
+    `hybrid` mode also matches exact terms ( model names, acronyms ).
+    """
+    return get_retrieval_service().search_many([query], mode=mode)[0]
+
+
+async def _asemantic_retrieval(query: str, mode: str = None) -> List[Dict]:
+    return (await get_retrieval_service().asearch_many([query], mode=mode))[0]
+
+
+semantic_retrieval = StructuredTool.from_function(
+    func=_semantic_retrieval,
+    coroutine=_asemantic_retrieval,
+    name="semantic_retrieval",
+    args_schema=SemnaticInput,
+)
+
+
+# the batch form used by the search agent, one list of hits per query.
+def _vector_search(
+    queries: List[str], k: int = None, mode: str = None
+) -> List[List[Dict]]:
+    """
+    semantic retrieval of several queries in one batch, one list of hits per
+    query, in the order of `queries`.
+    """
+    return get_retrieval_service().search_many(queries, k, mode)
+
+
+async def _avector_search(
+    queries: List[str], k: int = None, mode: str = None
+) -> List[List[Dict]]:
+    return await get_retrieval_service().asearch_many(queries, k, mode)
+
+
+vector_search = StructuredTool.from_function(
+    func=_vector_search,
+    coroutine=_avector_search,
+    name="vector_search",
+    args_schema=VectorSearchInput,
+)
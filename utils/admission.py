@@ -0,0 +1,97 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a run cannot be admitted, carries the HTTP status to answer with.
+    """
+
+    def __init__(self, status_code: int, retry_after: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+class AdmissionController:
+    """
+    Bounded admission queue: at most `max_concurrency` runs execute at once and
+    at most `max_queue` wait for a slot. A full queue is rejected right away
+    (429), a run that waited longer than `queue_timeout` is rejected with 503.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        max_queue: int = 32,
+        queue_timeout: float = 60,
+        retry_after: int = 10,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._waiting = 0
+        self._running = 0
+
+    @classmethod
+    def from_config(cls, config: dict) -> "AdmissionController":
+        return cls(
+            max_concurrency=int(config.get("max_concurrency", 4)),
+            max_queue=int(config.get("max_queue", 32)),
+            queue_timeout=float(config.get("queue_timeout", 60)),
+            retry_after=int(config.get("retry_after", 10)),
+        )
+
+    async def acquire(self):
+        if not self._semaphore.locked():
+            # a free slot is taken without suspending, so `locked()` is
+            # already accurate for the requests arriving right after this one.
+            await self._semaphore.acquire()
+        else:
+            if self._waiting >= self.max_queue:
+                raise AdmissionRejected(
+                    429,
+                    self.retry_after,
+                    "Too many queued research tasks, retry later.",
+                )
+
+            self._waiting += 1
+            acquiring = asyncio.ensure_future(self._semaphore.acquire())
+            try:
+                await asyncio.wait_for(acquiring, self.queue_timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                # before 3.12, wait_for can give up after the acquire went
+                # through: the slot is ours, give it back.
+                if acquiring.done() and not acquiring.cancelled():
+                    self._semaphore.release()
+                if isinstance(e, asyncio.TimeoutError):
+                    raise AdmissionRejected(
+                        503, self.retry_after, "No worker became available in time."
+                    )
+                raise
+            finally:
+                self._waiting -= 1
+        self._running += 1
+
+    def release(self):
+        self._running -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "running": self._running,
+            "queued": self._waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+        }
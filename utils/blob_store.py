@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import zlib
+import hashlib
+import logging
+import threading
+from functools import lru_cache
+from typing import Any, Optional, Set
+
+from utils.cache import parse_ttl
+from utils.config import load_config
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HANDLE_PREFIX = "blob:sha256:"
+
+
+def is_handle(value: Any) -> bool:
+    return isinstance(value, str) and value.startswith(HANDLE_PREFIX)
+
+
+class BlobStore:
+    """
+    Content-addressed store for the large state payloads (paper text, search
+    hits): the graph state keeps a `blob:sha256:<hex>` handle and the payload
+    is written once, compressed, to `<dir>/<hex[:2]>/<hex>.z`. Values smaller
+    than `min_bytes` stay inline. Blobs no checkpoint refers to any more are
+    removed by `prune` (with the checkpoint retention) once nobody read or
+    wrote them for `ttl` seconds.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        ttl: int = 86400,
+        min_bytes: int = 2048,
+        memory_entries: int = 64,
+    ):
+        self.directory = directory
+        self.ttl = ttl
+        self.min_bytes = min_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # files and bytes on disk, counted once and then kept up to date by
+        # put / prune (recounted by every prune).
+        self._blobs: Optional[int] = None
+        self._bytes = 0
+        # blobs are immutable, recently resolved ones are kept decoded.
+        self._load = lru_cache(maxsize=memory_entries)(self._read)
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config: dict, ttl) -> "BlobStore":
+        return cls(
+            directory=os.path.join(ROOT_DIR, config.get("dir", "cache/blobs")),
+            ttl=parse_ttl(config.get("ttl") or ttl),
+            min_bytes=int(config.get("min_bytes", 2048)),
+            memory_entries=int(config.get("memory_entries", 64)),
+        )
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], f"{digest}.z")
+
+    def put(self, value: Any) -> Any:
+        """
+        Returns a handle for `value`, or `value` itself when it is small.
+        """
+        data = json.dumps(value, ensure_ascii=False).encode()
+        if len(data) < self.min_bytes:
+            return value
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if os.path.exists(path):
+            # same content, keeps it from being pruned.
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            compressed = zlib.compress(data, 6)
+            with open(tmp_path, "wb") as f:
+                f.write(compressed)
+            os.replace(tmp_path, path)
+            with self._lock:
+                if self._blobs is not None:
+                    self._blobs += 1
+                    self._bytes += len(compressed)
+        return HANDLE_PREFIX + digest
+
+    def _read(self, digest: str) -> Any:
+        with open(self._path(digest), "rb") as f:
+            return json.loads(zlib.decompress(f.read()))
+
+    def resolve(self, value: Any, default: Any = None) -> Any:
+        """
+        Payload behind a handle. Inline values (and the state of threads
+        created before handles existed) are returned as they are.
+        """
+        if not is_handle(value):
+            return value
+        digest = value[len(HANDLE_PREFIX) :]
+        try:
+            payload = self._load(digest)
+            os.utime(self._path(digest))
+        except FileNotFoundError:
+            logger.warning(f"Blob {digest[:12]} is gone (pruned?), using a default")
+            with self._lock:
+                self.misses += 1
+            return default
+        with self._lock:
+            self.hits += 1
+        return payload
+
+    def resolve_all(self, value: Any) -> Any:
+        """
+        `value` with the handles found in its dicts and lists resolved.
+        """
+        if isinstance(value, dict):
+            return {key: self.resolve_all(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.resolve_all(item) for item in value]
+        return self.resolve(value)
+
+    def prune(self, referenced: Optional[Set[str]] = None) -> int:
+        """
+        Removes the blobs unused for `ttl` seconds, except the `referenced`
+        digests. The ttl also covers a handle written to the state but not yet
+        checkpointed.
+        """
+        cutoff = time.time() - self.ttl
+        referenced = referenced or set()
+        removed, kept, size = 0, 0, 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                    if name.split(".", 1)[0] not in referenced and (
+                        stat.st_mtime < cutoff
+                    ):
+                        os.remove(path)
+                        removed += 1
+                        continue
+                except FileNotFoundError:
+                    continue
+                kept += 1
+                size += stat.st_size
+        with self._lock:
+            self._blobs, self._bytes = kept, size
+        if removed:
+            self._load.cache_clear()
+        return removed
+
+    def _count(self):
+        count, size = 0, 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                try:
+                    size += os.path.getsize(os.path.join(root, name))
+                    count += 1
+                except FileNotFoundError:
+                    continue
+        with self._lock:
+            if self._blobs is None:
+                self._blobs, self._bytes = count, size
+
+    def stats(self) -> dict:
+        # called by /health: no directory walk past the first call.
+        if self._blobs is None:
+            self._count()
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "blobs": self._blobs,
+                "bytes": self._bytes,
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            config = load_config()
+            _store = BlobStore.from_config(
+                config.get("blob_store") or {}, config.get("ttl")
+            )
+        return _store
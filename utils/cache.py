@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+from typing import Any, Optional
+
+from utils.config import load_config
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_ttl(value, default: int = 86400) -> int:
+    # `ttl` may be left empty in config.yaml
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class ToolCache:
+    """
+    On-disk (SQLite) cache for tool results. Entries expire after `ttl`
+    seconds, the least recently used ones are evicted past `max_entries`.
+    """
+
+    def __init__(self, path: str, ttl: int = 86400, max_entries: int = 5000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tool_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS tool_cache_lru ON tool_cache (last_access)"
+        )
+        self._conn.commit()
+
+    @classmethod
+    def from_config(cls, config: dict, ttl) -> "ToolCache":
+        return cls(
+            path=os.path.join(ROOT_DIR, config.get("path", "cache/tool_cache.sqlite")),
+            ttl=parse_ttl(ttl),
+            max_entries=int(config.get("max_entries", 5000)),
+        )
+
+    @staticmethod
+    def make_key(namespace: str, query: str, **params) -> str:
+        normalized = " ".join(query.lower().split())
+        payload = json.dumps([namespace, normalized, params], sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM tool_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._conn.execute("DELETE FROM tool_cache WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                "UPDATE tool_cache SET last_access = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tool_cache VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now),
+            )
+            self._conn.execute(
+                """
+                DELETE FROM tool_cache WHERE key IN (
+                    SELECT key FROM tool_cache ORDER BY last_access ASC
+                    LIMIT max(0, (SELECT COUNT(*) FROM tool_cache) - ?)
+                )
+                """,
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            (entries,) = self._conn.execute(
+                "SELECT COUNT(*) FROM tool_cache"
+            ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+
+_tool_cache = None
+_tool_cache_lock = threading.Lock()
+
+
+def get_tool_cache() -> ToolCache:
+    global _tool_cache
+    with _tool_cache_lock:
+        if _tool_cache is None:
+            config = load_config()
+            _tool_cache = ToolCache.from_config(
+                config.get("tool_cache") or {}, config.get("ttl")
+            )
+        return _tool_cache
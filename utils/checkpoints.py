@@ -0,0 +1,445 @@
+import os
+import re
+import time
+import uuid
+import sqlite3
+import logging
+import argparse
+import itertools
+import threading
+from typing import Any, Dict, List, Optional, Set
+
+import aiosqlite
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+from utils.blob_store import HANDLE_PREFIX, get_blob_store
+from utils.cache import parse_ttl
+from utils.config import load_config
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_PATH = "checkpoints/checkpoints.sqlite"
+# uuid v6 timestamps count 100ns intervals since 1582-10-15.
+UUID_EPOCH = 0x01B21DD213814000
+PRAGMAS = (
+    # lets the janitor give free pages back in small steps, a full VACUUM holds
+    # the write lock for the whole file (new files only, older ones need one
+    # `CheckpointJanitor.vacuum`).
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    # with WAL, NORMAL only syncs on wal checkpoints and stays crash safe.
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+# blob handles in the serialized checkpoints, see `_referenced_blobs`.
+BLOB_HANDLE = re.compile(re.escape(HANDLE_PREFIX.encode()) + rb"([0-9a-f]{64})")
+# primary keys of the saver's tables.
+ROW_KEYS = {
+    "checkpoints": ("thread_id", "checkpoint_ns", "checkpoint_id"),
+    "writes": ("thread_id", "checkpoint_ns", "checkpoint_id", "task_id", "idx"),
+}
+
+
+def checkpoint_path() -> str:
+    return (load_config().get("checkpoints") or {}).get("path", CHECKPOINT_PATH)
+
+
+def connect(path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+async def aconnect(path: str) -> aiosqlite.Connection:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = await aiosqlite.connect(path)
+    for pragma in PRAGMAS:
+        await conn.execute(pragma)
+    return conn
+
+
+def checkpoint_time(checkpoint_id: str) -> float:
+    # checkpoint ids are uuid6, time ordered, and carry their creation time.
+    value = uuid.UUID(checkpoint_id).int
+    ticks = (
+        ((value >> 96) << 28)
+        | (((value >> 80) & 0xFFFF) << 12)
+        | ((value >> 64) & 0x0FFF)
+    )
+    return (ticks - UUID_EPOCH) / 1e7
+
+
+# ======================= Savers ========================
+class PooledSqliteSaver(SqliteSaver):
+    """
+    SqliteSaver that writes through its own connection (one writer, queued on
+    the saver lock) and reads through a few reader connections, so loading a
+    thread does not wait behind the checkpoint writes of the other threads.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, readers: List[SqliteSaver] = ()):
+        super().__init__(conn)
+        self.readers = list(readers)
+        self._next_reader = itertools.count()
+
+    @classmethod
+    def from_path(cls, path: str, readers: int = 2) -> "PooledSqliteSaver":
+        saver = cls(
+            connect(path), [SqliteSaver(connect(path)) for _ in range(readers)]
+        )
+        saver.setup()
+        return saver
+
+    def _reader(self) -> SqliteSaver:
+        if not self.readers:
+            return super()
+        return self.readers[next(self._next_reader) % len(self.readers)]
+
+    def get_tuple(self, config: RunnableConfig):
+        return self._reader().get_tuple(config)
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ):
+        yield from self._reader().list(
+            config, filter=filter, before=before, limit=limit
+        )
+
+
+class PooledAsyncSqliteSaver(AsyncSqliteSaver):
+    """
+    Async counterpart of `PooledSqliteSaver`: every aiosqlite connection runs
+    its own thread, writes are queued on the writer one.
+    """
+
+    def __init__(
+        self, conn: aiosqlite.Connection, readers: List[AsyncSqliteSaver] = ()
+    ):
+        super().__init__(conn)
+        self.readers = list(readers)
+        self._next_reader = itertools.count()
+
+    @classmethod
+    async def from_path(
+        cls, path: str, readers: int = 2
+    ) -> "PooledAsyncSqliteSaver":
+        saver = cls(await aconnect(path))
+        # the tables must exist before the readers query them.
+        await saver.setup()
+        for _ in range(readers):
+            reader = AsyncSqliteSaver(await aconnect(path))
+            await reader.setup()
+            saver.readers.append(reader)
+        return saver
+
+    def _reader(self) -> AsyncSqliteSaver:
+        if not self.readers:
+            return super()
+        return self.readers[next(self._next_reader) % len(self.readers)]
+
+    async def aget_tuple(self, config: RunnableConfig):
+        return await self._reader().aget_tuple(config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ):
+        async for item in self._reader().alist(
+            config, filter=filter, before=before, limit=limit
+        ):
+            yield item
+
+    async def aclose(self):
+        for reader in self.readers:
+            await reader.conn.close()
+        self.readers = []
+        await self.conn.close()
+
+
+# ======================= Retention ========================
+class CheckpointJanitor:
+    """
+    Retention for the checkpoint file, applied by a background thread every
+    `interval` seconds (or once, with `prune`):
+      - threads idle for more than `idle_ttl` seconds are deleted,
+      - a thread keeps its last `keep_last` checkpoints, the subgraph ones of
+        already finished agent runs are dropped,
+      - writes of deleted checkpoints are dropped,
+      - once `vacuum_ratio` of its pages are free, they are given back with
+        incremental vacuum steps of `vacuum_step_pages` (a full VACUUM only
+        runs from the command line, `--vacuum`),
+      - state blobs (utils.blob_store) no kept checkpoint or write refers
+        to are removed past their ttl.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        keep_last: int = 5,
+        idle_ttl: int = 86400,
+        interval: int = 600,
+        vacuum_ratio: float = 0.25,
+        vacuum_step_pages: int = 256,
+    ):
+        self.path = path
+        self.keep_last = keep_last
+        self.idle_ttl = idle_ttl
+        self.interval = interval
+        self.vacuum_ratio = vacuum_ratio
+        self.vacuum_step_pages = vacuum_step_pages
+        self.last_run: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._conn = connect(path)
+        # blob digests per checkpoint / write row, rows are scanned once.
+        self._blob_refs: Dict[tuple, Set[str]] = {}
+
+    @classmethod
+    def from_config(cls, config: dict, ttl) -> "CheckpointJanitor":
+        return cls(
+            path=config.get("path", CHECKPOINT_PATH),
+            keep_last=max(1, int(config.get("keep_last", 5))),
+            idle_ttl=parse_ttl(config.get("idle_ttl") or ttl),
+            interval=int(config.get("prune_interval", 600)),
+            vacuum_ratio=float(config.get("vacuum_ratio", 0.25)),
+            vacuum_step_pages=int(config.get("vacuum_step_pages", 256)),
+        )
+
+    def _has_tables(self) -> bool:
+        row = self._conn.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE name IN ('checkpoints', 'writes')"
+        ).fetchone()
+        return row[0] == 2
+
+    def _idle_threads(self) -> List[str]:
+        cutoff = time.time() - self.idle_ttl
+        rows = self._conn.execute(
+            "SELECT thread_id, MAX(checkpoint_id) FROM checkpoints GROUP BY thread_id"
+        ).fetchall()
+        return [
+            thread_id for thread_id, latest in rows if checkpoint_time(latest) < cutoff
+        ]
+
+    def prune(self) -> Dict[str, Any]:
+        start = time.perf_counter()
+        result = {"threads_expired": 0, "checkpoints_deleted": 0, "writes_deleted": 0}
+        with self._lock:
+            if not self._has_tables():
+                return result
+            with self._conn:
+                expired = self._idle_threads()
+                for thread_id in expired:
+                    self._conn.execute(
+                        "DELETE FROM writes WHERE thread_id = ?", (thread_id,)
+                    )
+                    result["checkpoints_deleted"] += self._conn.execute(
+                        "DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,)
+                    ).rowcount
+                result["threads_expired"] = len(expired)
+
+                result["checkpoints_deleted"] += self._conn.execute(
+                    """
+                    DELETE FROM checkpoints
+                    WHERE checkpoint_ns = '' AND (thread_id, checkpoint_id) IN (
+                        SELECT thread_id, checkpoint_id FROM (
+                            SELECT thread_id, checkpoint_id, ROW_NUMBER() OVER (
+                                PARTITION BY thread_id ORDER BY checkpoint_id DESC
+                            ) AS position
+                            FROM checkpoints WHERE checkpoint_ns = ''
+                        ) WHERE position > ?
+                    )
+                    """,
+                    (self.keep_last,),
+                ).rowcount
+                # a subgraph run is over once its parent checkpointed after it,
+                # one still running (or interrupted) is newer than that.
+                result["checkpoints_deleted"] += self._conn.execute(
+                    """
+                    DELETE FROM checkpoints
+                    WHERE checkpoint_ns != '' AND (thread_id, checkpoint_ns) IN (
+                        SELECT s.thread_id, s.checkpoint_ns FROM checkpoints s
+                        WHERE s.checkpoint_ns != ''
+                        GROUP BY s.thread_id, s.checkpoint_ns
+                        HAVING MAX(s.checkpoint_id) < (
+                            SELECT MAX(r.checkpoint_id) FROM checkpoints r
+                            WHERE r.thread_id = s.thread_id AND r.checkpoint_ns = ''
+                        )
+                    )
+                    """
+                ).rowcount
+                if self._conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'traces'"
+                ).fetchone():
+                    # run traces (utils.tracing) live as long as their thread.
+                    self._conn.execute(
+                        "DELETE FROM traces WHERE thread_id NOT IN "
+                        "(SELECT DISTINCT thread_id FROM checkpoints)"
+                    )
+                result["writes_deleted"] = self._conn.execute(
+                    """
+                    DELETE FROM writes WHERE NOT EXISTS (
+                        SELECT 1 FROM checkpoints c
+                        WHERE c.thread_id = writes.thread_id
+                        AND c.checkpoint_ns = writes.checkpoint_ns
+                        AND c.checkpoint_id = writes.checkpoint_id
+                    )
+                    """
+                ).rowcount
+            result["vacuumed"] = self._compact()
+            referenced = self._referenced_blobs()
+        # payloads the checkpoints point to live as long as they do.
+        result["blobs_deleted"] = get_blob_store().prune(referenced)
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        result["time"] = time.time()
+        self.last_run = result
+        if result["checkpoints_deleted"] or result["writes_deleted"]:
+            logger.info(f"checkpoint retention: {result}")
+        return result
+
+    def _referenced_blobs(self) -> Set[str]:
+        # handles are plain strings in the msgpack'd checkpoints and writes.
+        # only the rows added since the last run are read, the kept ones
+        # reuse their digests.
+        refs = {}
+        for table, column in (("checkpoints", "checkpoint"), ("writes", "value")):
+            columns = ", ".join(ROW_KEYS[table])
+            match = " AND ".join(f"{name} = ?" for name in ROW_KEYS[table])
+            for row in self._conn.execute(f"SELECT {columns} FROM {table}").fetchall():
+                row_key = (table, *row)
+                if row_key in self._blob_refs:
+                    refs[row_key] = self._blob_refs[row_key]
+                    continue
+                found = self._conn.execute(
+                    f"SELECT {column} FROM {table} WHERE {match}", row
+                ).fetchone()
+                data = found[0] if found else None
+                refs[row_key] = {
+                    digest.decode() for digest in BLOB_HANDLE.findall(data or b"")
+                }
+        self._blob_refs = refs
+        return set().union(*refs.values())
+
+    def _compact(self) -> bool:
+        try:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            (pages,) = self._conn.execute("PRAGMA page_count").fetchone()
+            (free,) = self._conn.execute("PRAGMA freelist_count").fetchone()
+            if not pages or free / pages < self.vacuum_ratio:
+                return False
+            (mode,) = self._conn.execute("PRAGMA auto_vacuum").fetchone()
+            if mode != 2:  # created before incremental vacuum
+                logger.info(
+                    f"{self.path} has {free} free pages, run "
+                    "`python -m utils.checkpoints --vacuum` while it is idle"
+                )
+                return False
+            # one short write transaction per step, writers get in between. the
+            # sqlite3 module steps a pragma once, which frees a single page.
+            while free > 0 and not self._stop.is_set():
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    for _ in range(min(free, self.vacuum_step_pages)):
+                        self._conn.execute("PRAGMA incremental_vacuum(1)")
+                    self._conn.execute("COMMIT")
+                except sqlite3.Error:
+                    self._conn.execute("ROLLBACK")
+                    raise
+                (free,) = self._conn.execute("PRAGMA freelist_count").fetchone()
+                time.sleep(0.01)
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            return True
+        except sqlite3.OperationalError as e:  # busy, retried on the next run
+            logger.warning(f"Checkpoint compaction skipped: {e}")
+            return False
+
+    def vacuum(self):
+        """
+        Full VACUUM, switching older files to incremental vacuum. Holds the
+        write lock for the whole file: run it while the API is stopped.
+        """
+        with self._lock:
+            self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self._conn.execute("VACUUM")
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.prune()
+            except Exception as e:
+                logger.warning(f"Checkpoint retention failed: {e}")
+
+    def start(self):
+        """
+        Starts the background retention thread, once per process.
+        """
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._loop, name="checkpoint-janitor", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        size = sum(
+            os.path.getsize(self.path + suffix)
+            for suffix in ("", "-wal")
+            if os.path.exists(self.path + suffix)
+        )
+        return {"bytes": size, "last_run": self.last_run}
+
+
+_janitor = None
+_janitor_lock = threading.Lock()
+
+
+def get_checkpoint_janitor() -> CheckpointJanitor:
+    global _janitor
+    with _janitor_lock:
+        if _janitor is None:
+            config = load_config()
+            _janitor = CheckpointJanitor.from_config(
+                config.get("checkpoints") or {}, config.get("ttl")
+            )
+        return _janitor
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Apply the checkpoint retention policy once."
+    )
+    parser.add_argument(
+        "--keep-last", type=int, help="checkpoints kept per thread, defaults to config"
+    )
+    parser.add_argument(
+        "--vacuum", action="store_true", help="then a full VACUUM, stop the API first"
+    )
+    args = parser.parse_args()
+
+    janitor = get_checkpoint_janitor()
+    if args.keep_last:
+        janitor.keep_last = args.keep_last
+    print(janitor.prune())
+    if args.vacuum:
+        janitor.vacuum()
+    print(janitor.stats())
@@ -0,0 +1,133 @@
+import asyncio
+import contextvars
+import logging
+import math
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class HostLimiter:
+    """
+    Process-wide concurrency caps per remote host, shared by every fan-out so
+    concurrent requests cannot oversubscribe one API together.
+    """
+
+    def __init__(self, limit: int = 4):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._sync: Dict[str, threading.BoundedSemaphore] = {}
+        # asyncio primitives belong to one loop, keep a set per running loop.
+        self._async = weakref.WeakKeyDictionary()
+
+    def sync_semaphore(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            if host not in self._sync:
+                self._sync[host] = threading.BoundedSemaphore(self.limit)
+            return self._sync[host]
+
+    def async_semaphore(self, host: str) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphores = self._async.setdefault(loop, {})
+            if host not in semaphores:
+                semaphores[host] = asyncio.Semaphore(self.limit)
+            return semaphores[host]
+
+
+def fan_out(
+    func: Callable[[Any], Any],
+    items: List[Any],
+    semaphore: threading.BoundedSemaphore,
+    timeout: float,
+    max_workers: int,
+) -> List[Optional[Any]]:
+    """
+    Calls `func` on every item from a thread pool, at most `semaphore` at a
+    time. Results keep the order of `items`; calls that fail or run longer
+    than `timeout` are logged and left as `None`. A thread cannot be
+    cancelled: `func` should bound its own I/O (client timeouts) so dropped
+    calls give their semaphore back soon after.
+    """
+    if not items:
+        return []
+
+    started: Dict[int, float] = {}
+
+    def call(index, item):
+        with semaphore:
+            started[index] = time.monotonic()
+            return func(item)
+
+    # calls that never got a slot are given up once every wave could have
+    # used its full timeout.
+    give_up = time.monotonic() + timeout * math.ceil(len(items) / max(1, max_workers))
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items))))
+    try:
+        # a context copy per call, so the calls stay children of the current
+        # run (callbacks, tracing) like they are in `afan_out`.
+        futures = [
+            executor.submit(contextvars.copy_context().run, call, index, item)
+            for index, item in enumerate(items)
+        ]
+        pending = dict(enumerate(futures))
+        while pending:
+            now = time.monotonic()
+            deadlines = [
+                started[index] + timeout if index in started else give_up
+                for index in pending
+            ]
+            if min(deadlines) <= now:
+                for index, deadline in zip(list(pending), deadlines):
+                    if deadline <= now:
+                        del pending[index]
+                continue
+            done, _ = wait(
+                pending.values(),
+                timeout=min(deadlines) - now,
+                return_when=FIRST_COMPLETED,
+            )
+            pending = {i: f for i, f in pending.items() if f not in done}
+
+        results = []
+        for item, future in zip(items, futures):
+            if not future.done():
+                logger.warning(f"Dropping {item!r}: no answer after {timeout}s")
+                results.append(None)
+            elif future.exception() is not None:
+                logger.warning(f"Dropping {item!r}: {future.exception()}")
+                results.append(None)
+            else:
+                results.append(future.result())
+        return results
+    finally:
+        # do not wait for the stragglers, their results are dropped anyway.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def afan_out(
+    func: Callable[[Any], Awaitable[Any]],
+    items: List[Any],
+    semaphore: asyncio.Semaphore,
+    timeout: float,
+) -> List[Optional[Any]]:
+    """
+    Async counterpart of `fan_out`: one task per item, bounded by `semaphore`,
+    each call cancelled after `timeout` seconds.
+    """
+
+    async def call(item):
+        async with semaphore:
+            try:
+                return await asyncio.wait_for(func(item), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Dropping {item!r}: no answer after {timeout}s")
+            except Exception as e:
+                logger.warning(f"Dropping {item!r}: {e}")
+            return None
+
+    return list(await asyncio.gather(*(call(item) for item in items)))
@@ -0,0 +1,21 @@
+import os
+import yaml
+from functools import lru_cache
+
+CONFIG_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "config.yaml"
+)
+
+
+@lru_cache(maxsize=1)
+def load_config() -> dict:
+    """
+    Loads `config/config.yaml`, or the file named by `RESEARCH_CONFIG`, once
+    per process.
+    """
+    with open(os.environ.get("RESEARCH_CONFIG") or CONFIG_PATH, "r") as f:
+        return yaml.safe_load(f) or {}
+
+
+def get_section(name: str) -> dict:
+    return load_config().get(name) or {}
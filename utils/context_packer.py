@@ -0,0 +1,212 @@
+import re
+import math
+import logging
+from collections import Counter
+from dataclasses import dataclass, asdict
+from functools import lru_cache
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+WORD = re.compile(r"[a-z0-9][a-z0-9\-\.]*[a-z0-9]|[a-z0-9]")
+SECTION_HEADING = re.compile(
+    r"^(?:(?:[0-9]+(?:\.[0-9]+)*\.?|[IVX]+\.)\s+[A-Z][^\n]{0,80}"
+    r"|(?:abstract|introduction|related work|background|methods?|methodology|"
+    r"experiments?|results|discussion|conclusions?|references|bibliography|"
+    r"acknowledge?ments?|appendix(?:\s+[A-Z0-9]+)?)[.:]?)$",
+    re.IGNORECASE,
+)
+SKIPPED_SECTIONS = re.compile(r"^(?:references|bibliography)\b", re.IGNORECASE)
+STOPWORDS = {
+    "the", "and", "for", "are", "with", "that", "this", "from", "what", "which",
+    "how", "about", "into", "their", "there", "these", "those", "was", "were",
+    "you", "your", "can", "its", "has", "have", "not", "but", "all", "any",
+}
+
+
+# ========================= Tokens =============================
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:  # not installed, or the BPE file cannot be fetched
+        logger.info(f"tiktoken unavailable, estimating tokens from length: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Approximate prompt tokens (cl100k is close enough to the llama tokenizer
+    for budgeting), falls back to ~4 characters per token.
+    """
+    encoding = _encoding()
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def tokenize(text: str) -> List[str]:
+    # lexical terms, shared with the BM25 scoring.
+    return [w for w in WORD.findall(text.lower()) if w not in STOPWORDS]
+
+
+# ========================= Packing ============================
+@dataclass
+class PackStats:
+    items_in: int = 0
+    items_kept: int = 0
+    duplicates_dropped: int = 0
+    over_budget_dropped: int = 0
+    tokens_in: int = 0
+    tokens_kept: int = 0
+    budget: int = 0
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def _relevance(task: str, items: List[str]) -> List[float]:
+    # BM25 of the task against the candidate set itself.
+    query = set(tokenize(task))
+    docs = [Counter(tokenize(item)) for item in items]
+    if not query or not docs:
+        return [0.0] * len(items)
+
+    avg_len = sum(sum(d.values()) for d in docs) / len(docs) or 1.0
+    idf = {}
+    for term in query:
+        df = sum(1 for d in docs if term in d)
+        idf[term] = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+    scores = []
+    for doc in docs:
+        length = sum(doc.values())
+        score = 0.0
+        for term in query:
+            tf = doc.get(term, 0)
+            if not tf:
+                continue
+            norm = 1.2 * (0.25 + 0.75 * length / avg_len)
+            score += idf[term] * tf * 2.2 / (tf + norm)
+        scores.append(score)
+    return scores
+
+
+def _shingles(text: str, size: int = 5) -> set:
+    words = tokenize(text)
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i : i + size]) for i in range(len(words) - size + 1)}
+
+
+def pack_context(
+    task: str,
+    items: List[str],
+    budget: int,
+    dedup_threshold: float = 0.8,
+    keep_order: bool = False,
+) -> Tuple[List[int], PackStats]:
+    """
+    Selects which `items` go into a prompt: ranks them by relevance to `task`,
+    drops near-duplicates (shingle Jaccard >= `dedup_threshold`) and fills up
+    to `budget` tokens. Returns the kept indices, by rank or, with
+    `keep_order`, in document order, plus what was kept and dropped.
+    """
+    tokens = [count_tokens(item) for item in items]
+    stats = PackStats(items_in=len(items), tokens_in=sum(tokens), budget=budget)
+
+    scores = _relevance(task, items)
+    ranked = sorted(range(len(items)), key=lambda i: (-scores[i], i))
+
+    kept, kept_shingles, used = [], [], 0
+    for i in ranked:
+        shingles = _shingles(items[i])
+        if any(
+            len(shingles & other) / (len(shingles | other) or 1) >= dedup_threshold
+            for other in kept_shingles
+        ):
+            stats.duplicates_dropped += 1
+            continue
+        if used + tokens[i] > budget:
+            stats.over_budget_dropped += 1
+            continue
+        kept.append(i)
+        kept_shingles.append(shingles)
+        used += tokens[i]
+
+    stats.items_kept = len(kept)
+    stats.tokens_kept = used
+    return (sorted(kept) if keep_order else kept), stats
+
+
+def split_passages(text: str, max_tokens: int = 256) -> List[str]:
+    """
+    Splits a long document into passages of roughly `max_tokens`, on paragraph
+    and then line boundaries, so they can be ranked and packed.
+    """
+    passages, current, current_tokens = [], [], 0
+    for block in re.split(r"\n\s*\n", text):
+        for line in block.split("\n"):
+            line = line.strip()
+            if not line:
+                continue
+            line_tokens = count_tokens(line)
+            if current and current_tokens + line_tokens > max_tokens:
+                passages.append(" ".join(current))
+                current, current_tokens = [], 0
+            current.append(line)
+            current_tokens += line_tokens
+        if current and current_tokens >= max_tokens // 2:
+            passages.append(" ".join(current))
+            current, current_tokens = [], 0
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+
+def split_sections(text: str, max_tokens: int = 2048) -> List[str]:
+    """
+    Splits a paper into chunks that follow its sections (numbered or usual
+    headings): short sections are merged, long ones are split into passages,
+    every chunk starts with its section heading. The reference list is left out.
+    """
+    sections, heading, lines = [], "", []
+    for line in text.split("\n"):
+        stripped = line.strip()
+        if stripped and len(stripped) < 100 and SECTION_HEADING.match(stripped):
+            sections.append((heading, lines))
+            heading, lines = stripped, []
+        else:
+            lines.append(line)
+    sections.append((heading, lines))
+
+    chunks, current, current_tokens = [], [], 0
+    for heading, lines in sections:
+        if SKIPPED_SECTIONS.match(heading):
+            continue
+        body = "\n".join(lines).strip()
+        if not body:
+            continue
+        section = f"{heading}\n{body}" if heading else body
+        section_tokens = count_tokens(section)
+
+        if section_tokens > max_tokens:
+            if current:
+                chunks.append("\n\n".join(current))
+                current, current_tokens = [], 0
+            passage_tokens = max_tokens - count_tokens(heading)
+            chunks.extend(
+                f"{heading}\n{passage}" if heading else passage
+                for passage in split_passages(body, passage_tokens)
+            )
+            continue
+
+        if current and current_tokens + section_tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(section)
+        current_tokens += section_tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
@@ -0,0 +1,138 @@
+import os
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from utils.config import get_section
+from utils.llm_scheduler import scheduled_embeddings
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class EmbeddingStore:
+    """
+    Persistent vectors keyed by sha256(model, text). Vectors are stored as raw
+    float16/float32 bytes, not JSON lists.
+    """
+
+    def __init__(self, path: str, dtype: str = "float16"):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                dtype TEXT NOT NULL,
+                vector BLOB NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{text}".encode()).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            # stay below sqlite's bound parameter limit.
+            for start in range(0, len(keys), 500):
+                chunk = keys[start : start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, dtype, vector FROM embeddings "
+                    f"WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for key, dtype, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=dtype).astype(np.float32)
+        return {key: vector.tolist() for key, vector in found.items()}
+
+    def put_many(self, items: Dict[str, List[float]]):
+        rows = [
+            (key, self.dtype.name, np.asarray(vector, dtype=self.dtype).tobytes())
+            for key, vector in items.items()
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an `Embeddings` client: texts already embedded with the same model
+    are served from the store, only the missing ones reach the model (once
+    each, duplicates within a batch are embedded a single time).
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str, store: EmbeddingStore):
+        self.embeddings = embeddings
+        self.model = model
+        self.store = store
+
+    def _lookup(self, texts: List[str]):
+        keys = [self.store.make_key(self.model, text) for text in texts]
+        found = self.store.get_many(list(set(keys)))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing[key] = text
+        return keys, found, missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, missing = self._lookup(texts)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.store.put_many(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, missing = self._lookup(texts)
+        if missing:
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.store.put_many(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def cached_embeddings(embeddings: Embeddings, model: str) -> Embeddings:
+    """
+    Returns `embeddings` wrapped with the process-wide embedding cache, or
+    only scheduled (utils.llm_scheduler) when `embedding_cache.enabled` is false.
+    """
+    global _store
+    embeddings = scheduled_embeddings(embeddings)
+    config = get_section("embedding_cache")
+    if not config.get("enabled", True):
+        return embeddings
+    with _store_lock:
+        if _store is None:
+            _store = EmbeddingStore(
+                os.path.join(ROOT_DIR, config.get("path", "cache/embeddings.sqlite")),
+                dtype=config.get("dtype", "float16"),
+            )
+    return CachedEmbeddings(embeddings, model, _store)
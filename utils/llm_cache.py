@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+import warnings
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+from langchain_core._api import LangChainBetaWarning
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+from langchain_core.outputs import Generation
+from langchain_ollama import OllamaEmbeddings
+
+from utils.cache import parse_ttl
+from utils.config import load_config
+from utils.embedding_cache import cached_embeddings
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# nodes whose answer is a route label, the same for near-identical inputs.
+SEMANTIC_NODES = ("main_router", "search_router")
+
+
+class LLMCacheStore:
+    """
+    SQLite store of LLM generations keyed by sha256(node, llm_string, prompt):
+    the llm_string carries the model, its parameters and the output schema, the
+    prompt is the serialized messages. Entries expire after `ttl` seconds, the
+    least recently used ones are evicted past `max_entries`. Entries may also
+    keep an embedding of their input for similarity lookups.
+    """
+
+    def __init__(self, path: str, ttl: int = 86400, max_entries: int = 10000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                scope TEXT NOT NULL,
+                value TEXT NOT NULL,
+                vector BLOB,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS llm_cache_scope ON llm_cache (scope)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS llm_cache_lru ON llm_cache (last_access)"
+        )
+        self._conn.commit()
+
+    @classmethod
+    def from_config(cls, config: dict, ttl) -> "LLMCacheStore":
+        return cls(
+            path=os.path.join(ROOT_DIR, config.get("path", "cache/llm_cache.sqlite")),
+            ttl=parse_ttl(ttl),
+            max_entries=int(config.get("max_entries", 10000)),
+        )
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def _touch(self, key: str):
+        self._conn.execute(
+            "UPDATE llm_cache SET last_access = ? WHERE key = ?", (time.time(), key)
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM llm_cache WHERE key = ? AND created_at > ?",
+                (key, time.time() - self.ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            self._touch(key)
+            self.hits += 1
+        return row[0]
+
+    def nearest(self, scope: str, vector: np.ndarray, threshold: float) -> Optional[str]:
+        """
+        Best entry of `scope` whose input embedding has a cosine similarity of
+        at least `threshold` with `vector`.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value, vector FROM llm_cache "
+                "WHERE scope = ? AND vector IS NOT NULL AND created_at > ?",
+                (scope, time.time() - self.ttl),
+            ).fetchall()
+            if not rows:
+                return None
+            matrix = np.stack([np.frombuffer(row[2], dtype=np.float32) for row in rows])
+            scores = matrix @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < threshold:
+                return None
+            self._touch(rows[best][0])
+            self.semantic_hits += 1
+        return rows[best][1]
+
+    def set(self, key: str, scope: str, value: str, vector: np.ndarray = None):
+        now = time.time()
+        blob = None if vector is None else vector.astype(np.float32).tobytes()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (key, scope, value, blob, now, now),
+            )
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE created_at <= ?", (now - self.ttl,)
+            )
+            self._conn.execute(
+                """
+                DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY last_access ASC
+                    LIMIT max(0, (SELECT COUNT(*) FROM llm_cache) - ?)
+                )
+                """,
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def clear(self, scope: str = None):
+        with self._lock:
+            if scope is None:
+                self._conn.execute("DELETE FROM llm_cache")
+            else:
+                self._conn.execute("DELETE FROM llm_cache WHERE scope = ?", (scope,))
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+        return {
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "entries": entries,
+        }
+
+
+def _human_text(prompt: str) -> str:
+    # the prompt is the serialized message list, compare on the user turns only:
+    # the system prompt is the same for every call of a node.
+    try:
+        messages = json.loads(prompt)
+        texts = [
+            str(m["kwargs"].get("content", ""))
+            for m in messages
+            if m.get("id", [""])[-1] in ("HumanMessage", "HumanMessageChunk")
+        ]
+        return "\n".join(texts) or prompt
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return prompt
+
+
+class LLMResponseCache(BaseCache):
+    """
+    LangChain cache for one graph node: exact matches first, then, with a
+    `threshold` > 0, the closest earlier input of the same node and model
+    settings by embedding similarity.
+    """
+
+    def __init__(
+        self,
+        store: LLMCacheStore,
+        namespace: str,
+        embeddings=None,
+        threshold: float = 0.0,
+    ):
+        self.store = store
+        self.namespace = namespace
+        self.embeddings = embeddings
+        self.threshold = threshold if embeddings is not None else 0.0
+        # embeddings computed by a missed lookup, reused by the update after it.
+        self._pending: Dict[str, np.ndarray] = {}
+        self._pending_lock = threading.Lock()
+
+    def _scope(self, llm_string: str) -> str:
+        return self.store.make_key(self.namespace, llm_string)
+
+    def _embed(self, prompt: str) -> Optional[np.ndarray]:
+        try:
+            vector = np.asarray(
+                self.embeddings.embed_query(_human_text(prompt)), dtype=np.float32
+            )
+        except Exception as e:
+            logger.warning(f"LLM cache embedding failed, exact match only: {e}")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Generation]]:
+        key = self.store.make_key(self.namespace, llm_string, prompt)
+        value = self.store.get(key)
+        if value is None and self.threshold > 0:
+            vector = self._embed(prompt)
+            if vector is not None:
+                value = self.store.nearest(self._scope(llm_string), vector, self.threshold)
+                if value is None:
+                    with self._pending_lock:
+                        self._pending[key] = vector
+        if value is None:
+            self.store.miss()
+            return None
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", LangChainBetaWarning)
+            generations = loads(value)
+        for generation in generations:
+            # lets the metrics tell hits from model calls.
+            message = getattr(generation, "message", None)
+            if message is not None:
+                message.response_metadata["llm_cache_hit"] = True
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]):
+        key = self.store.make_key(self.namespace, llm_string, prompt)
+        with self._pending_lock:
+            vector = self._pending.pop(key, None)
+        if vector is None and self.threshold > 0:
+            vector = self._embed(prompt)
+        self.store.set(key, self._scope(llm_string), dumps(list(return_val)), vector)
+
+    def clear(self, **kwargs: Any):
+        self.store.clear()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_llm_cache_store() -> LLMCacheStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            config = load_config()
+            _store = LLMCacheStore.from_config(
+                config.get("llm_cache") or {}, config.get("ttl")
+            )
+        return _store
+
+
+def cached_llm(llm, node: str):
+    """
+    Copy of the shared chat model that answers from the LLM cache, for the
+    nodes listed in the `llm_cache.nodes` config (the others get `llm` back).
+    Near-identical inputs share an answer only in the `semantic_nodes`.
+    """
+    config = load_config().get("llm_cache") or {}
+    if not config.get("enabled", False) or node not in (config.get("nodes") or []):
+        return llm
+
+    embeddings = None
+    threshold = float(config.get("semantic_threshold", 0) or 0)
+    # only for label-valued answers: the queries / paper metadata of "paper X"
+    # would be served for "paper Y", whose input embeds almost identically.
+    if node not in config.get("semantic_nodes", SEMANTIC_NODES):
+        threshold = 0.0
+    if threshold > 0:
+        model = (load_config().get("vector_store") or {}).get(
+            "embedding_model", "llama3.1:8b-instruct-q4_K_M"
+        )
+        embeddings = cached_embeddings(OllamaEmbeddings(model=model), model)
+
+    cache = LLMResponseCache(get_llm_cache_store(), node, embeddings, threshold)
+    return llm.model_copy(update={"cache": cache})
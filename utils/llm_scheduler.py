@@ -0,0 +1,297 @@
+import time
+import asyncio
+import logging
+import threading
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_ollama import ChatOllama
+
+from utils.config import get_section
+
+logger = logging.getLogger(__name__)
+
+# lower runs first: routing decides what happens next, bulk work can wait.
+PRIORITIES = {"router": 0, "embed": 0, "structured": 1, "generate": 2, "bulk": 3}
+
+
+@dataclass
+class _Waiter:
+    call_class: str
+    thread_id: str
+    seq: int
+    enqueued_at: float = field(default_factory=time.perf_counter)
+    event: Optional[threading.Event] = None
+    future: Optional[asyncio.Future] = None
+    loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+class LLMScheduler:
+    """
+    Process-wide gate in front of Ollama, shared by the sync and async graphs:
+    at most `max_in_flight` model calls run at once, the others wait in a
+    queue ordered by call class priority (PRIORITIES), then by how many calls
+    their graph thread already has running (so one request cannot take every
+    slot), then by arrival. Queue waits are recorded per call class.
+    """
+
+    def __init__(self, max_in_flight: int = 2, window: int = 1000):
+        self.max_in_flight = max_in_flight
+        self._lock = threading.Lock()
+        self._waiters: List[_Waiter] = []
+        self._in_flight = 0
+        self._per_thread: Dict[str, int] = defaultdict(int)
+        self._seq = 0
+        self._calls: Dict[str, int] = defaultdict(int)
+        self._waits: Dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+
+    @classmethod
+    def from_config(cls, config: dict) -> "LLMScheduler":
+        return cls(max_in_flight=int(config.get("max_in_flight", 2)))
+
+    # ------------------------- slots -------------------------
+    def _enqueue(self, call_class: str, thread_id: str, **wake) -> _Waiter:
+        with self._lock:
+            self._seq += 1
+            waiter = _Waiter(call_class, thread_id or "", self._seq, **wake)
+            self._waiters.append(waiter)
+            self._grant()
+        return waiter
+
+    def _grant(self):
+        # called with the lock held.
+        while self._waiters and self._in_flight < self.max_in_flight:
+            waiter = min(
+                self._waiters,
+                key=lambda w: (
+                    PRIORITIES.get(w.call_class, 2),
+                    self._per_thread.get(w.thread_id, 0),
+                    w.seq,
+                ),
+            )
+            self._waiters.remove(waiter)
+            self._in_flight += 1
+            self._per_thread[waiter.thread_id] += 1
+            self._calls[waiter.call_class] += 1
+            self._waits[waiter.call_class].append(
+                time.perf_counter() - waiter.enqueued_at
+            )
+            if waiter.event is not None:
+                waiter.event.set()
+            else:
+                waiter.loop.call_soon_threadsafe(self._wake, waiter)
+
+    def _wake(self, waiter: _Waiter):
+        if waiter.future.done():  # cancelled while the grant was on its way
+            self.release(waiter.thread_id)
+        else:
+            waiter.future.set_result(None)
+
+    def release(self, thread_id: str = ""):
+        with self._lock:
+            self._in_flight -= 1
+            self._per_thread[thread_id or ""] -= 1
+            if self._per_thread[thread_id or ""] <= 0:
+                del self._per_thread[thread_id or ""]
+            self._grant()
+
+    @contextmanager
+    def slot(self, call_class: str, thread_id: str = ""):
+        waiter = self._enqueue(call_class, thread_id, event=threading.Event())
+        waiter.event.wait()
+        try:
+            yield
+        finally:
+            self.release(thread_id)
+
+    @asynccontextmanager
+    async def aslot(self, call_class: str, thread_id: str = ""):
+        loop = asyncio.get_running_loop()
+        waiter = self._enqueue(
+            call_class, thread_id, future=loop.create_future(), loop=loop
+        )
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            # granted and woken, then cancelled before resuming: the slot is ours.
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(thread_id)
+            raise
+        try:
+            yield
+        finally:
+            self.release(thread_id)
+
+    # ------------------------- metrics -------------------------
+    def stats(self) -> dict:
+        with self._lock:
+            classes = {}
+            for call_class, waits in self._waits.items():
+                ordered = sorted(waits)
+                classes[call_class] = {
+                    "calls": self._calls[call_class],
+                    "wait_p50": round(ordered[len(ordered) // 2], 4),
+                    "wait_p95": round(ordered[int(len(ordered) * 0.95)], 4),
+                    "wait_max": round(ordered[-1], 4),
+                }
+            return {
+                "max_in_flight": self.max_in_flight,
+                "in_flight": self._in_flight,
+                "queued": len(self._waiters),
+                "classes": classes,
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_llm_scheduler() -> LLMScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler.from_config(get_section("llm_scheduler"))
+        return _scheduler
+
+
+def _thread_id(run_manager) -> str:
+    # LangGraph puts the thread_id of the run in the callback metadata.
+    metadata = getattr(run_manager, "metadata", None) or {}
+    return str(metadata.get("thread_id", ""))
+
+
+# ======================= Chat model ========================
+class ScheduledChatOllama(ChatOllama):
+    """
+    ChatOllama whose calls take a scheduler slot of class `call_class` for as
+    long as they run (a stream holds it until its last token). Cache hits are
+    answered before `_generate`, without a slot.
+    """
+
+    call_class: str = "generate"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        with get_llm_scheduler().slot(self.call_class, _thread_id(run_manager)):
+            return super()._generate(messages, stop, run_manager, **kwargs)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        async with get_llm_scheduler().aslot(
+            self.call_class, _thread_id(run_manager)
+        ):
+            return await super()._agenerate(messages, stop, run_manager, **kwargs)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        with get_llm_scheduler().slot(self.call_class, _thread_id(run_manager)):
+            yield from super()._stream(messages, stop, run_manager, **kwargs)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        async with get_llm_scheduler().aslot(
+            self.call_class, _thread_id(run_manager)
+        ):
+            async for chunk in super()._astream(
+                messages, stop, run_manager, **kwargs
+            ):
+                yield chunk
+
+
+def chat_model(model: str) -> ChatOllama:
+    if not get_section("llm_scheduler").get("enabled", True):
+        return ChatOllama(model=model)
+    return ScheduledChatOllama(model=model)
+
+
+def scheduled_llm(llm, call_class: str):
+    """
+    Copy of the shared chat model scheduled as `call_class` (see PRIORITIES),
+    `llm` itself when the scheduler is disabled.
+    """
+    if not isinstance(llm, ScheduledChatOllama):
+        return llm
+    return llm.model_copy(update={"call_class": call_class})
+
+
+# ======================= Embeddings ========================
+class _Batch:
+    def __init__(self):
+        self.texts: List[str] = []
+        self.vectors: List[List[float]] = []
+        self.error: Optional[Exception] = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class ScheduledEmbeddings(Embeddings):
+    """
+    Embedding client going through the scheduler. With a `window`, single
+    queries arriving within `window` seconds of each other (router, LLM cache
+    and retrieval lookups of concurrent requests) are sent as one batch of at
+    most `max_batch` texts.
+    """
+
+    def __init__(
+        self, embeddings: Embeddings, window: float = 0.0, max_batch: int = 32
+    ):
+        self.embeddings = embeddings
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._open: Optional[_Batch] = None
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with get_llm_scheduler().slot("embed"):
+            return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.window <= 0:
+            return self.embed_documents([text])[0]
+
+        with self._lock:
+            batch, leader = self._open, False
+            if batch is None:
+                batch, leader = _Batch(), True
+                self._open = batch
+            index = len(batch.texts)
+            batch.texts.append(text)
+            if len(batch.texts) >= self.max_batch:
+                self._open = None
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._open is batch:
+                    self._open = None
+            try:
+                batch.vectors = self.embed_documents(batch.texts)
+            except Exception as e:
+                batch.error = e
+            batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.vectors[index]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.to_thread(self.embed_query, text)
+
+
+def scheduled_embeddings(embeddings: Embeddings) -> Embeddings:
+    config = get_section("llm_scheduler")
+    if not config.get("enabled", True):
+        return embeddings
+    return ScheduledEmbeddings(
+        embeddings,
+        window=float(config.get("embed_batch_window", 0) or 0),
+        max_batch=int(config.get("embed_max_batch", 32)),
+    )
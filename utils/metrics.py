@@ -0,0 +1,229 @@
+import json
+import time
+import threading
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    Counter,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, REGISTRY
+
+SECONDS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+NODE_SECONDS = Histogram(
+    "research_node_duration_seconds",
+    "Graph node wall time.",
+    ["node"],
+    buckets=SECONDS,
+)
+NODE_ERRORS = Counter("research_node_errors", "Graph nodes that raised.", ["node"])
+NODE_BYTES = Histogram(
+    "research_node_output_bytes",
+    "Size of the state update a node returns.",
+    ["node"],
+    buckets=BYTES,
+)
+TOOL_SECONDS = Histogram(
+    "research_tool_duration_seconds",
+    "Tool call wall time.",
+    ["tool"],
+    buckets=SECONDS,
+)
+TOOL_ERRORS = Counter("research_tool_errors", "Tool calls that raised.", ["tool"])
+TOOL_BYTES = Histogram(
+    "research_tool_output_bytes", "Size of a tool result.", ["tool"], buckets=BYTES
+)
+LLM_SECONDS = Histogram(
+    "research_llm_duration_seconds",
+    "Chat model call wall time, queue wait included.",
+    ["node"],
+    buckets=SECONDS,
+)
+LLM_TOKENS = Counter(
+    "research_llm_tokens",
+    "Tokens per node, kind is prompt or completion.",
+    ["node", "kind"],
+)
+LLM_CACHE_HITS = Counter(
+    "research_node_llm_cache_hits",
+    "Chat model calls answered by the LLM cache.",
+    ["node"],
+)
+
+
+def payload_size(value: Any) -> int:
+    if isinstance(value, str):
+        return len(value.encode())
+    try:
+        return len(json.dumps(value, default=str).encode())
+    except (TypeError, ValueError):
+        return len(str(value).encode())
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Records graph nodes, tool calls and chat model calls of every run it is
+    passed to (`callbacks` of the run config) into the Prometheus metrics.
+    A node is the chain run LangGraph names after it (`langgraph_node`).
+    """
+
+    # bookkeeping only, no need for the executor hop in async runs.
+    run_inline = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started: Dict[UUID, tuple] = {}
+
+    def _start(self, run_id: UUID, kind: str, name: str):
+        with self._lock:
+            self._started[run_id] = (kind, name, time.perf_counter())
+
+    def _end(self, run_id: UUID, kind: str) -> Optional[tuple]:
+        with self._lock:
+            started = self._started.pop(run_id, None)
+        if started is None or started[0] != kind:
+            return None
+        return started[1], time.perf_counter() - started[2]
+
+    # ------------------------- nodes -------------------------
+    def on_chain_start(
+        self, serialized, inputs, *, run_id, metadata=None, name=None, **kwargs
+    ):
+        node = (metadata or {}).get("langgraph_node")
+        if node and name == node and not node.startswith("__"):
+            self._start(run_id, "node", node)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        ended = self._end(run_id, "node")
+        if ended:
+            node, seconds = ended
+            NODE_SECONDS.labels(node).observe(seconds)
+            NODE_BYTES.labels(node).observe(payload_size(outputs))
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        ended = self._end(run_id, "node")
+        if ended:
+            NODE_ERRORS.labels(ended[0]).inc()
+
+    # ------------------------- tools -------------------------
+    def on_tool_start(self, serialized, input_str, *, run_id, name=None, **kwargs):
+        self._start(run_id, "tool", name or (serialized or {}).get("name", "tool"))
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        ended = self._end(run_id, "tool")
+        if ended:
+            tool, seconds = ended
+            TOOL_SECONDS.labels(tool).observe(seconds)
+            TOOL_BYTES.labels(tool).observe(payload_size(output))
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        ended = self._end(run_id, "tool")
+        if ended:
+            TOOL_ERRORS.labels(ended[0]).inc()
+
+    # ------------------------- chat model -------------------------
+    def on_chat_model_start(
+        self, serialized, messages, *, run_id, metadata=None, **kwargs
+    ):
+        self._start(run_id, "llm", (metadata or {}).get("langgraph_node", "other"))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        ended = self._end(run_id, "llm")
+        if not ended:
+            return
+        node, seconds = ended
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                if message is None:
+                    continue
+                if message.response_metadata.get("llm_cache_hit"):
+                    LLM_CACHE_HITS.labels(node).inc()
+                    continue
+                usage = getattr(message, "usage_metadata", None) or {}
+                LLM_TOKENS.labels(node, "prompt").inc(usage.get("input_tokens", 0))
+                LLM_TOKENS.labels(node, "completion").inc(usage.get("output_tokens", 0))
+        LLM_SECONDS.labels(node).observe(seconds)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, "llm")
+
+
+class StatsCollector:
+    """
+    Exposes the counters the caches and the LLM scheduler already keep,
+    read at scrape time.
+    """
+
+    def collect(self):
+        # imported here, the stores open their files on first use.
+        from utils.cache import get_tool_cache
+        from utils.llm_cache import get_llm_cache_store
+        from utils.llm_scheduler import get_llm_scheduler
+
+        for name, stats in (
+            ("tool_cache", get_tool_cache().stats()),
+            ("llm_cache", get_llm_cache_store().stats()),
+        ):
+            for key in ("hits", "semantic_hits", "misses"):
+                if key in stats:
+                    yield CounterMetricFamily(
+                        f"research_{name}_{key}", f"{name} {key}.", value=stats[key]
+                    )
+            yield GaugeMetricFamily(
+                f"research_{name}_entries", f"{name} entries.", value=stats["entries"]
+            )
+
+        scheduler = get_llm_scheduler().stats()
+        yield GaugeMetricFamily(
+            "research_llm_in_flight",
+            "Model calls running.",
+            value=scheduler["in_flight"],
+        )
+        yield GaugeMetricFamily(
+            "research_llm_queued",
+            "Model calls waiting for a slot.",
+            value=scheduler["queued"],
+        )
+        calls = CounterMetricFamily(
+            "research_llm_scheduled_calls",
+            "Model calls per class.",
+            labels=["call_class"],
+        )
+        wait = GaugeMetricFamily(
+            "research_llm_queue_wait_p95_seconds",
+            "Recent queue wait, 95th percentile.",
+            labels=["call_class"],
+        )
+        for call_class, values in scheduler["classes"].items():
+            calls.add_metric([call_class], values["calls"])
+            wait.add_metric([call_class], values["wait_p95"])
+        yield calls
+        yield wait
+
+
+_handler = None
+_handler_lock = threading.Lock()
+
+
+def get_metrics_handler() -> MetricsCallbackHandler:
+    global _handler
+    with _handler_lock:
+        if _handler is None:
+            _handler = MetricsCallbackHandler()
+            REGISTRY.register(StatsCollector())
+        return _handler
+
+
+def render_metrics():
+    """
+    Body and content type of the `/metrics` answer.
+    """
+    get_metrics_handler()
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,212 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+from utils.cache import parse_ttl
+from utils.config import load_config
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ARXIV_ID = re.compile(r"arxiv\.org/(?:abs|pdf)/(.+?)(?:\.pdf)?/?$", re.IGNORECASE)
+ARXIV_VERSIONED = re.compile(r"v\d+$")
+
+
+@dataclass
+class CachedPDF:
+    source_key: str
+    content_hash: str
+    etag: str
+    last_modified: str
+    checked_at: float
+
+    @property
+    def immutable(self) -> bool:
+        # a versioned arXiv id (e.g. 1706.03762v7) never changes content.
+        return self.source_key.startswith("arxiv:") and bool(
+            ARXIV_VERSIONED.search(self.source_key)
+        )
+
+
+class PDFTextCache:
+    """
+    Content-addressed cache of extracted PDF text. The index maps a normalized
+    source (arXiv id or URL) to the sha256 of the downloaded bytes plus the
+    validators needed for a conditional request; the text itself is stored
+    once per content hash and evicted least-recently-used past `max_bytes`.
+    """
+
+    def __init__(self, directory: str, revalidate_after: int, max_bytes: int):
+        self.directory = directory
+        self.revalidate_after = revalidate_after
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.join(directory, "text"), exist_ok=True)
+        self._conn = sqlite3.connect(
+            os.path.join(directory, "index.sqlite"), check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sources (
+                source_key TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                checked_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS texts (
+                content_hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+
+    @classmethod
+    def from_config(cls, config: dict, ttl) -> "PDFTextCache":
+        return cls(
+            directory=os.path.join(ROOT_DIR, config.get("dir", "cache/pdf")),
+            revalidate_after=parse_ttl(config.get("revalidate_after", ttl)),
+            max_bytes=int(config.get("max_bytes", 512 * 1024 * 1024)),
+        )
+
+    @staticmethod
+    def source_key(url: str) -> str:
+        match = ARXIV_ID.search(url)
+        if match:
+            return f"arxiv:{match.group(1).lower()}"
+        parts = urlsplit(url.strip())
+        return urlunsplit(
+            (parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, "")
+        )
+
+    def _text_path(self, content_hash: str) -> str:
+        return os.path.join(
+            self.directory, "text", content_hash[:2], f"{content_hash}.txt"
+        )
+
+    def lookup(self, source_key: str) -> Optional[CachedPDF]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT source_key, content_hash, etag, last_modified, checked_at "
+                "FROM sources WHERE source_key = ?",
+                (source_key,),
+            ).fetchone()
+        if row is None or not os.path.exists(self._text_path(row[1])):
+            return None
+        return CachedPDF(*row)
+
+    def is_fresh(self, entry: CachedPDF) -> bool:
+        return entry.immutable or time.time() - entry.checked_at < self.revalidate_after
+
+    def conditional_headers(self, entry: Optional[CachedPDF]) -> Dict[str, str]:
+        headers = {}
+        if entry is not None and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry is not None and entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def read_text(self, content_hash: str) -> Optional[str]:
+        path = self._text_path(content_hash)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self._conn.execute(
+                "UPDATE texts SET last_access = ? WHERE content_hash = ?",
+                (time.time(), content_hash),
+            )
+            self._conn.commit()
+        return text
+
+    def mark_validated(self, source_key: str):
+        # 304 Not Modified: the cached text is still current.
+        with self._lock:
+            self._conn.execute(
+                "UPDATE sources SET checked_at = ? WHERE source_key = ?",
+                (time.time(), source_key),
+            )
+            self._conn.commit()
+
+    def store(
+        self,
+        source_key: str,
+        content_hash: str,
+        text: str,
+        etag: str = "",
+        last_modified: str = "",
+    ):
+        path = self._text_path(content_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?)",
+                (source_key, content_hash, etag or "", last_modified or "", now),
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO texts VALUES (?, ?, ?)",
+                (content_hash, os.path.getsize(path), now),
+            )
+            self._conn.commit()
+        self.evict()
+
+    def evict(self):
+        with self._lock:
+            (total,) = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM texts"
+            ).fetchone()
+            if total <= self.max_bytes:
+                return
+            rows = self._conn.execute(
+                "SELECT content_hash, size FROM texts ORDER BY last_access ASC"
+            ).fetchall()
+            for content_hash, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self._conn.execute(
+                    "DELETE FROM texts WHERE content_hash = ?", (content_hash,)
+                )
+                self._conn.execute(
+                    "DELETE FROM sources WHERE content_hash = ?", (content_hash,)
+                )
+                try:
+                    os.remove(self._text_path(content_hash))
+                except OSError as e:
+                    logger.warning(f"Could not evict cached text {content_hash}: {e}")
+                total -= size
+            self._conn.commit()
+
+
+_pdf_cache = None
+_pdf_cache_lock = threading.Lock()
+
+
+def get_pdf_cache() -> PDFTextCache:
+    global _pdf_cache
+    with _pdf_cache_lock:
+        if _pdf_cache is None:
+            config = load_config()
+            _pdf_cache = PDFTextCache.from_config(
+                config.get("pdf_cache") or {}, config.get("ttl")
+            )
+        return _pdf_cache
@@ -23,6 +23,15 @@ SEARCH_PROMPT = (
     "max results is always 3, unless the user asked for more."
 )
 
+PLANNER_PROMPT = (
+    "Plan how to handle the user input in one step: pick the route, either search_agent or deep_analysis_agent or chat."
+    "where search_agent is to search for general live information about multiple research papers, and deep_analysis_agent is to analyze one specific research paper in full detail only if the user asked for a deep dive into a specific paper."
+    "if the user continued asking questions about past conversation, route to chat directly, usually you will be provided with extra content from previous conversations."
+    "only for search_agent, also pick the sub_route, either web_search for general live information about research papers or vector_store to only retrieve context about mesh and StyleGAN topics from a vector store,"
+    "and generate a list of search queries (minimum of 3 queries) that will gather any relevant information, max_results is always 3, unless the user asked for more."
+    "utilize the content provided below as needed: \n"
+)
+
 GENERATOR_PROMPT = (
     "you are an expert illustrator of research papers, you will be provided with context about research papers, generate such a coherent and contextually consistent illustrated paragraphs, that provide a clear overview of each paper or context."
     "if you are provided with meta data such as url and title, provide the url in the paragraphs so the user can click on it and be redirected to the original source."
@@ -30,6 +39,16 @@ GENERATOR_PROMPT = (
 
 DEEP_ANALYSIS_PROMPT = "you will be provided by a full research paper, analyze the paragraphs from the paper and further illustrate the research paper, generate a coherent and contextually consistent paragraphs, helping the researcher to better understand the paper."
 
+PAPER_CHUNK_PROMPT = (
+    "you will be provided with a task and one section of a research paper, extract and summarize everything in this section that is relevant to the task: methods, results, numbers, claims and limitations."
+    "only use the section provided, if nothing in it is relevant, answer with a single short sentence saying so."
+)
+
+PAPER_REDUCE_PROMPT = (
+    "you will be provided with notes extracted from the sections of one research paper, in reading order, analyze them and further illustrate the research paper, generate a coherent and contextually consistent paragraphs, helping the researcher to better understand the paper."
+    "only rely on the notes provided, do not mention that the paper was provided as notes."
+)
+
 
 IMPROVER_PROMPT = (
     "you will be provided with generated paragraphs illustrating topics from retrieved_content, and a critique with recommendations on how to improve the paragraphs, and the retrieved content itself which the paragraphs was originally generated from, revise the paragraphs and generate the best paragraph possible from the generated paragraphs (i.e. previous attempts), to achieve a coherent and contextually consistent paragraphs."
@@ -43,6 +62,7 @@ IMPROVER_PROMPT = (
 REFLECTION_PROMPT = (
     "you are an expert critique of research papers, you will be provided with paragraphs illustrating research papers, generate critique and recommendations for the summaries based on the task and the coherence of the summaries, including requests for length, depth, style, etc."
     "don't generate any paragraphs, just critique and recommendations on how to improve the summaries, without generated summaries or paragraphs."
+    "also grade the summaries with a score from 0 to 1, and give the verdict accept only if they fully answer the task and need no further revision, otherwise revise."
 )
 
 CHAT_PROMPT = "you are a helpful assistant, usually you will be provided with a task and previous conversation history, generate a response complying to the task."
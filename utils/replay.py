@@ -0,0 +1,239 @@
+import os
+import gzip
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from utils.config import get_section
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def llm_key(messages, schema: Any = None) -> str:
+    """
+    Identity of a chat model request: the messages and the output schema.
+    """
+    payload = [[message.type, str(message.content)] for message in messages]
+    return hashlib.sha256(
+        json.dumps([payload, schema], sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def tool_key(name: str, inputs: Any) -> str:
+    return hashlib.sha256(
+        json.dumps([name, inputs], sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+class RunRecorder(BaseCallbackHandler):
+    """
+    What one graph invocation got from outside the graph, from its callbacks:
+    every chat model request and response, every tool input and output, with
+    start offsets and durations, plus the order the nodes ran in. Replayed by
+    `benchmarks.replay`.
+    """
+
+    run_inline = True
+
+    def __init__(
+        self,
+        thread_id: str,
+        task: str,
+        resume: bool = False,
+        analysis_mode: str = None,
+        latency_budget: float = None,
+    ):
+        self.thread_id = thread_id
+        self.task = task
+        self.resume = resume
+        self.analysis_mode = analysis_mode
+        self.latency_budget = latency_budget
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._calls: Dict[UUID, Dict[str, Any]] = {}
+        self._nodes: List[tuple] = []
+
+    def _offset(self) -> float:
+        return round(time.time() - self.started_at, 4)
+
+    def _start(self, run_id: UUID, **call):
+        with self._lock:
+            self._calls[run_id] = {**call, "start": self._offset()}
+
+    def _end(self, run_id: UUID, **update):
+        with self._lock:
+            call = self._calls.get(run_id)
+            if call is not None:
+                call["seconds"] = round(self._offset() - call["start"], 4)
+                call.update(update)
+
+    # ------------------------- callbacks -------------------------
+    def on_chain_start(
+        self, serialized, inputs, *, run_id, metadata=None, name=None, **kwargs
+    ):
+        node = (metadata or {}).get("langgraph_node")
+        if node and name == node and not node.startswith("__"):
+            with self._lock:
+                self._nodes.append((self._offset(), node))
+
+    def on_chat_model_start(
+        self,
+        serialized,
+        messages,
+        *,
+        run_id,
+        metadata=None,
+        invocation_params=None,
+        **kwargs,
+    ):
+        schema = (invocation_params or {}).get("format")
+        self._start(
+            run_id,
+            kind="llm",
+            node=(metadata or {}).get("langgraph_node", ""),
+            schema=schema.get("title") if isinstance(schema, dict) else schema,
+            key=llm_key(messages[0], schema),
+            request=[
+                {"role": message.type, "content": str(message.content)}
+                for message in messages[0]
+            ],
+        )
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        generation = response.generations[0][0]
+        message = getattr(generation, "message", None)
+        self._end(
+            run_id,
+            response=generation.text,
+            usage=getattr(message, "usage_metadata", None) or {},
+            cache_hit=bool(
+                message is not None and message.response_metadata.get("llm_cache_hit")
+            ),
+        )
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=repr(error))
+
+    def on_tool_start(
+        self,
+        serialized,
+        input_str,
+        *,
+        run_id,
+        metadata=None,
+        name=None,
+        inputs=None,
+        **kwargs,
+    ):
+        name = name or (serialized or {}).get("name", "tool")
+        tool_input = inputs if inputs is not None else input_str
+        self._start(
+            run_id,
+            kind="tool",
+            name=name,
+            node=(metadata or {}).get("langgraph_node", ""),
+            key=tool_key(name, tool_input),
+            input=tool_input,
+        )
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id, output=output)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=repr(error))
+
+    def record(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = [call for call in self._calls.values() if "seconds" in call]
+            nodes = [node for _, node in sorted(self._nodes)]
+        return {
+            "thread_id": self.thread_id,
+            "task": self.task,
+            "resume": self.resume,
+            "analysis_mode": self.analysis_mode,
+            "latency_budget": self.latency_budget,
+            "started_at": self.started_at,
+            "duration": round(time.time() - self.started_at, 4),
+            "nodes": nodes,
+            "calls": sorted(calls, key=lambda call: call["start"]),
+        }
+
+
+# ======================= Storage ========================
+class ReplayLog:
+    """
+    Recorded runs appended to `path`, one gzip member (a JSON line) per run,
+    so the file stays readable while it grows. `sample_rate` of the runs are
+    recorded until the file reaches `max_bytes`.
+    """
+
+    def __init__(self, path: str, sample_rate: float = 1.0, max_bytes: int = 0):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._full = False
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config: dict) -> "ReplayLog":
+        return cls(
+            path=os.path.join(
+                ROOT_DIR, config.get("path", "cache/replay/runs.jsonl.gz")
+            ),
+            sample_rate=float(config.get("sample_rate", 1.0)),
+            max_bytes=int(config.get("max_bytes", 0) or 0),
+        )
+
+    def should_record(self) -> bool:
+        if self._full or random.random() >= self.sample_rate:
+            return False
+        if self.max_bytes and os.path.exists(self.path):
+            if os.path.getsize(self.path) >= self.max_bytes:
+                logger.warning(f"{self.path} reached max_bytes, recording stopped")
+                self._full = True
+                return False
+        return True
+
+    def save(self, recorder: RunRecorder):
+        line = json.dumps(recorder.record(), default=str, separators=(",", ":"))
+        data = gzip.compress((line + "\n").encode())
+        with self._lock, open(self.path, "ab") as f:
+            f.write(data)
+
+    @staticmethod
+    def load(path: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        runs = []
+        with gzip.open(path, "rt") as f:
+            for line in f:
+                runs.append(json.loads(line))
+                if limit and len(runs) >= limit:
+                    break
+        return runs
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_replay_log() -> ReplayLog:
+    global _log
+    with _log_lock:
+        if _log is None:
+            _log = ReplayLog.from_config(get_section("replay"))
+        return _log
+
+
+def recording_enabled() -> bool:
+    if not get_section("replay").get("record", False):
+        return False
+    return get_replay_log().should_record()
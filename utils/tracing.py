@@ -0,0 +1,327 @@
+import json
+import time
+import zlib
+import argparse
+import threading
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from utils.checkpoints import checkpoint_path, connect
+from utils.config import get_section
+from utils.metrics import payload_size
+
+
+class RunTracer(BaseCallbackHandler):
+    """
+    Span tree of one graph invocation, from its callbacks: the main graph,
+    the subgraphs, every node, LLM call and tool call, with epoch start/end
+    seconds and sizes. Other chain runs (sequences, parsers, the node
+    functions) are folded into their closest kept parent by `spans`.
+    """
+
+    run_inline = True
+
+    def __init__(self, thread_id: str):
+        self.thread_id = thread_id
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._spans: Dict[str, Dict[str, Any]] = {}
+
+    def _start(self, run_id: UUID, parent_run_id: Optional[UUID], **span):
+        with self._lock:
+            self._spans[str(run_id)] = {
+                "id": str(run_id),
+                "parent": str(parent_run_id) if parent_run_id else None,
+                "start": time.time(),
+                "end": None,
+                **span,
+            }
+
+    def _end(self, run_id: UUID, **update):
+        with self._lock:
+            span = self._spans.get(str(run_id))
+            if span is not None:
+                span["end"] = time.time()
+                span.update(update)
+
+    # ------------------------- callbacks -------------------------
+    def on_chain_start(
+        self,
+        serialized,
+        inputs,
+        *,
+        run_id,
+        parent_run_id=None,
+        metadata=None,
+        name=None,
+        **kwargs,
+    ):
+        node = (metadata or {}).get("langgraph_node")
+        if node and node.startswith("__"):
+            return
+        kind = "node" if node and name == node else "chain"
+        self._start(run_id, parent_run_id, name=name or "chain", kind=kind)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        with self._lock:
+            span = self._spans.get(str(run_id))
+            is_node = span is not None and span["kind"] == "node"
+        if is_node:
+            self._end(run_id, output_bytes=payload_size(outputs))
+        else:
+            self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=repr(error))
+
+    def on_chat_model_start(
+        self,
+        serialized,
+        messages,
+        *,
+        run_id,
+        parent_run_id=None,
+        metadata=None,
+        **kwargs,
+    ):
+        self._start(
+            run_id,
+            parent_run_id,
+            name=(metadata or {}).get("ls_model_name") or "chat_model",
+            kind="llm",
+            input_bytes=sum(
+                payload_size(message.content) for batch in messages for message in batch
+            ),
+        )
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        update = {"output_bytes": 0}
+        for generations in response.generations:
+            for generation in generations:
+                update["output_bytes"] += payload_size(generation.text)
+                message = getattr(generation, "message", None)
+                if message is None:
+                    continue
+                usage = getattr(message, "usage_metadata", None) or {}
+                update["prompt_tokens"] = usage.get("input_tokens", 0)
+                update["completion_tokens"] = usage.get("output_tokens", 0)
+                update["cache_hit"] = bool(
+                    message.response_metadata.get("llm_cache_hit")
+                )
+        self._end(run_id, **update)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=repr(error))
+
+    def on_tool_start(
+        self,
+        serialized,
+        input_str,
+        *,
+        run_id,
+        parent_run_id=None,
+        name=None,
+        **kwargs,
+    ):
+        self._start(
+            run_id,
+            parent_run_id,
+            name=name or (serialized or {}).get("name", "tool"),
+            kind="tool",
+            input_bytes=payload_size(input_str),
+        )
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id, output_bytes=payload_size(output))
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=repr(error))
+
+    # ------------------------- tree -------------------------
+    def spans(self) -> List[Dict[str, Any]]:
+        """
+        The kept spans in start order, a chain is kept as a graph when it
+        runs nodes (or is the root).
+        """
+        with self._lock:
+            spans = {key: dict(span) for key, span in self._spans.items()}
+        graphs = {
+            span["parent"]
+            for span in spans.values()
+            if span["kind"] == "node" and span["parent"] in spans
+        }
+        for key, span in spans.items():
+            if span["kind"] == "chain" and (key in graphs or span["parent"] is None):
+                span["kind"] = "graph"
+
+        def kept_parent(key):
+            while key is not None and key in spans and spans[key]["kind"] == "chain":
+                key = spans[key]["parent"]
+            return key if key in spans else None
+
+        kept = []
+        for span in spans.values():
+            if span["kind"] == "chain":
+                continue
+            span["parent"] = kept_parent(span["parent"])
+            if span["end"] is None:  # cancelled mid-run
+                span["end"] = time.time()
+            kept.append(span)
+        return sorted(kept, key=lambda span: span["start"])
+
+
+def to_chrome_trace(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Chrome trace / Perfetto JSON of stored runs: one process per run, spans
+    on as few tracks as keep them properly nested (concurrent tool calls
+    get their own tracks).
+    """
+    events = []
+    for pid, run in enumerate(runs, start=1):
+        events.append(
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": pid,
+                "args": {"name": f"run {run['run_id'][:8]} ({run['thread_id']})"},
+            }
+        )
+        lanes: List[List[Dict[str, Any]]] = []
+        for span in run["spans"]:
+            for tid, stack in enumerate(lanes):
+                while stack and stack[-1]["end"] <= span["start"]:
+                    stack.pop()
+                if not stack or stack[-1]["end"] >= span["end"]:
+                    break
+            else:
+                tid, stack = len(lanes), []
+                lanes.append(stack)
+            stack.append(span)
+            events.append(
+                {
+                    "name": span["name"],
+                    "cat": span["kind"],
+                    "ph": "X",
+                    "pid": pid,
+                    "tid": tid,
+                    "ts": int(span["start"] * 1e6),
+                    "dur": max(1, int((span["end"] - span["start"]) * 1e6)),
+                    "args": {
+                        key: value
+                        for key, value in span.items()
+                        if key not in ("name", "kind", "start", "end")
+                    },
+                }
+            )
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+# ======================= Storage ========================
+class TraceStore:
+    """
+    Span trees in the checkpoint file, next to the thread they belong to
+    (`traces` table), the last `keep_last` runs per thread. The checkpoint
+    retention drops the traces of expired threads.
+    """
+
+    def __init__(self, path: str, keep_last: int = 20):
+        self.keep_last = keep_last
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS traces (
+                run_id TEXT PRIMARY KEY,
+                thread_id TEXT NOT NULL,
+                started_at REAL NOT NULL,
+                duration REAL NOT NULL,
+                spans BLOB NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS traces_thread ON traces (thread_id, started_at)"
+        )
+        self._conn.commit()
+
+    def save(self, tracer: RunTracer):
+        spans = tracer.spans()
+        if not spans:
+            return
+        root = spans[0]
+        blob = zlib.compress(json.dumps(spans, default=str).encode())
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO traces VALUES (?, ?, ?, ?, ?)",
+                (
+                    root["id"],
+                    tracer.thread_id,
+                    root["start"],
+                    root["end"] - root["start"],
+                    blob,
+                ),
+            )
+            self._conn.execute(
+                """
+                DELETE FROM traces WHERE thread_id = ? AND run_id NOT IN (
+                    SELECT run_id FROM traces WHERE thread_id = ?
+                    ORDER BY started_at DESC LIMIT ?
+                )
+                """,
+                (tracer.thread_id, tracer.thread_id, self.keep_last),
+            )
+
+    def runs(self, thread_id: str, limit: int = None) -> List[Dict[str, Any]]:
+        """
+        Stored runs of a thread, most recent first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT run_id, started_at, duration, spans FROM traces "
+                "WHERE thread_id = ? ORDER BY started_at DESC LIMIT ?",
+                (thread_id, limit or self.keep_last),
+            ).fetchall()
+        return [
+            {
+                "run_id": run_id,
+                "thread_id": thread_id,
+                "started_at": started_at,
+                "duration": duration,
+                "spans": json.loads(zlib.decompress(spans)),
+            }
+            for run_id, started_at, duration, spans in rows
+        ]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_trace_store() -> TraceStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            config = get_section("tracing")
+            _store = TraceStore(checkpoint_path(), int(config.get("keep_last", 20)))
+        return _store
+
+
+def tracing_enabled() -> bool:
+    return bool(get_section("tracing").get("enabled", True))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export the stored runs of a thread as a Chrome trace file."
+    )
+    parser.add_argument("thread_id", type=str)
+    parser.add_argument("--output", "-o", type=str, default="trace.json")
+    parser.add_argument("--limit", type=int, help="most recent runs only")
+    args = parser.parse_args()
+
+    runs = get_trace_store().runs(args.thread_id, args.limit)
+    with open(args.output, "w") as f:
+        json.dump(to_chrome_trace(runs[::-1]), f)
+    print(f"{len(runs)} runs of {args.thread_id} written to {args.output}")
@@ -1,55 +1,341 @@
 import os
+import json
+import hashlib
 import argparse
+import multiprocessing
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Tuple
 
-from tools.semantic_retrieval import semantic_retrieval ##############
 from langchain_ollama import OllamaEmbeddings
-from langchain_community.vectorstores import Chroma
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import PyPDFLoader
 from langchain.schema import Document
 
+from utils.config import get_section
+from utils.embedding_cache import cached_embeddings
+from vector_store.bm25 import BM25Index
+from vector_store.chroma_store import chroma_collection
+from vector_store.numpy_store import NumpyVectorStore
 
-def vector_store(pdf_dir: str, chroma_dir: str):
+MANIFEST_NAME = "ingest_manifest.json"
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# ========================== Manifest ==========================
+class IngestManifest:
     """
-    Function to fetch pdfs from a directory and store them in a local vector store in other directory.
+    Record of the ingested PDFs (`<chroma_dir>/ingest_manifest.json`): file
+    hash, status and chunk count. A file is only marked `done` once all its
+    chunks are written, so an interrupted run resumes from the `pending` ones.
     """
 
-    pdf_path = list(Path(pdf_dir).glob("*.pdf"))
-    if not pdf_path:
-        raise Exception("No pdfs found in the directory")
+    def __init__(self, chroma_dir: str):
+        self.path = os.path.join(chroma_dir, MANIFEST_NAME)
+        self.files: Dict[str, Dict] = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.files = json.load(f).get("files", {})
+
+    def is_done(self, name: str, sha256: str) -> bool:
+        entry = self.files.get(name, {})
+        return entry.get("sha256") == sha256 and entry.get("status") == "done"
+
+    def previous_hash(self, name: str) -> str:
+        return self.files.get(name, {}).get("sha256", "")
+
+    def shared_by(self, sha256: str, name: str) -> List[str]:
+        """
+        The other files recorded with the same content, they share its chunks.
+        """
+        return [
+            other
+            for other, entry in self.files.items()
+            if other != name and entry.get("sha256") == sha256
+        ]
+
+    def mark(self, name: str, sha256: str, status: str, chunks: int = 0):
+        self.files[name] = {"sha256": sha256, "status": status, "chunks": chunks}
+        self.save()
+
+    def forget(self, name: str):
+        self.files.pop(name, None)
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"files": self.files}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+# =================== Parse & split ( worker ) ==================
+def _parse_and_split(
+    pdf: str, sha256: str, chunk_size: int, chunk_overlap: int
+) -> Tuple[str, str, List[Document]]:
+    """
+    Runs in a worker process: load one PDF and split it into chunks.
+    """
+    pdf = Path(pdf)
+    try:
+        docs = PyPDFLoader(str(pdf)).load()
+    except UnicodeEncodeError:
+        print(f"Skipping problematic pdf: {pdf}")
+        return str(pdf), sha256, []
+
+    for doc in docs:
+        doc.metadata.update(
+            {
+                "title": pdf.stem,
+                "document_type": "research_paper",
+                "source_hash": sha256,
+            }
+        )
+
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    )
+    return str(pdf), sha256, splitter.split_documents(docs)
+
+
+# ========================= Ingestion ==========================
+class Ingester:
+    """
+    Pipelined ingestion: PDFs are parsed and split in a process pool, chunks
+    are embedded in batches with at most `max_inflight` embedding requests in
+    flight, and every embedded batch is written to Chroma right away. Chunk
+    ids are `<file sha256>:<index>`, so re-writing a batch is idempotent and
+    identical files under different names share one set of chunks. Files
+    removed from the directory are dropped from the store and the manifest.
+    The same ids are indexed in the BM25 index used by hybrid retrieval.
+
+    `backend="numpy"` writes to a memory-mapped `NumpyVectorStore` in
+    `chroma_dir` instead of a Chroma collection.
+    """
+
+    def __init__(
+        self,
+        chroma_dir: str,
+        model: str,
+        batch_size: int = 64,
+        max_inflight: int = 2,
+        workers: int = 4,
+        chunk_size: int = 1024,
+        chunk_overlap: int = 128,
+        backend: str = "chroma",
+        dtype: str = "float16",
+    ):
+        self.chroma_dir = chroma_dir
+        self.batch_size = batch_size
+        self.max_inflight = max_inflight
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+        # chunks already embedded by an earlier run (or another corpus) are
+        # served from the embedding cache.
+        self.embeddings = cached_embeddings(OllamaEmbeddings(model=model), model)
+        if backend == "numpy":
+            self.collection = NumpyVectorStore(chroma_dir, dtype=dtype)
+        else:
+            self.collection = chroma_collection(chroma_dir)
+        self.bm25 = BM25Index(chroma_dir)
+        self.manifest = IngestManifest(chroma_dir)
 
-    documents = []
-    for pdf in pdf_path:
-        try:
-            loader = PyPDFLoader(str(pdf))
-            docs = loader.load()
-            print(f"{pdf} Loaded successfully")
-        except UnicodeEncodeError:
-            print(f"Skipping problematic pdf: {pdf}")
-            continue
+    def _shared(self, sha256: str, name: str, hashes: Dict[Path, str]) -> bool:
+        # chunk ids are content based: identical files under other names share
+        # the chunks of `sha256`, they stay while one of them still has it.
+        return bool(self.manifest.shared_by(sha256, name)) or any(
+            digest == sha256 for pdf, digest in hashes.items() if pdf.name != name
+        )
 
-        for doc in docs:
-            doc.metadata.update({"title": pdf.stem, "document_type": "research_paper"})
+    def _delete_source(self, sha256: str):
+        self.collection.delete(where={"source_hash": sha256})
+        self.bm25.delete_source(sha256)
 
-        documents.extend(docs)
+    def _removed_files(self, hashes: Dict[Path, str]) -> int:
+        """
+        Drops the files no longer in the directory from the manifest, and their
+        chunks once no other file shares them.
+        """
+        names = {pdf.name for pdf in hashes}
+        removed = [name for name in self.manifest.files if name not in names]
+        for name in removed:
+            previous = self.manifest.previous_hash(name)
+            self.manifest.forget(name)
+            if previous and not self._shared(previous, name, hashes):
+                self._delete_source(previous)
+            print(f"{name} removed")
+        return len(removed)
 
-    splitter = RecursiveCharacterTextSplitter(chunk_size=1024, chunk_overlap=128)
-    splitted_docs = splitter.split_documents(documents)
+    def _pending_files(self, hashes: Dict[Path, str]) -> List[Tuple[Path, str]]:
+        pending = []
+        for pdf, sha256 in hashes.items():
+            if self.manifest.is_done(pdf.name, sha256):
+                continue
+            previous = self.manifest.previous_hash(pdf.name)
+            if (
+                previous
+                and previous != sha256
+                and not self._shared(previous, pdf.name, hashes)
+            ):
+                # the file changed, drop the chunks of its old version.
+                self._delete_source(previous)
+            self.manifest.mark(pdf.name, sha256, "pending")
+            pending.append((pdf, sha256))
+        return pending
 
-    embeddings = OllamaEmbeddings(model="llama3.1:8b-instruct-q4_K_M")
+    def _missing(self, ids: List[str]) -> set:
+        # after a crash, part of a file may already be in the collection.
+        existing = set(self.collection.get(ids=ids, include=[])["ids"])
+        return {i for i in ids if i not in existing}
 
-    vector_store = Chroma(persist_directory=chroma_dir, embedding_function=embeddings)
-    vector_store.add_documents(splitted_docs)
-    vector_store.persist()
+    def _embed(self, batch: List[Tuple[str, Document]]):
+        texts = [doc.page_content for _, doc in batch]
+        return batch, self.embeddings.embed_documents(texts)
 
-    # Chroma.from_documents(
-    #     documents=splitted_docs, embedding=embeddings, persist_directory=chroma_dir
-    # )
+    def _write(self, batch: List[Tuple[str, Document]], vectors: List[List[float]]):
+        # lexical index first: resuming is driven by the ids found in Chroma.
+        self.bm25.add(
+            [chunk_id for chunk_id, _ in batch],
+            [doc.page_content for _, doc in batch],
+            [doc.metadata["source_hash"] for _, doc in batch],
+        )
+        self.collection.upsert(
+            ids=[chunk_id for chunk_id, _ in batch],
+            embeddings=vectors,
+            documents=[doc.page_content for _, doc in batch],
+            metadatas=[doc.metadata for _, doc in batch],
+        )
+
+    def run(self, pdf_dir: str) -> int:
+        pdfs = sorted(Path(pdf_dir).glob("*.pdf"))
+        hashes = {pdf: file_sha256(pdf) for pdf in pdfs}
+        if not hashes:
+            # also keeps a wrong path from removing every ingested file.
+            raise Exception("No pdfs found in the directory")
+
+        self._removed_files(hashes)
+        pending = self._pending_files(hashes)
+        if not pending:
+            print("Vector store is up to date, nothing to ingest")
+            return 0
+
+        remaining: Dict[str, int] = {}  # batches not yet written, per file
+        chunk_counts: Dict[str, int] = {}
+        in_flight = set()
+        ingested = 0
+
+        def drain(return_when):
+            nonlocal in_flight
+            done, in_flight = wait(in_flight, return_when=return_when)
+            for future in done:
+                batch, vectors = future.result()
+                self._write(batch, vectors)
+                source_hash = batch[0][1].metadata["source_hash"]
+                name = batch[0][1].metadata["file_name"]
+                remaining[name] -= 1
+                if remaining[name] == 0:
+                    self.manifest.mark(name, source_hash, "done", chunk_counts[name])
+                    print(f"{name} ingested ({chunk_counts[name]} chunks)")
+
+        # spawn, forking after the store, index and cache connections are open
+        # is not safe (same as tools/pdf_loader).
+        parsers = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        with parsers, ThreadPoolExecutor(max_workers=self.max_inflight) as embedders:
+            parsed = [
+                parsers.submit(
+                    _parse_and_split,
+                    str(pdf),
+                    sha256,
+                    self.chunk_size,
+                    self.chunk_overlap,
+                )
+                for pdf, sha256 in pending
+            ]
+            for future in as_completed(parsed):
+                pdf, sha256, chunks = future.result()
+                name = Path(pdf).name
+                for doc in chunks:
+                    doc.metadata["file_name"] = name
+
+                ids = [f"{sha256}:{i}" for i in range(len(chunks))]
+                missing = self._missing(ids) if ids else set()
+                todo = [(i, doc) for i, doc in zip(ids, chunks) if i in missing]
+                batches = [
+                    todo[start : start + self.batch_size]
+                    for start in range(0, len(todo), self.batch_size)
+                ]
+
+                chunk_counts[name] = len(chunks)
+                if not batches:
+                    self.manifest.mark(name, sha256, "done", len(chunks))
+                    continue
+
+                remaining[name] = len(batches)
+                ingested += 1
+                for batch in batches:
+                    if len(in_flight) >= self.max_inflight:
+                        drain(FIRST_COMPLETED)
+                    in_flight.add(embedders.submit(self._embed, batch))
+
+            while in_flight:
+                drain(FIRST_COMPLETED)
+
+        return ingested
+
+
+def vector_store(pdf_dir: str, chroma_dir: str, **kwargs):
+    """
+    Function to fetch pdfs from a directory and store them in a local vector store in other directory.
+    Only new or changed PDFs are processed, removed ones are dropped, see `Ingester`.
+    """
+    config = get_section("ingest")
+    store_config = get_section("vector_store")
+    options = {
+        "model": store_config.get("embedding_model", "llama3.1:8b-instruct-q4_K_M"),
+        "backend": store_config.get("backend", "chroma"),
+        "dtype": store_config.get("numpy_dtype", "float16"),
+        "batch_size": int(config.get("batch_size", 64)),
+        "max_inflight": int(config.get("max_inflight", 2)),
+        "workers": int(config.get("workers", 4)),
+        "chunk_size": int(config.get("chunk_size", 1024)),
+        "chunk_overlap": int(config.get("chunk_overlap", 128)),
+    }
+    rebuild_bm25 = kwargs.pop("rebuild_bm25", False)
+    ivf_lists = kwargs.pop("ivf_lists", None)
+    if NumpyVectorStore.exists(chroma_dir):
+        # an existing store keeps its backend unless one is asked for.
+        options["backend"] = "numpy"
+    options.update({k: v for k, v in kwargs.items() if v is not None})
+
+    ingester = Ingester(chroma_dir, **options)
+    if rebuild_bm25:
+        indexed = ingester.bm25.rebuild_from(ingester.collection)
+        print(f"BM25 index rebuilt from {indexed} existing chunks")
+    ingested = ingester.run(pdf_dir)
+    if ivf_lists and isinstance(ingester.collection, NumpyVectorStore):
+        indexed = ingester.collection.build_ivf(ivf_lists)
+        print(f"IVF partition built: {indexed} vectors in {ivf_lists} lists")
 
     print(
-        f"Successfully ingested {len(documents)} documents into Chroma VS at {chroma_dir}"
+        f"Successfully ingested {ingested} documents into {options['backend']} VS at {chroma_dir}"
     )
 
     # ===================================================================
@@ -64,7 +350,36 @@ if __name__ == "__main__":
         "pdf_dir", type=str, help="path to the directory containing the PDFs"
     )
     parser.add_argument("chroma_dir", type=str, help="path to save the PDFs")
+    parser.add_argument("--batch-size", type=int, help="chunks per embedding request")
+    parser.add_argument(
+        "--max-inflight", type=int, help="embedding requests in flight at once"
+    )
+    parser.add_argument("--workers", type=int, help="processes parsing the PDFs")
+    parser.add_argument(
+        "--backend",
+        choices=["chroma", "numpy"],
+        help="vector store written to, numpy is a memory-mapped matrix",
+    )
+    parser.add_argument(
+        "--ivf-lists",
+        type=int,
+        help="numpy backend: build an IVF partition with this many lists",
+    )
+    parser.add_argument(
+        "--rebuild-bm25",
+        action="store_true",
+        help="rebuild the lexical index from the chunks already in the store",
+    )
 
     args = parser.parse_args()
 
-    vector_store(args.pdf_dir, args.chroma_dir)
+    vector_store(
+        args.pdf_dir,
+        args.chroma_dir,
+        batch_size=args.batch_size,
+        max_inflight=args.max_inflight,
+        workers=args.workers,
+        backend=args.backend,
+        ivf_lists=args.ivf_lists,
+        rebuild_bm25=args.rebuild_bm25,
+    )
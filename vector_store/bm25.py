@@ -0,0 +1,168 @@
+import os
+import math
+import sqlite3
+import threading
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from utils.context_packer import tokenize
+
+INDEX_NAME = "bm25.sqlite"
+
+
+class BM25Index:
+    """
+    Lexical inverted index over the ingested chunks, stored next to the Chroma
+    collection (`<chroma_dir>/bm25.sqlite`) and keyed by the same chunk ids.
+    Catches the exact model names and acronyms that dense search misses.
+    """
+
+    def __init__(self, chroma_dir: str, k1: float = 1.2, b: float = 0.75):
+        self.path = os.path.join(chroma_dir, INDEX_NAME)
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+
+        os.makedirs(chroma_dir, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS docs (
+                id TEXT PRIMARY KEY,
+                source_hash TEXT NOT NULL,
+                length INTEGER NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, doc_id)
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS docs_source ON docs (source_hash)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def exists(chroma_dir: str) -> bool:
+        return os.path.exists(os.path.join(chroma_dir, INDEX_NAME))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    # ------------------------- writes -------------------------
+    def add(self, ids: List[str], texts: List[str], source_hashes: List[str]):
+        """
+        Indexes (or re-indexes) chunks, idempotent for a given id.
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM postings WHERE doc_id = ?", [(i,) for i in ids]
+            )
+            for doc_id, text, source_hash in zip(ids, texts, source_hashes):
+                terms = Counter(tokenize(text))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO docs (id, source_hash, length) VALUES (?, ?, ?)",
+                    (doc_id, source_hash, sum(terms.values())),
+                )
+                self._conn.executemany(
+                    "INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)",
+                    [(term, doc_id, tf) for term, tf in terms.items()],
+                )
+
+    def delete_source(self, source_hash: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM postings WHERE doc_id IN "
+                "(SELECT id FROM docs WHERE source_hash = ?)",
+                (source_hash,),
+            )
+            self._conn.execute("DELETE FROM docs WHERE source_hash = ?", (source_hash,))
+
+    def rebuild_from(self, collection, page_size: int = 1000) -> int:
+        """
+        Builds the index from an existing Chroma collection, for stores that
+        were ingested before the lexical index existed.
+        """
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM docs")
+        total, offset = 0, 0
+        while True:
+            page = collection.get(
+                include=["documents", "metadatas"], limit=page_size, offset=offset
+            )
+            if not page["ids"]:
+                return total
+            self.add(
+                page["ids"],
+                page["documents"],
+                [(m or {}).get("source_hash", "") for m in page["metadatas"]],
+            )
+            total += len(page["ids"])
+            offset += page_size
+
+    # ------------------------- search -------------------------
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """
+        Returns the `k` best `(chunk id, score)` pairs for `query`.
+        """
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return []
+
+        placeholders = ",".join("?" * len(terms))
+        with self._lock:
+            total, avg_length = self._conn.execute(
+                "SELECT COUNT(*), AVG(length) FROM docs"
+            ).fetchone()
+            if not total:
+                return []
+            df: Dict[str, int] = dict(
+                self._conn.execute(
+                    f"SELECT term, COUNT(*) FROM postings WHERE term IN ({placeholders}) "
+                    "GROUP BY term",
+                    terms,
+                ).fetchall()
+            )
+            rows = self._conn.execute(
+                f"SELECT p.term, p.doc_id, p.tf, d.length FROM postings p "
+                f"JOIN docs d ON d.id = p.doc_id WHERE p.term IN ({placeholders})",
+                terms,
+            ).fetchall()
+
+        avg_length = avg_length or 1.0
+        scores: Dict[str, float] = {}
+        for term, doc_id, tf, length in rows:
+            idf = math.log(1 + (total - df[term] + 0.5) / (df[term] + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+            scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (
+                tf + norm
+            )
+        return sorted(scores.items(), key=lambda item: -item[1])[:k]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[str]:
+    """
+    Fuses several rankings of ids: every list adds `1 / (k + rank)` per id.
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda doc_id: -scores[doc_id])
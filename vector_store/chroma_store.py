@@ -0,0 +1,14 @@
+import chromadb
+
+# collection LangChain's Chroma wrapper creates by default, existing stores use it.
+COLLECTION_NAME = "langchain"
+
+
+def chroma_collection(chroma_dir: str, name: str = COLLECTION_NAME):
+    """
+    The persistent Chroma collection in `chroma_dir`, written by the ingestion
+    and queried by retrieval. Embeddings are always passed in, so the collection
+    has no embedding function of its own.
+    """
+    client = chromadb.PersistentClient(path=chroma_dir)
+    return client.get_or_create_collection(name=name, embedding_function=None)
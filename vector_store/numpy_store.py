@@ -0,0 +1,354 @@
+import os
+import json
+import sqlite3
+import threading
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+VECTORS_NAME = "vectors.bin"
+CHUNKS_NAME = "chunks.sqlite"
+IVF_NAME = "ivf.npz"
+BLOCK_ROWS = 1 << 16  # rows scored per matrix product in a full scan
+
+
+class NumpyVectorStore:
+    """
+    Read-mostly vector store: normalized embeddings appended to a raw
+    float16/float32 matrix (`vectors.bin`) that readers memory-map, plus a
+    SQLite side table with the chunk id, text and metadata of every row.
+    Every process serving queries maps the same page-cached file, so opening
+    the store costs nothing and queries are plain batched dot products.
+
+    Implements the subset of the Chroma collection API used by ingestion and
+    retrieval (`get`, `upsert`, `delete`, `query`, `count`), so it can be used
+    in place of `chroma_collection(...)`. Replaced or deleted rows are only
+    dropped from the side table, the matrix is append-only.
+    """
+
+    def __init__(self, directory: str, dtype: str = "float16", nprobe: int = 8):
+        self.directory = directory
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.vectors_path = os.path.join(directory, VECTORS_NAME)
+        self.ivf_path = os.path.join(directory, IVF_NAME)
+
+        self._conn = sqlite3.connect(
+            os.path.join(directory, CHUNKS_NAME), check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                row INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                source_hash TEXT NOT NULL,
+                document TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source_hash)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        self._conn.commit()
+
+        # the first store of a directory fixes its dtype, readers follow it.
+        meta = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+        self.dtype = np.dtype(meta.get("dtype", dtype))
+        self.dim = int(meta["dim"]) if "dim" in meta else 0
+
+        self._matrix = None
+        self._alive = None
+        self._version = None
+        self._ivf = None
+        self._ivf_mtime = None
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        return os.path.exists(os.path.join(directory, CHUNKS_NAME))
+
+    # ------------------------- helpers -------------------------
+    def _set_meta(self, key: str, value):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value))
+        )
+
+    def _bump_version(self):
+        # readers rebuild their row mask when this changes.
+        self._conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('version', '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+
+    def _rows_on_disk(self) -> int:
+        if not self.dim or not os.path.exists(self.vectors_path):
+            return 0
+        return os.path.getsize(self.vectors_path) // (self.dim * self.dtype.itemsize)
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def _refresh(self):
+        """
+        Remaps the matrix and the live-row mask if a writer changed the store.
+        """
+        if not self.dim:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+            self.dim = int(row[0]) if row else 0
+        version = self._conn.execute(
+            "SELECT value FROM meta WHERE key = 'version'"
+        ).fetchone()
+        rows = self._rows_on_disk()
+        if self._version == (version, rows):
+            return
+        if rows:
+            self._matrix = np.memmap(
+                self.vectors_path, dtype=self.dtype, mode="r", shape=(rows, self.dim)
+            )
+        else:
+            self._matrix = None
+        alive = np.zeros(rows, dtype=bool)
+        live_rows = [r for (r,) in self._conn.execute("SELECT row FROM chunks")]
+        alive[[r for r in live_rows if r < rows]] = True
+        self._alive = alive
+        self._version = (version, rows)
+
+    def _load_ivf(self):
+        if not os.path.exists(self.ivf_path):
+            self._ivf = None
+            return None
+        mtime = os.path.getmtime(self.ivf_path)
+        if self._ivf is None or self._ivf_mtime != mtime:
+            with np.load(self.ivf_path) as ivf:
+                self._ivf = {name: ivf[name] for name in ivf.files}
+            self._ivf_mtime = mtime
+        return self._ivf
+
+    def _records(self, rows: List[int]) -> Dict[int, tuple]:
+        if not rows:
+            return {}
+        placeholders = ",".join("?" * len(rows))
+        return {
+            row: (chunk_id, document, json.loads(metadata))
+            for row, chunk_id, document, metadata in self._conn.execute(
+                f"SELECT row, id, document, metadata FROM chunks WHERE row IN ({placeholders})",
+                [int(r) for r in rows],
+            )
+        }
+
+    # ------------------------- writes -------------------------
+    def upsert(
+        self,
+        ids: List[str],
+        embeddings: List[List[float]],
+        documents: List[str],
+        metadatas: List[Dict],
+    ):
+        vectors = self._normalize(embeddings)
+        with self._lock, self._conn:
+            if not self.dim:
+                self.dim = vectors.shape[1]
+                self._set_meta("dim", self.dim)
+                self._set_meta("dtype", self.dtype.name)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(
+                    f"Embedding size {vectors.shape[1]} does not match the store ({self.dim})"
+                )
+
+            # rows past the last committed one (a crashed append) are never live.
+            start = self._rows_on_disk()
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.astype(self.dtype).tobytes())
+
+            self._conn.executemany(
+                "DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in ids]
+            )
+            self._conn.executemany(
+                "INSERT INTO chunks (row, id, source_hash, document, metadata) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        start + i,
+                        chunk_id,
+                        (metadata or {}).get("source_hash", ""),
+                        document,
+                        json.dumps(metadata or {}),
+                    )
+                    for i, (chunk_id, document, metadata) in enumerate(
+                        zip(ids, documents, metadatas)
+                    )
+                ],
+            )
+            self._bump_version()
+
+    def delete(self, ids: List[str] = None, where: Dict = None):
+        with self._lock, self._conn:
+            if ids:
+                self._conn.executemany(
+                    "DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in ids]
+                )
+            if where:
+                if set(where) != {"source_hash"}:
+                    raise ValueError("Only `source_hash` filters are supported")
+                self._conn.execute(
+                    "DELETE FROM chunks WHERE source_hash = ?", (where["source_hash"],)
+                )
+            self._bump_version()
+
+    def build_ivf(self, n_lists: int, iterations: int = 10, sample: int = 50000) -> int:
+        """
+        Builds the IVF coarse partition (spherical k-means over the live rows),
+        queries then only scan the `nprobe` closest lists. Rows appended later
+        are scanned exhaustively until the next build.
+        """
+        with self._lock:
+            self._refresh()
+            rows = np.flatnonzero(self._alive) if self._alive is not None else []
+            if len(rows) < n_lists:
+                raise ValueError(f"{len(rows)} vectors are not enough for {n_lists} lists")
+
+            rng = np.random.default_rng(0)
+            train_rows = np.sort(rng.choice(rows, min(sample, len(rows)), replace=False))
+            train = self._matrix[train_rows].astype(np.float32)
+            centroids = train[rng.choice(len(train), n_lists, replace=False)]
+            for _ in range(iterations):
+                assign = np.argmax(train @ centroids.T, axis=1)
+                for j in range(n_lists):
+                    members = train[assign == j]
+                    centroids[j] = (
+                        members.sum(axis=0) if len(members) else train[rng.integers(len(train))]
+                    )
+                centroids = self._normalize(centroids)
+
+            assign = np.concatenate(
+                [
+                    np.argmax(
+                        self._matrix[rows[s : s + BLOCK_ROWS]].astype(np.float32)
+                        @ centroids.T,
+                        axis=1,
+                    )
+                    for s in range(0, len(rows), BLOCK_ROWS)
+                ]
+            )
+            order = np.argsort(assign, kind="stable")
+            offsets = np.searchsorted(assign[order], np.arange(n_lists + 1))
+
+            tmp_path = f"{self.ivf_path}.tmp.npz"
+            np.savez(
+                tmp_path,
+                centroids=centroids,
+                rows=rows[order],
+                offsets=offsets,
+                indexed_rows=np.array(self._matrix.shape[0]),
+            )
+            os.replace(tmp_path, self.ivf_path)
+            return len(rows)
+
+    # ------------------------- reads --------------------------
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def get(
+        self,
+        ids: List[str] = None,
+        include: List[str] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+    ) -> Dict[str, list]:
+        with self._lock:
+            if ids is not None:
+                if not ids:
+                    records = []
+                else:
+                    placeholders = ",".join("?" * len(ids))
+                    records = self._conn.execute(
+                        f"SELECT id, document, metadata FROM chunks WHERE id IN ({placeholders})",
+                        list(ids),
+                    ).fetchall()
+            else:
+                records = self._conn.execute(
+                    "SELECT id, document, metadata FROM chunks ORDER BY row LIMIT ? OFFSET ?",
+                    (-1 if limit is None else limit, offset or 0),
+                ).fetchall()
+        return {
+            "ids": [r[0] for r in records],
+            "documents": [r[1] for r in records],
+            "metadatas": [json.loads(r[2]) for r in records],
+        }
+
+    def _candidates(self, query: np.ndarray) -> Optional[np.ndarray]:
+        ivf = self._load_ivf()
+        if ivf is None:
+            return None
+        lists = np.argsort(-(ivf["centroids"] @ query))[: self.nprobe]
+        rows = [ivf["rows"][ivf["offsets"][j] : ivf["offsets"][j + 1]] for j in lists]
+        # rows appended since the partition was built.
+        rows.append(np.arange(int(ivf["indexed_rows"]), self._matrix.shape[0]))
+        return np.concatenate(rows)
+
+    def query(
+        self, query_embeddings: List[List[float]], n_results: int = 10, include=None
+    ) -> Dict[str, list]:
+        """
+        Top `n_results` rows by cosine similarity for every query vector.
+        """
+        queries = self._normalize(query_embeddings)
+        with self._lock:
+            self._refresh()
+            if self._matrix is None:
+                empty = [[] for _ in range(len(queries))]
+                return {"ids": empty, "documents": empty, "metadatas": empty}
+
+            hits = []
+            ivf = self._load_ivf()
+            if ivf is None:
+                # one pass over the matrix for all the queries.
+                scores = np.empty((self._matrix.shape[0], len(queries)), dtype=np.float32)
+                for s in range(0, self._matrix.shape[0], BLOCK_ROWS):
+                    block = self._matrix[s : s + BLOCK_ROWS].astype(np.float32)
+                    scores[s : s + BLOCK_ROWS] = block @ queries.T
+                scores[~self._alive] = -np.inf
+                for column in scores.T:
+                    hits.append(self._top(np.arange(len(column)), column, n_results))
+            else:
+                for query in queries:
+                    rows = self._candidates(query)
+                    rows = rows[self._alive[rows]]
+                    column = self._matrix[np.sort(rows)].astype(np.float32) @ query
+                    hits.append(self._top(np.sort(rows), column, n_results))
+
+            records = self._records(sorted({r for rows in hits for r in rows}))
+
+        results = {"ids": [], "documents": [], "metadatas": []}
+        for rows in hits:
+            rows = [r for r in rows if r in records]
+            results["ids"].append([records[r][0] for r in rows])
+            results["documents"].append([records[r][1] for r in rows])
+            results["metadatas"].append([records[r][2] for r in rows])
+        return results
+
+    @staticmethod
+    def _top(rows: np.ndarray, scores: np.ndarray, k: int) -> List[int]:
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [int(rows[i]) for i in best if np.isfinite(scores[i])]
+
+    def close(self):
+        with self._lock:
+            self._matrix = None
+            self._conn.close()